@@ -0,0 +1,94 @@
+"""
+Compare the JSON codecs on analytics files of realistic sizes.
+
+Run with `python benchmarks/codec_benchmark.py`. Files are generated in the
+shape of `sa2_data.json`: a per-day history plus widgets with per-value
+counters, scaled up by the number of days, widgets and values.
+"""
+
+import datetime
+import random
+import sys
+import timeit
+
+from streamlit_analytics2 import codec
+
+# Target file sizes in bytes.
+SIZES = [1_000, 100_000, 1_000_000, 10_000_000, 50_000_000]
+
+
+def _widgets(n_widgets, n_values, rng):
+    widgets = {}
+    for i in range(n_widgets):
+        if i % 4 == 0:
+            widgets[f"button {i}"] = rng.randrange(1000)
+        else:
+            widgets[f"selectbox {i}"] = {
+                f"option {j}": rng.randrange(1000) for j in range(n_values)
+            }
+    return widgets
+
+
+def make_data(size, seed=0):
+    """Return an analytics dict that encodes to roughly `size` bytes."""
+    rng = random.Random(seed)
+    n_days = 1
+    n_widgets, n_values = 4, 3
+    while True:
+        start = datetime.date(2020, 1, 1)
+        days = [str(start + datetime.timedelta(days=i)) for i in range(n_days)]
+        data = {
+            "loaded_from_firestore": False,
+            "total_pageviews": rng.randrange(10**6),
+            "total_script_runs": rng.randrange(10**6),
+            "total_time_seconds": rng.random() * 10**6,
+            "per_day": {
+                "days": days,
+                "pageviews": [rng.randrange(1000) for _ in days],
+                "script_runs": [rng.randrange(1000) for _ in days],
+                "session_time_seconds": [rng.random() * 1000 for _ in days],
+                "widgets": [_widgets(n_widgets, n_values, rng) for _ in days],
+            },
+            "widgets": _widgets(n_widgets, n_values, rng),
+        }
+        if len(codec.dumps(data)) >= size:
+            return data
+        # Grow the history first, then the number of widgets and values.
+        if n_days < 365:
+            n_days = min(365, n_days * 2)
+        else:
+            n_widgets *= 2
+            n_values = min(n_values + 1, 20)
+
+
+def _time(func, seconds=1.0):
+    number, total = timeit.Timer(func).autorange()
+    repeat = max(1, min(5, int(seconds / max(total, 1e-9))))
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main(sizes=SIZES):
+    backends = [name for name in codec.BACKENDS if _available(name)]
+    print(f"{'size':>10} {'codec':>8} {'dump ms':>10} {'load ms':>10}")
+    for size in sizes:
+        codec.use("json")
+        data = make_data(size)
+        raw = codec.dumps(data)
+        for name in backends:
+            codec.use(name)
+            dump = _time(lambda: codec.dumps(data))
+            load = _time(lambda: codec.load_data(raw))
+            print(f"{len(raw):>10} {name:>8} {dump * 1e3:>10.3f} {load * 1e3:>10.3f}")
+    codec.use()
+
+
+def _available(name):
+    try:
+        codec.use(name)
+        return True
+    except ImportError:
+        return False
+
+
+if __name__ == "__main__":
+    main([int(s) for s in sys.argv[1:]] or SIZES)
@@ -0,0 +1,112 @@
+"""
+Measure the per-call overhead of the patched widgets as coverage grows.
+
+Run with `python benchmarks/widget_benchmark.py`. N no-op widget methods are
+added to DeltaGenerator, registered as button-like widgets and patched with
+`widgets.monkey_patch`, so a call goes through the same dispatch, timing
+(`wrappers._instrumented`) and counting as st.button does. One more no-op is
+patched with a wrapper that only calls through, which times the dispatch and
+timing on their own. The overhead is the time of a call on `st._main` minus
+a direct call of the no-op:
+
+- dispatch: the call-through widget of a tracked session,
+- first, last: the first and the last button-like widget of a tracked
+  session, i.e. dispatch plus counting,
+- untracked: the last one of an untracked session, which calls straight
+  through.
+
+Outside `streamlit run`, st.session_state is slower than in an app, but the
+wrappers only touch it through `state.use_state_dict` here as they do there.
+"""
+
+import logging
+import sys
+import timeit
+
+import streamlit as st
+from streamlit.delta_generator import DeltaGenerator
+
+from streamlit_analytics2 import metrics, state, widgets, wrappers
+
+# Numbers of registered widgets.
+COVERAGE = [10, 100, 1_000, 10_000]
+
+DISPATCH = "sa2_benchmark_dispatch"
+
+
+def _noop(self, label, *args, **kwargs):
+    return False
+
+
+def _names(n):
+    return [f"sa2_benchmark_{i}" for i in range(n)]
+
+
+@wrappers._instrumented
+def _call_through(func):
+    return func
+
+
+def patch(n):
+    """
+    Add and patch `n` button-like widgets and the `DISPATCH` widget, see
+    `unpatch`.
+    """
+    widgets.KINDS[DISPATCH] = _call_through
+    for name in _names(n) + [DISPATCH]:
+        setattr(DeltaGenerator, name, _noop)
+        widgets.register(name, DISPATCH if name == DISPATCH else "event")
+    widgets.monkey_patch()
+
+
+def unpatch(n):
+    """Restore streamlit and forget the widgets `patch` added."""
+    widgets.reset_widgets()
+    for name in _names(n) + [DISPATCH]:
+        widgets.REGISTRY.pop(name)
+        widgets._originals.pop(name, None)
+        delattr(DeltaGenerator, name)
+    widgets.KINDS.pop(DISPATCH)
+    widgets._built["key"] = None
+
+
+def _time(func, seconds=1.0):
+    number, total = timeit.Timer(func).autorange()
+    # The minimum of several repeats, as other processes add noise.
+    repeat = max(5, min(15, int(seconds / max(total, 1e-9))))
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main(coverage=COVERAGE):
+    # Outside `streamlit run`, every st.session_state access warns.
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    for name in logging.root.manager.loggerDict:
+        if name.startswith("streamlit."):
+            logging.getLogger(name).setLevel(logging.ERROR)
+    dg = st._main
+    baseline = _time(lambda: _noop(dg, "label"))
+    print(f"direct call: {baseline * 1e9:.0f} ns")
+    columns = ["dispatch ns", "first ns", "last ns", "untracked ns"]
+    print(f"{'widgets':>8}" + "".join(f"{c:>14}" for c in columns))
+    # The button wrapper keeps the returned state per label.
+    state.use_state_dict({})
+    metrics.start_run()
+    for n in coverage:
+        patch(n)
+        try:
+            dispatch = getattr(dg, DISPATCH)
+            first = getattr(dg, "sa2_benchmark_0")
+            last = getattr(dg, f"sa2_benchmark_{n - 1}")
+            state.set_tracked(True)
+            times = [_time(lambda: f("label")) for f in [dispatch, first, last]]
+            state.set_tracked(False)
+            times.append(_time(lambda: last("label")))
+        finally:
+            state.set_tracked(False)
+            unpatch(n)
+        print(f"{n:>8}" + "".join(f"{(t - baseline) * 1e9:>14.0f}" for t in times))
+    state.use_state_dict(None)
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or COVERAGE)
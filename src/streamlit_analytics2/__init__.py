@@ -5,6 +5,7 @@ Track & visualize user interactions with your streamlit app.
 
 from .main import (  # noqa: F401
     delete_session_data,
+    delete_sessions_data,
     start_tracking,
     stop_tracking,
     track,
@@ -0,0 +1,158 @@
+"""
+Incrementally maintained aggregates of the widget counts for the dashboard.
+
+A `state.record` observer keeps, as counts change, the total interactions per
+widget, a ranking of the most used widgets and the most selected values per
+widget, each in an indexed `TopN`. Counts only grow between two loads, so a
+value can only enter a top N by passing its smallest count and the structure
+stays exact without looking at the other values. The dashboard renders from
+`current()` in O(N) per widget instead of sorting every value on each open.
+
+The observer is registered the first time the dashboard asks for the
+aggregates, with a full scan of `data`. Code that changes the counts without
+`record`, e.g. loading or merging data, calls `invalidate` to scan again.
+"""
+
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from .state import data, observers
+
+# Widgets in the ranking and values shown per widget.
+TOP_N = 20
+
+
+class TopN:
+    """The `n` largest counts, sorted, with an index of their positions."""
+
+    __slots__ = ("n", "items", "index")
+
+    def __init__(self, n: int = TOP_N):
+        self.n = n
+        # [count, key], largest count first.
+        self.items: List[List[Any]] = []
+        self.index: Dict[Hashable, int] = {}
+
+    def update(self, key: Hashable, count: float):
+        """Note that `key` reached `count`, which never decreases."""
+        items, index = self.items, self.index
+        i = index.get(key)
+        if i is None:
+            if len(items) < self.n:
+                items.append([count, key])
+            elif count > items[-1][0]:
+                del index[items[-1][1]]
+                items[-1] = [count, key]
+            else:
+                return
+            i = len(items) - 1
+        else:
+            items[i][0] = count
+        # Move up past the smaller counts, like one step of insertion sort.
+        while i > 0 and items[i - 1][0] < count:
+            items[i] = items[i - 1]
+            index[items[i][1]] = i
+            i -= 1
+        items[i] = [count, key]
+        index[key] = i
+
+    def top(self) -> List[Tuple[Hashable, Any]]:
+        """`(key, count)` pairs, largest count first."""
+        return [(key, count) for count, key in self.items]
+
+
+_lock = threading.Lock()
+_state: Dict[str, Any] = {
+    # The widgets dict the aggregates were built from, None to rebuild.
+    "widgets": None,
+    "totals": {},
+    "ranking": TopN(),
+    "values": {},
+}
+
+
+def invalidate():
+    """Scan the counts again next time, e.g. after they changed in place."""
+    with _lock:
+        _state["widgets"] = None
+
+
+def _total(counts: Any) -> float:
+    return sum(counts.values()) if isinstance(counts, dict) else counts
+
+
+def _rebuild():
+    widgets = data["widgets"]
+    totals: Dict[str, float] = {}
+    ranking = TopN()
+    values: Dict[str, TopN] = {}
+    for label, counts in widgets.copy().items():
+        totals[label] = _total(counts)
+        ranking.update(label, totals[label])
+        if isinstance(counts, dict):
+            top = values[label] = TopN()
+            for value, count in counts.copy().items():
+                top.update(value, count)
+    _state.update(widgets=widgets, totals=totals, ranking=ranking, values=values)
+
+
+def _observe(day: str, key: tuple, amount: float = 1):
+    """`state.record` observer that updates the aggregates."""
+    if key[0] != "widgets":
+        return
+    with _lock:
+        widgets = _state["widgets"]
+        if widgets is None or widgets is not data["widgets"]:
+            return
+        label = key[1]
+        total = _state["totals"].get(label, 0) + amount
+        _state["totals"][label] = total
+        _state["ranking"].update(label, total)
+        if len(key) == 3 and isinstance(widgets.get(label), dict):
+            if label not in _state["values"]:
+                _state["values"][label] = TopN()
+            _state["values"][label].update(key[2], widgets[label].get(key[2], 0))
+
+
+def current() -> Dict[str, Any]:
+    """
+    Return the aggregates of `data`.
+
+    `totals` maps every counted widget to its interactions, `ranking` lists
+    the `TOP_N` most used widgets and `values` the most selected values per
+    widget, as `(key, count)` pairs with the largest count first.
+    """
+    with _lock:
+        if _observe not in observers:
+            observers.append(_observe)
+        if _state["widgets"] is None or _state["widgets"] is not data["widgets"]:
+            _rebuild()
+        return {
+            "totals": dict(_state["totals"]),
+            "ranking": _state["ranking"].top(),
+            "values": {label: top.top() for label, top in _state["values"].items()},
+        }
+
+
+def top_values(
+    aggregated: Dict[str, Any],
+    label: str,
+    counts: Dict[Any, Any],
+    n: Optional[int] = None,
+) -> List[Tuple[Any, Any]]:
+    """
+    The `n` (default `TOP_N`) most selected values of widget `label`.
+
+    Values that were never selected fill up the list from `counts`, in their
+    order. Every counted value is in the top N unless it is full, so this
+    looks at no more than 2n values.
+    """
+    n = TOP_N if n is None else n
+    rows: List[Tuple[Any, Any]] = aggregated["values"].get(label, [])[:n]
+    shown = {value for value, _ in rows}
+    for value, count in counts.items():
+        if len(rows) >= n:
+            break
+        if value not in shown:
+            rows.append((value, count))
+    return rows
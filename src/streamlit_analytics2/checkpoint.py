@@ -0,0 +1,234 @@
+"""
+Binary checkpoints of the analytics data for fast restarts.
+
+A checkpoint file is laid out as
+
+    magic (8 bytes) | version (uint16) | header length (uint32) | header | body
+
+The header is JSON with the time the checkpoint was taken, the `save_seq` of
+the data (see `_restore_checkpoint` in `main.py`) and an offset table
+`{section: [offset, length, encoding]}` into the body. The history columns
+are stored as the raw bytes of their typed arrays (see `columnar.py`), all
+other data as one msgpack section (JSON if msgspec is not installed). On
+load, the file is memory-mapped and every column is restored with a single
+copy of its bytes, without parsing.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+from . import codec, columnar, schema
+from .state import history_lock
+
+MAGIC = b"SA2CKPT\0"
+VERSION = 1
+# Default seconds between two checkpoints.
+INTERVAL = 60.0
+
+_PREFIX = struct.Struct("<8sHI")
+# Sections start at multiples of this, so columns can be viewed in place.
+_ALIGN = 8
+
+
+def _msgpack():
+    try:
+        import msgspec
+
+        return "msgpack", msgspec.msgpack.encode, msgspec.msgpack.decode
+    except ImportError:
+        return "json", codec.dumps, codec.loads
+
+
+def _encode(d: Dict[str, Any]) -> Tuple[str, bytes]:
+    encoding, encode, _ = _msgpack()
+    try:
+        return encoding, encode(d)
+    except TypeError:
+        # e.g. widget values msgpack cannot use as keys.
+        return "json", codec.dumps(d)
+
+
+def _decode(encoding: str, raw: Any) -> Any:
+    if encoding == "msgpack":
+        return _msgpack()[2](raw)
+    return codec.loads(bytes(raw))
+
+
+def dumps(data: Dict[str, Any], saved_at: Optional[float] = None) -> bytes:
+    """Encode `data` as a checkpoint taken at `saved_at` (default now)."""
+    sections: Dict[str, Tuple[str, bytes]] = {}
+    rest = {}
+    for key, value in data.items():
+        if isinstance(value, columnar.PerDay):
+            for name, column in value.columns().items():
+                sections[f"{key}.{name}"] = (column.typecode, column.tobytes())
+            sections[f"{key}.widgets"] = _encode({"widgets": value["widgets"]})
+            rest[f"{key}.extra"] = value.extra()
+        else:
+            rest[key] = value
+    sections["data"] = _encode(rest)
+
+    table = {}
+    body = bytearray()
+    for name, (encoding, raw) in sections.items():
+        body += b"\0" * (-len(body) % _ALIGN)
+        table[name] = [len(body), len(raw), encoding]
+        body += raw
+    header = json.dumps(
+        {
+            "saved_at": time.time() if saved_at is None else saved_at,
+            "save_seq": data.get("save_seq", 0),
+            "byteorder": sys.byteorder,
+            "sections": table,
+        }
+    ).encode()
+    header += b" " * (-(_PREFIX.size + len(header)) % _ALIGN)
+    return _PREFIX.pack(MAGIC, VERSION, len(header)) + header + bytes(body)
+
+
+def _header(buffer: Any) -> Tuple[Dict[str, Any], int]:
+    magic, version, length = _PREFIX.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("Not a streamlit-analytics2 checkpoint")
+    if version != VERSION:
+        raise ValueError(f"Unsupported checkpoint version {version}")
+    start = _PREFIX.size
+    end = start + length
+    return json.loads(bytes(buffer[start:end])), end
+
+
+def loads(buffer: Any) -> Tuple[float, Dict[str, Any]]:
+    """
+    Decode a checkpoint from `buffer`, e.g. bytes or a memory map.
+
+    Returns
+    -------
+    Tuple[float, Dict[str, Any]]
+        The time the checkpoint was taken and the data.
+    """
+    header, base = _header(buffer)
+    view = memoryview(buffer)
+
+    def section(name):
+        offset, length, encoding = header["sections"][name]
+        start = base + offset
+        end = start + length
+        return encoding, view[start:end]
+
+    data = _decode(*section("data"))
+    for key in columnar.HISTORY_KEYS:
+        extra = data.pop(f"{key}.extra", None)
+        if f"{key}.days" not in header["sections"]:
+            continue
+        columns = {}
+        for name in columnar.TYPECODES:
+            typecode, raw = section(f"{key}.{name}")
+            column = array(typecode)
+            column.frombytes(raw)
+            if header["byteorder"] != sys.byteorder:
+                column.byteswap()
+            columns[name] = column
+        widgets = _decode(*section(f"{key}.widgets"))["widgets"]
+        data[key] = columnar.PerDay.from_columns(columns, widgets, extra)
+    view.release()
+    return header["saved_at"], schema.upgrade(data)
+
+
+def _read_header(path: Union[str, Path]) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            prefix = f.read(_PREFIX.size)
+            header = f.read(_PREFIX.unpack(prefix)[2])
+    except (OSError, struct.error):
+        return None
+    parsed: Dict[str, Any] = json.loads(header)
+    return parsed
+
+
+def saved_at(path: Union[str, Path]) -> Optional[float]:
+    """When the checkpoint at `path` was taken, None if there is none."""
+    header = _read_header(path)
+    return None if header is None else header["saved_at"]
+
+
+def save_seq(path: Union[str, Path]) -> Optional[int]:
+    """The `save_seq` of the data in the checkpoint at `path`, None if none."""
+    header = _read_header(path)
+    return None if header is None else header.get("save_seq", 0)
+
+
+def load(path: Union[str, Path]) -> Tuple[float, Dict[str, Any]]:
+    """Memory-map and decode the checkpoint at `path`, see `loads`."""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return loads(mapped)
+
+
+def save(path: Union[str, Path], data: Dict[str, Any]) -> int:
+    """
+    Atomically write a checkpoint of `data` to `path`.
+
+    Returns
+    -------
+    int
+        Number of bytes written.
+    """
+    with history_lock:
+        raw = dumps(data)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(raw)
+    os.replace(tmp, path)
+    return len(raw)
+
+
+_lock = threading.Lock()
+_last: Dict[str, float] = {}
+_timers: Dict[str, threading.Timer] = {}
+
+
+def _save_logged(path: Union[str, Path], data: Dict[str, Any]):
+    try:
+        save(path, data)
+    except (OSError, RuntimeError, TypeError) as e:
+        # RuntimeError if another thread changed the data while encoding, the
+        # next checkpoint catches up.
+        logging.warning(f"SA2: Could not write checkpoint {path}: {e}")
+
+
+def _deferred(path: Union[str, Path], data: Dict[str, Any]):
+    with _lock:
+        _timers.pop(str(path), None)
+        _last[str(path)] = time.monotonic()
+    _save_logged(path, data)
+
+
+def periodic(path: Union[str, Path], data: Dict[str, Any], interval: float = INTERVAL):
+    """
+    Checkpoint `data` to `path` at most every `interval` seconds.
+
+    A call within the interval schedules a checkpoint for its end instead, so
+    the last changes are written once the app goes idle.
+    """
+    key = str(path)
+    with _lock:
+        wait = _last.get(key, -interval) + interval - time.monotonic()
+        if wait > 0:
+            if key not in _timers:
+                timer = threading.Timer(wait, _deferred, (path, data))
+                timer.daemon = True
+                _timers[key] = timer
+                timer.start()
+            return
+        _last[key] = time.monotonic()
+    _save_logged(path, data)
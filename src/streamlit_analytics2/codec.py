@@ -0,0 +1,141 @@
+"""
+JSON encoding and decoding for the analytics data.
+
+msgspec or orjson are used when installed (the `fast` extra), the standard
+library otherwise.
+With msgspec, `load_data` decodes the analytics file against the `Data`
+schema below, which validates it while decoding instead of afterwards.
+"""
+
+import json
+from typing import Any, Callable, Dict, List, Optional, TypedDict, Union
+
+from .columnar import to_jsonable
+
+# Counts are ints, but data written by older versions, merged or replayed
+# from a journal may hold floats, which must not fail the load.
+Count = Union[int, float]
+
+# Counter for widgets without values, or counters per value.
+Widget = Union[Count, Dict[str, Count]]
+
+
+class History(TypedDict, total=False):
+    days: List[str]
+    pageviews: List[Count]
+    script_runs: List[Count]
+    session_time_seconds: List[float]
+    widgets: List[Dict[str, Widget]]
+
+
+class Data(TypedDict, total=False):
+    loaded_from_firestore: bool
+    total_pageviews: Count
+    total_script_runs: Count
+    total_time_seconds: float
+    per_day: History
+    per_week: History
+    per_month: History
+    widgets: Dict[str, Widget]
+    start_time: str
+    # See `schema.py`.
+    schema_version: int
+    # See `checkpoint.py`.
+    save_seq: int
+    # See `replicas.py`.
+    replica_id: str
+    # See `sampling.py`.
+    sample_rates: Dict[str, float]
+    # See `journal.py`.
+    journal: Dict[str, int]
+    # See `sketches.py`.
+    sketches: Dict[str, Dict[str, Any]]
+    # See `latency.py`.
+    latency: Dict[str, Any]
+    # See `uploads.py`.
+    uploads: Dict[str, Dict[str, Any]]
+    # Only in dictionary-encoded files, see `interning.encode`.
+    strings: List[str]
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, default=to_jsonable).encode()
+
+
+def _json():
+    return "json", _json_dumps, json.loads, json.loads
+
+
+def _orjson():
+    import orjson
+
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=to_jsonable, option=options)
+
+    return "orjson", dumps, orjson.loads, orjson.loads
+
+
+def _msgspec():
+    import msgspec
+
+    encoder = msgspec.json.Encoder(enc_hook=to_jsonable)
+    decoder = msgspec.json.Decoder()
+    data_decoder = msgspec.json.Decoder(Data)
+    return "msgspec", encoder.encode, decoder.decode, data_decoder.decode
+
+
+BACKENDS: Dict[str, Callable] = {
+    "msgspec": _msgspec,
+    "orjson": _orjson,
+    "json": _json,
+}
+
+name: str = "json"
+_dumps = _json_dumps
+_loads: Callable[[Any], Any] = json.loads
+_load_data: Callable[[Any], Dict[str, Any]] = json.loads
+
+
+def use(backend: Optional[str] = None) -> str:
+    """
+    Switch to `backend`, or the fastest installed one if None.
+
+    Returns
+    -------
+    str
+        Name of the backend in use.
+    """
+    global name, _dumps, _loads, _load_data
+    names = list(BACKENDS) if backend is None else [backend]
+    for candidate in names:
+        try:
+            name, _dumps, _loads, _load_data = BACKENDS[candidate]()
+            return name
+        except ImportError:
+            if backend is not None:
+                raise
+    return name
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode `obj` as JSON bytes."""
+    try:
+        return _dumps(obj)
+    except TypeError:
+        # e.g. widget values of a type the fast encoders reject as keys.
+        return _json_dumps(obj)
+
+
+def loads(raw: Union[str, bytes]) -> Any:
+    """Decode JSON from `raw` without a schema, e.g. credentials."""
+    return _loads(raw)
+
+
+def load_data(raw: Union[str, bytes]) -> Dict[str, Any]:
+    """Decode an analytics file, validated against `Data` with msgspec."""
+    return _load_data(raw)
+
+
+use()
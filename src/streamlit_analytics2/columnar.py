@@ -0,0 +1,298 @@
+"""
+Compact columnar storage for the per-day history.
+
+`PerDay` keeps `days` as epoch days in an int32 array and the metrics in typed
+arrays instead of Python lists of boxed numbers. It behaves like the
+`{"days": [...], "pageviews": [...], ...}` dict it replaces, serializes back
+to that shape with `to_dict()` and hands pandas zero-copy views with
+`to_numpy()`.
+"""
+
+import bisect
+import datetime
+from array import array
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+
+_EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+# Column name -> array typecode.
+TYPECODES = {
+    "days": "i",
+    "pageviews": "q",
+    "script_runs": "q",
+    "session_time_seconds": "d",
+}
+
+HISTORY_KEYS = ["per_day", "per_week", "per_month"]
+
+
+def _to_epoch(day: str) -> int:
+    return datetime.date.fromisoformat(day).toordinal() - _EPOCH
+
+
+def _from_epoch(day: int) -> str:
+    return str(datetime.date.fromordinal(day + _EPOCH))
+
+
+def _typed(typecode: str, values) -> array:
+    try:
+        return array(typecode, values)
+    except TypeError:
+        # e.g. counts that were stored as floats by another tool.
+        cast = float if typecode == "d" else int
+        return array(typecode, (cast(v) for v in values))
+
+
+def _misaligned(name: str, n: int, days: int) -> str:
+    return (
+        f"History column {name} has {n} entries for {days} days, "
+        "upgrade the data with schema.upgrade first"
+    )
+
+
+class _Days:
+    """List-like view that shows the epoch-day array as ISO date strings."""
+
+    def __init__(self, history: "PerDay"):
+        self._history = history
+
+    @property
+    def _array(self) -> array:
+        return self._history._columns["days"]
+
+    def __len__(self) -> int:
+        return len(self._array)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [_from_epoch(day) for day in self._array[i]]
+        return _from_epoch(self._array[i])
+
+    def __setitem__(self, i: int, day: str):
+        self._array[i] = _to_epoch(day)
+
+    def __delitem__(self, i):
+        self._history._resize("days", lambda a: a.__delitem__(i))
+
+    def __iter__(self) -> Iterator[str]:
+        return (_from_epoch(day) for day in self._array)
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def append(self, day: str):
+        self._history._resize("days", lambda a: a.append(_to_epoch(day)))
+
+    def insert(self, i: int, day: str):
+        self._history._resize("days", lambda a: a.insert(i, _to_epoch(day)))
+
+
+class PerDay(MutableMapping):
+    """
+    Columnar replacement for a `per_day`-shaped dict.
+
+    Metric columns are `array.array` objects, so `[-1] += 1` works as on a
+    list. Rows should be added and removed with `append_day`, `insert_day`
+    and `delete_front`, which keep the columns aligned and cope with views
+    handed out by `to_numpy`. `widgets` stays a list of dicts. Unknown keys
+    are kept as they are.
+    """
+
+    def __init__(self, history: Optional[Dict[str, Any]] = None):
+        history = dict(history or {})
+        days = history.pop("days", [])
+        self._columns: Dict[str, array] = {
+            "days": array("i", (_to_epoch(day) for day in days))
+        }
+        for name, typecode in TYPECODES.items():
+            if name == "days":
+                continue
+            values = history.pop(name, None)
+            if values is None:
+                values = [0] * len(days)
+            elif len(values) != len(days):
+                raise ValueError(_misaligned(name, len(values), len(days)))
+            self._columns[name] = _typed(typecode, values)
+        widgets = history.pop("widgets", None)
+        if widgets is None:
+            widgets = [{} for _ in days]
+        elif len(widgets) != len(days):
+            raise ValueError(_misaligned("widgets", len(widgets), len(days)))
+        self._widgets: List[Dict[str, Any]] = list(widgets)
+        self._extra = history
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: Dict[str, array],
+        widgets: List[Dict[str, Any]],
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> "PerDay":
+        """Wrap typed `columns` as returned by `columns()`, without converting."""
+        history = cls()
+        for name, typecode in TYPECODES.items():
+            if columns[name].typecode != typecode:
+                raise ValueError(f"Column {name} must have typecode {typecode}")
+            history._columns[name] = columns[name]
+        history._widgets = widgets
+        history._extra = dict(extra or {})
+        return history
+
+    def columns(self) -> Dict[str, array]:
+        """The typed arrays, `days` as epoch days."""
+        return dict(self._columns)
+
+    def extra(self) -> Dict[str, Any]:
+        """Keys other than the columns and `widgets`."""
+        return dict(self._extra)
+
+    def _resize(self, name: str, op):
+        """
+        Apply a resizing `op` to column `name`.
+
+        Arrays cannot be resized while pandas holds a view on them, in that
+        case the column is copied and the view keeps the old buffer.
+        """
+        try:
+            op(self._columns[name])
+        except BufferError:
+            column = array(self._columns[name].typecode, self._columns[name])
+            op(column)
+            self._columns[name] = column
+
+    def append_day(self, day: str):
+        """Append an empty row for `day`."""
+        self.insert_day(len(self._columns["days"]), day)
+
+    def insert_day(self, i: int, day: str):
+        """Insert an empty row for `day` at position `i`."""
+        for name in TYPECODES:
+            value = _to_epoch(day) if name == "days" else 0
+            self._resize(name, lambda a: a.insert(i, value))
+        self._widgets.insert(i, {})
+
+    def delete_front(self, k: int):
+        """Remove the `k` oldest rows."""
+        for name in TYPECODES:
+            self._resize(name, lambda a: a.__delitem__(slice(0, k)))
+        del self._widgets[:k]
+
+    def __getitem__(self, key: str):
+        if key == "days":
+            return _Days(self)
+        if key in self._columns:
+            return self._columns[key]
+        if key == "widgets":
+            return self._widgets
+        return self._extra[key]
+
+    def __setitem__(self, key: str, value):
+        if key == "days":
+            self._columns["days"] = array("i", (_to_epoch(day) for day in value))
+        elif key in TYPECODES:
+            self._columns[key] = _typed(TYPECODES[key], value)
+        elif key == "widgets":
+            self._widgets = list(value)
+        else:
+            self._extra[key] = value
+
+    def __delitem__(self, key: str):
+        if key in TYPECODES or key == "widgets":
+            raise KeyError(f"Column {key} cannot be removed")
+        del self._extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._columns
+        yield "widgets"
+        yield from self._extra
+
+    def __len__(self) -> int:
+        return len(self._columns) + 1 + len(self._extra)
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the history in the JSON/Firestore list-of-values shape."""
+        result: Dict[str, Any] = {"days": list(self["days"])}
+        for name in TYPECODES:
+            if name != "days":
+                result[name] = self._columns[name].tolist()
+        result["widgets"] = self._widgets
+        result.update(self._extra)
+        return result
+
+    def to_numpy(self) -> Dict[str, np.ndarray]:
+        """
+        Return the columns as numpy arrays, e.g. for `pd.DataFrame(...,
+        copy=False)`.
+
+        The metric columns are read-only views on the underlying arrays, only
+        the `days` column is materialized as `datetime64`.
+        """
+        columns = {
+            "days": np.frombuffer(self._columns["days"], dtype=np.int32).astype(
+                "datetime64[D]"
+            )
+        }
+        for name in TYPECODES:
+            if name != "days":
+                view = np.frombuffer(
+                    self._columns[name], dtype=self._columns[name].typecode
+                )
+                view.flags.writeable = False
+                columns[name] = view
+        return columns
+
+    def nbytes(self) -> int:
+        """Size of the array buffers in bytes."""
+        return sum(a.itemsize * len(a) for a in self._columns.values())
+
+
+def adopt(d: Dict[str, Any]):
+    """Convert the history dicts in `d` to `PerDay`, see `schema.upgrade`."""
+    for key in HISTORY_KEYS:
+        if key in d and not isinstance(d[key], PerDay):
+            d[key] = PerDay(d[key])
+
+
+def _add_widgets(target: Dict[Any, Any], other: Dict[Any, Any]):
+    for label, counts in other.items():
+        if isinstance(counts, dict):
+            values = target.setdefault(label, {})
+            if isinstance(values, dict):
+                for value, n in counts.items():
+                    values[value] = values.get(value, 0) + n
+        elif not isinstance(target.get(label, 0), dict):
+            target[label] = target.get(label, 0) + counts
+
+
+def add_history(target: PerDay, other: Union[PerDay, Dict[str, Any]]):
+    """Add the counts of history `other` to `target`, row by row per day."""
+    if not isinstance(other, PerDay):
+        other = PerDay(other)
+    for i, day in enumerate(other["days"]):
+        j = bisect.bisect_left(target["days"], day)
+        if j == len(target["days"]) or target["days"][j] != day:
+            target.insert_day(j, day)
+        for name in TYPECODES:
+            if name != "days":
+                target[name][j] += other[name][i]
+        _add_widgets(target["widgets"][j], other["widgets"][i])
+
+
+def to_jsonable(obj: Any) -> Any:
+    """`default` hook for `json.dump` that handles the columnar types."""
+    if isinstance(obj, PerDay):
+        return obj.to_dict()
+    if isinstance(obj, array):
+        return obj.tolist()
+    if isinstance(obj, _Days):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
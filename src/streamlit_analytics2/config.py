@@ -4,6 +4,8 @@ from pathlib import Path
 import streamlit as st
 import toml
 
+from . import metrics
+
 # import logging
 
 # Set up logging
@@ -212,3 +214,16 @@ def show_config():
             st.success("Configuration reset to defaults!")
             new_config = DEFAULT_CONFIG
             st.rerun()
+
+    # Cost of the tracking itself, see `metrics.py`.
+    st.subheader("Tracking overhead")
+    samples = metrics.snapshot()
+    if samples:
+        st.dataframe(
+            {"metric": list(samples), "value": list(samples.values())},
+            hide_index=True,
+        )
+        with st.expander("OpenMetrics"):
+            st.code(metrics.render(), language="text")
+    else:
+        st.write("Nothing measured yet.")
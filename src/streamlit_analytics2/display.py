@@ -2,13 +2,100 @@
 Displays the analytics results within streamlit.
 """
 
+import datetime
+
 import altair as alt
 import pandas as pd
 import streamlit as st
 
-from . import utils
+from . import aggregates, columnar, latency, sampling, sketches, uploads, utils
 from .state import data, session_data  # noqa: F401
 
+# Shown for widgets whose values are kept in a quantile sketch.
+PERCENTILES = [5, 25, 50, 75, 95, 99]
+
+_TRAFFIC = ["pageviews", "script_runs", "session_time_seconds"]
+
+
+def _history_frame(data):  # noqa: F811
+    """Per-day history with the rolled-up weekly and monthly buckets in front."""
+    frames = []
+    for key in ["per_month", "per_week", "per_day"]:
+        history = data.get(key)
+        if history is None or len(history["days"]) == 0:
+            continue
+        if not isinstance(history, columnar.PerDay):
+            history = columnar.PerDay(history)
+        frames.append(pd.DataFrame(history.to_numpy(), copy=False))
+    if len(frames) == 1:
+        # Only per-day history, keep the zero-copy views.
+        return frames[0]
+    return pd.concat(frames, ignore_index=True)
+
+
+# Key and result of the last `_sample_rates`.
+_rates_cache = {"key": None, "value": None}
+
+
+def _sample_rates(data):  # noqa: F811
+    """
+    Effective sample rates of the traffic totals and of each widget's total.
+
+    The rate of each history row is weighted by what was counted on it, see
+    `sampling.py`. Totals without history are scaled by today's rate. Widgets
+    without a rate of their own are scaled by today's rate as well.
+    """
+    rates = data.get("sample_rates", {})
+    if all(rate >= 1 for rate in rates.values()):
+        # Never sampled, no need to look at the history.
+        return 1.0, dict.fromkeys(_TRAFFIC, 1.0)
+    # Computed once per save, the weights hardly change in between.
+    key = (
+        data.get("save_seq", 0),
+        str(datetime.date.today()),
+        tuple(sorted(rates.items())),
+    )
+    if _rates_cache["key"] != key:
+        _rates_cache["value"] = _weighted_rates(data, rates)
+        _rates_cache["key"] = key
+    return _rates_cache["value"]
+
+
+def _weighted_rates(data, rates):  # noqa: F811
+    today = sampling.rate_on(rates, str(datetime.date.today()))
+    traffic = {name: [] for name in _TRAFFIC}
+    widgets = {}
+    for key in columnar.HISTORY_KEYS:
+        history = data.get(key)
+        if not history:
+            continue
+        for i, day in enumerate(history["days"]):
+            rate = sampling.rate_on(rates, day)
+            for name, counts in traffic.items():
+                counts.append((history[name][i], rate))
+            for label, value in history["widgets"][i].items():
+                count = sum(value.values()) if isinstance(value, dict) else value
+                widgets.setdefault(label, []).append((count, rate))
+    effective = {
+        name: sampling.effective_rate(counts, today)
+        for name, counts in {**traffic, **widgets}.items()
+    }
+    return today, effective
+
+
+def _scaled_history(df, rates):
+    """The history frame `df` with each day's counts scaled by its sample rate."""
+    scale = [1 / sampling.rate_on(rates, str(day.date())) for day in df["days"]]
+    return df.assign(
+        pageviews=df["pageviews"] * scale, script_runs=df["script_runs"] * scale
+    )
+
+
+def _estimated(count, rate):
+    """`count` scaled up by the sample `rate`, with its 95% interval."""
+    total, low, high = sampling.estimate(count, rate)
+    return round(total), f"95% confidence interval: {low:,.0f} to {high:,.0f}"
+
 
 def show_results(data, reset_callback, unsafe_password=None):  # noqa: F811
     """Show analytics results in streamlit, asking for password if given."""
@@ -38,27 +125,47 @@ def show_results(data, reset_callback, unsafe_password=None):  # noqa: F811
         # Show traffic.
         st.header("Traffic")
         st.write(f"since {data['start_time']}")
+        rate, rates = _sample_rates(data)
+        # Scale counts only if sessions were ever sampled.
+        sampled = any(r < 1 for r in data.get("sample_rates", {}).values())
+        pageviews, pageviews_ci = _estimated(
+            data["total_pageviews"], rates["pageviews"]
+        )
+        script_runs, script_runs_ci = _estimated(
+            data["total_script_runs"], rates["script_runs"]
+        )
+        if sampled:
+            st.caption(
+                f"Only {rate:.2%} of sessions are tracked, counts are scaled up "
+                "estimates."
+            )
         col1, col2, col3 = st.columns(3)
         col1.metric(
             "Pageviews",
-            data["total_pageviews"],
-            help="Every time a user (re-)loads the site.",
+            pageviews,
+            help="Every time a user (re-)loads the site."
+            + (f" {pageviews_ci}" if sampled else ""),
         )
         col2.metric(
             "Widget Interactions",
-            data["total_script_runs"],
-            help="Every time Streamlit reruns upon changes or interactions.",
+            script_runs,
+            help="Every time Streamlit reruns upon changes or interactions."
+            + (f" {script_runs_ci}" if sampled else ""),
         )
         col3.metric(
             "Time spent",
-            utils.format_seconds(data["total_time_seconds"]),
+            utils.format_seconds(
+                data["total_time_seconds"] / rates["session_time_seconds"]
+            ),
             help=(
                 "Total usage from all users from run to last widget interaction"
             ),  # noqa: E501
         )
         st.write("")
 
-        df = pd.DataFrame(data["per_day"])
+        df = _history_frame(data)
+        if sampled:
+            df = _scaled_history(df, data["sample_rates"])
         # check if more than one year of data exists
         if pd.to_datetime(df["days"]).dt.year.nunique() > 1:
             x_axis_ticks = "yearmonthdate(days):O"
@@ -101,6 +208,37 @@ def show_results(data, reset_callback, unsafe_password=None):  # noqa: F811
         )
         st.altair_chart(layer, use_container_width=True)
 
+        # Show how long script runs take per page, slowest first.
+        st.header("Script run latency")
+        latency_today, latency_total = st.tabs(["Today", "All time"])
+        with latency_today:
+            st.dataframe(
+                pd.DataFrame(latency.summary(data, str(datetime.date.today()))),
+                hide_index=True,
+            )
+        with latency_total:
+            st.dataframe(pd.DataFrame(latency.summary(data)), hide_index=True)
+
+        # Show uploads per file widget.
+        upload_rows = uploads.summary(data)
+        if upload_rows:
+            st.header("Uploads")
+            st.dataframe(pd.DataFrame(upload_rows), hide_index=True)
+
+        # Rankings kept up to date as counts change, see `aggregates.py`, of
+        # the same counts as `data` if it is a snapshot.
+        aggregated = data.get("aggregates") or aggregates.current()
+        st.header("Most used widgets")
+        ranking = pd.DataFrame(
+            aggregated["ranking"], columns=["widget_name", "number_of_interactions"]
+        )
+        if sampled:
+            ranking["estimated_interactions"] = (
+                ranking["number_of_interactions"]
+                / ranking["widget_name"].map(lambda label: rates.get(label, rate))
+            ).round()
+        st.dataframe(ranking, hide_index=True)
+
         # Show widget interactions.
         st.header("Widget interactions")
         st.markdown(
@@ -127,26 +265,43 @@ def show_results(data, reset_callback, unsafe_password=None):  # noqa: F811
         for i in data["widgets"].keys():
             st.markdown(f"##### `{i}` Widget Usage")
             if type(data["widgets"][i]) is dict:
-                st.dataframe(
-                    pd.DataFrame(
-                        {
-                            "widget_name": i,
-                            "selected_value": list(data["widgets"][i].keys()),
-                            "number_of_interactions": data["widgets"][
-                                i
-                            ].values(),  # noqa: E501
-                        }
-                    ).sort_values(by="number_of_interactions", ascending=False)
+                # Already sorted, most selected first.
+                rows = aggregates.top_values(aggregated, i, data["widgets"][i])
+                frame = pd.DataFrame(
+                    rows, columns=["selected_value", "number_of_interactions"]
                 )
+                frame.insert(0, "widget_name", i)
+                if len(data["widgets"][i]) > len(rows):
+                    st.caption(f"Top {len(rows)} of {len(data['widgets'][i])} values")
             else:
+                frame = pd.DataFrame(
+                    {
+                        "widget_name": i,
+                        "number_of_interactions": data["widgets"][i],
+                    },
+                    index=[0],
+                )
+            if sampled:
+                frame["estimated_interactions"] = (
+                    frame["number_of_interactions"] / rates.get(i, rate)
+                ).round()
+            st.dataframe(frame)
+            sketch = data.get("sketches", {}).get(i)
+            if sketch is not None and sketch["count"]:
+                # Numeric values are kept as a distribution, not one by one.
                 st.dataframe(
                     pd.DataFrame(
                         {
-                            "widget_name": i,
-                            "number_of_interactions": data["widgets"][i],
-                        },
-                        index=[0],
-                    ).sort_values(by="number_of_interactions", ascending=False)
+                            "percentile": PERCENTILES,
+                            "value": [
+                                sketches.quantile(sketch, p / 100) for p in PERCENTILES
+                            ],
+                        }
+                    ),
+                    hide_index=True,
+                )
+                st.bar_chart(
+                    pd.DataFrame(sketches.buckets(sketch)), x="value", y="count"
                 )
 
         # Show button to reset analytics.
@@ -1,12 +1,43 @@
-import json
+import datetime
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Optional, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Union
 
 import streamlit as st
 from google.cloud import firestore
 from google.oauth2 import service_account
 
-from .state import data, session_data  # noqa: F401
+from . import codec, schema
+from .columnar import PerDay
+from .state import data, history_lock, session_data  # noqa: F401
+
+# Maximum number of writes in one Firestore batch.
+BATCH_SIZE = 500
+
+# Fields of the counts document that tracking needs. The history fields are
+# only needed for the dashboard and are loaded later, see `load_history`.
+TRACKING_FIELDS = [
+    "total_pageviews",
+    "total_script_runs",
+    "total_time_seconds",
+    "widgets",
+    "start_time",
+    "journal",
+    "sample_rates",
+    "save_seq",
+    "schema_version",
+    "replica_id",
+    # Numeric widgets count into their sketch, see `wrappers.value`.
+    "sketches",
+]
+HISTORY_FIELDS = ["per_day", "per_week", "per_month", "latency", "uploads"]
+
+
+def _collection_name(collection_name: Optional[str]) -> str:
+    if collection_name is None:
+        raise ValueError("firestore_collection_name must be provided")
+    return collection_name
 
 
 def sanitize_data(data):  # noqa: F811
@@ -15,6 +46,8 @@ def sanitize_data(data):  # noqa: F811
         return {
             str(k) if k else "": sanitize_data(v) for k, v in data.items() if k
         }  # noqa: E501
+    elif isinstance(data, PerDay):
+        return sanitize_data(data.to_dict())
     elif isinstance(data, list):
         # Apply sanitization to elements in lists
         return [sanitize_data(item) for item in data]
@@ -30,8 +63,14 @@ def load(
     streamlit_secrets_firestore_key: Optional[str] = None,
     firestore_project_name: Optional[str] = None,
     session_id: Optional[str] = None,
+    field_paths: Optional[List[str]] = None,
 ):
-    """Load count data from firestore into `data`."""
+    """
+    Load count data from firestore into `data`.
+
+    Pass `data=None` to only load the session document, and `field_paths`
+    (e.g. `TRACKING_FIELDS`) to only load these fields of the counts document.
+    """
     firestore_data = None
     firestore_session_data = None
 
@@ -39,26 +78,35 @@ def load(
         # Following along here
         # https://blog.streamlit.io/streamlit-firestore-continued/#part-4-securely-deploying-on-streamlit-sharing  # noqa: E501
         # for deploying to Streamlit Cloud with Firestore
-        key_dict = json.loads(st.secrets[streamlit_secrets_firestore_key])
+        key_dict = codec.loads(st.secrets[streamlit_secrets_firestore_key])
         creds = service_account.Credentials.from_service_account_info(key_dict)
         db = firestore.Client(credentials=creds, project=firestore_project_name)
         col = db.collection(collection_name)
-        firestore_data = col.document(document_name).get().to_dict()
+        if data is not None:
+            firestore_data = (
+                col.document(document_name).get(field_paths=field_paths).to_dict()
+            )
         if session_id is not None:
             firestore_session_data = col.document(session_id).get().to_dict()
     else:
         db = firestore.Client.from_service_account_json(service_account_json)
         col = db.collection(collection_name)
-        firestore_data = col.document(document_name).get().to_dict()
+        if data is not None:
+            firestore_data = (
+                col.document(document_name).get(field_paths=field_paths).to_dict()
+            )
         if session_id is not None:
             firestore_session_data = col.document(session_id).get().to_dict()
 
     if firestore_data is not None:
+        # Fields of the counts document may be left out, see `field_paths`.
+        schema.upgrade(firestore_data)
         for key in firestore_data:
             if key in data:
                 data[key] = firestore_data[key]
 
     if firestore_session_data is not None:
+        schema.upgrade(firestore_session_data)
         for key in firestore_session_data:
             if key in session_data:
                 session_data[key] = firestore_session_data[key]
@@ -67,6 +115,52 @@ def load(
     # logging.debug("Data loaded from Firestore: %s", firestore_data)
 
 
+def load_history(
+    service_account_json: Optional[Union[str, Path]] = None,
+    collection_name: Optional[str] = None,
+    document_name: Optional[str] = "counts",
+    streamlit_secrets_firestore_key: Optional[str] = None,
+    firestore_project_name: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Return the `HISTORY_FIELDS` of the counts document."""
+    if streamlit_secrets_firestore_key is not None:
+        key_dict = codec.loads(st.secrets[streamlit_secrets_firestore_key])
+        creds = service_account.Credentials.from_service_account_info(key_dict)
+        db = firestore.Client(credentials=creds, project=firestore_project_name)
+    else:
+        db = firestore.Client.from_service_account_json(service_account_json)
+    snapshot = (
+        db.collection(_collection_name(collection_name))
+        .document(document_name)
+        .get(field_paths=HISTORY_FIELDS + ["schema_version"])
+    )
+    return schema.upgrade(snapshot.to_dict() or {})
+
+
+def save_seq(
+    service_account_json: Optional[Union[str, Path]] = None,
+    collection_name: Optional[str] = None,
+    document_name: Optional[str] = "counts",
+    streamlit_secrets_firestore_key: Optional[str] = None,
+    firestore_project_name: Optional[str] = None,
+) -> Optional[int]:
+    """The `save_seq` of the counts document, without reading its other fields."""
+    if streamlit_secrets_firestore_key is not None:
+        key_dict = codec.loads(st.secrets[streamlit_secrets_firestore_key])
+        creds = service_account.Credentials.from_service_account_info(key_dict)
+        db = firestore.Client(credentials=creds, project=firestore_project_name)
+    else:
+        db = firestore.Client.from_service_account_json(service_account_json)
+    snapshot = (
+        db.collection(_collection_name(collection_name))
+        .document(document_name)
+        .get(field_paths=["save_seq"])
+    )
+    if not snapshot.exists:
+        return None
+    return int((snapshot.to_dict() or {}).get("save_seq", 0))
+
+
 def save(
     data,  # noqa: F811
     service_account_json: Optional[Union[str, Path]] = None,
@@ -76,15 +170,16 @@ def save(
     firestore_project_name: Optional[str] = None,
     session_id: Optional[str] = None,
 ):
-    """Save count data from `data` to firestore."""
+    """
+    Save count data from `data` to firestore.
 
-    # Ensure all keys are strings and not empty
-    sanitized_data = sanitize_data(data)
+    Pass `data=None` to only save the session document.
+    """
 
     if streamlit_secrets_firestore_key is not None:
         # Following along here https://blog.streamlit.io/streamlit-firestore-continued/#part-4-securely-deploying-on-streamlit-sharing  # noqa: E501
         # for deploying to Streamlit Cloud with Firestore
-        key_dict = json.loads(st.secrets[streamlit_secrets_firestore_key])
+        key_dict = codec.loads(st.secrets[streamlit_secrets_firestore_key])
         creds = service_account.Credentials.from_service_account_info(key_dict)
         db = firestore.Client(credentials=creds, project=firestore_project_name)
     else:
@@ -95,12 +190,46 @@ def save(
 
     # Attempt to save to Firestore
     # creates if doesn't exist
-    col.document(document_name).set(sanitized_data, merge=True)
+    if data is not None:
+        # Ensure all keys are strings and not empty
+        with history_lock:
+            sanitized_data = sanitize_data(data)
+        col.document(document_name).set(sanitized_data, merge=True)
     if session_id is not None:
-        sanitized_session_data = sanitize_data(session_data)
+        with history_lock:
+            sanitized_session_data = sanitize_data(session_data)
         col.document(session_id).set(sanitized_session_data, merge=True)
 
 
+def save_sessions(
+    sessions: Dict[str, Dict[str, Any]],
+    service_account_json: Optional[Union[str, Path]] = None,
+    collection_name: Optional[str] = None,
+    streamlit_secrets_firestore_key: Optional[str] = None,
+    firestore_project_name: Optional[str] = None,
+):
+    """Save the counters of several sessions, keyed by session id, in batches."""
+    if not sessions:
+        return
+    if streamlit_secrets_firestore_key is not None:
+        key_dict = codec.loads(st.secrets[streamlit_secrets_firestore_key])
+        creds = service_account.Credentials.from_service_account_info(key_dict)
+        db = firestore.Client(credentials=creds, project=firestore_project_name)
+    else:
+        db = firestore.Client.from_service_account_json(service_account_json)
+    col = db.collection(_collection_name(collection_name))
+
+    session_ids = list(sessions)
+    for start in range(0, len(session_ids), BATCH_SIZE):
+        end = start + BATCH_SIZE
+        batch = db.batch()
+        for session_id in session_ids[start:end]:
+            with history_lock:
+                sanitized = sanitize_data(sessions[session_id])
+            batch.set(col.document(session_id), sanitized, merge=True)
+        batch.commit()
+
+
 def delete(
     document_name: str,  # noqa: F811
     collection_name: str,
@@ -113,7 +242,7 @@ def delete(
         print("Using secrets to connect to firestore for deletion")
         # Following along here https://blog.streamlit.io/streamlit-firestore-continued/#part-4-securely-deploying-on-streamlit-sharing  # noqa: E501
         # for deploying to Streamlit Cloud with Firestore
-        key_dict = json.loads(st.secrets[streamlit_secrets_firestore_key])
+        key_dict = codec.loads(st.secrets[streamlit_secrets_firestore_key])
         creds = service_account.Credentials.from_service_account_info(key_dict)
         db = firestore.Client(credentials=creds, project=firestore_project_name)
     else:
@@ -124,3 +253,152 @@ def delete(
 
     # Delete from firestore
     col.document(document_name).delete()
+
+
+# Fields of a session document that `inactive_for` reads.
+INACTIVE_FIELDS = ("per_day.days",)
+
+
+def inactive_for(days: int) -> Callable[[str, Dict[str, Any]], bool]:
+    """
+    Predicate for `bulk_delete` that matches sessions without activity in the
+    last `days` days, judged by the last day of their per-day history.
+    """
+    cutoff = str(datetime.date.today() - datetime.timedelta(days=days))
+
+    def predicate(session_id: str, doc: Dict[str, Any]) -> bool:
+        session_days = doc.get("per_day", {}).get("days", [])
+        return not session_days or session_days[-1] < cutoff
+
+    return predicate
+
+
+def _matching_ids(col, predicate, keep, page_size, fields):
+    """
+    Page through `col` by document id, yielding ids matching `predicate`.
+    Only `fields` of the documents are read, unless it is None.
+    """
+    if fields is not None:
+        col = col.select(list(fields))
+    last = None
+    while True:
+        query = col.order_by("__name__").limit(page_size)
+        if last is not None:
+            query = query.start_after(last)
+        page = list(query.stream())
+        for snapshot in page:
+            if snapshot.id not in keep and predicate(snapshot.id, snapshot.to_dict()):
+                yield snapshot.id
+        if len(page) < page_size:
+            return
+        last = page[-1]
+
+
+def bulk_delete(
+    db,
+    collection_name: str,
+    session_ids: Optional[Iterable[str]] = None,
+    predicate: Optional[Callable[[str, Dict[str, Any]], bool]] = None,
+    keep: Iterable[str] = ("counts",),
+    batch_size: int = BATCH_SIZE,
+    max_workers: int = 4,
+    progress: Optional[Callable[[Dict[str, float]], None]] = None,
+    fields: Optional[Iterable[str]] = INACTIVE_FIELDS,
+) -> Dict[str, float]:
+    """
+    Delete many session documents with batched commits.
+
+    Parameters
+    ----------
+    db : firestore.Client
+        Client to delete with.
+    collection_name : str
+        Collection holding the session documents.
+    session_ids : Iterable[str], optional
+        Ids to delete. If None, the collection is paged through and every
+        document for which `predicate(session_id, doc)` is true is deleted.
+    predicate : Callable[[str, Dict[str, Any]], bool], optional
+        E.g. `inactive_for(90)`.
+    keep : Iterable[str]
+        Documents that are never deleted, i.e. the global counts.
+    batch_size : int
+        Deletes per commit, at most 500.
+    max_workers : int
+        Maximum number of commits in flight at the same time.
+    progress : Callable[[Dict[str, float]], None], optional
+        Called with the running report after every commit.
+    fields : Iterable[str], optional
+        Field paths `predicate` reads, the only ones fetched while paging.
+        Defaults to those of `inactive_for`, None fetches whole documents.
+
+    Returns
+    -------
+    Dict[str, float]
+        `deleted` documents, elapsed `seconds` and `per_second` throughput.
+    """
+    if session_ids is None and predicate is None:
+        raise ValueError("Pass session_ids or a predicate")
+    keep = set(keep)
+    col = db.collection(collection_name)
+    if session_ids is None:
+        session_ids = _matching_ids(
+            col, predicate, keep, page_size=batch_size, fields=fields
+        )
+    else:
+        session_ids = (i for i in session_ids if i and i not in keep)
+
+    report = {"deleted": 0, "seconds": 0.0, "per_second": 0.0}
+    start = time.monotonic()
+
+    def _done(future):
+        report["deleted"] += future.result()
+        report["seconds"] = time.monotonic() - start
+        report["per_second"] = report["deleted"] / max(report["seconds"], 1e-9)
+        if progress is not None:
+            progress(dict(report))
+
+    def _commit(ids):
+        batch = db.batch()
+        for session_id in ids:
+            batch.delete(col.document(session_id))
+        batch.commit()
+        return len(ids)
+
+    in_flight: Set[Future] = set()
+    with ThreadPoolExecutor(max_workers, thread_name_prefix="sa2-delete") as pool:
+        ids = []
+        for session_id in session_ids:
+            ids.append(session_id)
+            if len(ids) < batch_size:
+                continue
+            # Keep a bounded number of batches queued, not the whole id list.
+            if len(in_flight) >= 2 * max_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _done(future)
+            in_flight.add(pool.submit(_commit, ids))
+            ids = []
+        if ids:
+            in_flight.add(pool.submit(_commit, ids))
+        for future in wait(in_flight).done:
+            _done(future)
+    return report
+
+
+def delete_many(
+    collection_name: str,
+    session_ids: Optional[Iterable[str]] = None,
+    predicate: Optional[Callable[[str, Dict[str, Any]], bool]] = None,
+    service_account_json: Optional[Union[str, Path]] = None,
+    streamlit_secrets_firestore_key: Optional[str] = None,
+    firestore_project_name: Optional[str] = None,
+    **kwargs,
+) -> Dict[str, float]:
+    """Connect to firestore and run `bulk_delete`."""
+    if streamlit_secrets_firestore_key is not None:
+        key_dict = codec.loads(st.secrets[streamlit_secrets_firestore_key])
+        creds = service_account.Credentials.from_service_account_info(key_dict)
+        db = firestore.Client(credentials=creds, project=firestore_project_name)
+    else:
+        db = firestore.Client.from_service_account_json(service_account_json)
+    return bulk_delete(db, collection_name, session_ids, predicate, **kwargs)
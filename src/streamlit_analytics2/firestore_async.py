@@ -0,0 +1,397 @@
+"""
+Asyncio Firestore backend built on `google.cloud.firestore.AsyncClient`.
+
+All I/O runs on a dedicated event loop thread, so the Streamlit script thread
+only hands over a sanitized copy of the data and gets a future back. Saves of
+the same document that have not started yet are coalesced into one write.
+"""
+
+import asyncio
+import atexit
+import threading
+from concurrent.futures import Future
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import streamlit as st
+from google.cloud import firestore
+from google.oauth2 import service_account
+
+from . import codec, schema
+from .firestore import HISTORY_FIELDS, _collection_name, sanitize_data
+from .state import current_session, history_lock, session_data
+
+
+class AsyncFirestore:
+    """
+    Run Firestore reads, writes and deletes on a background event loop.
+
+    Parameters
+    ----------
+    client_factory : Callable[[], Any]
+        Builds the `AsyncClient` (or an in-process fake). Called once, on the
+        event loop thread.
+    max_concurrency : int
+        Maximum number of Firestore requests in flight at the same time.
+    max_pending : int
+        Maximum number of submitted but unfinished operations. Submitting more
+        blocks the caller until one finishes (backpressure).
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Any],
+        max_concurrency: int = 8,
+        max_pending: int = 64,
+    ):
+        self._client_factory = client_factory
+        self._client = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        # Saves that were scheduled but have not started, keyed by document.
+        self._queued_saves: Dict[Tuple[str, str], Tuple[Future, dict]] = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, name="sa2-firestore", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _collection(self, collection_name):
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client.collection(collection_name)
+
+    def _submit(self, coro, timeout: Optional[float] = None) -> Future:
+        """Schedule `coro` on the loop, blocking while too many are pending."""
+        if not self._pending.acquire(timeout=timeout):
+            coro.close()
+            raise TimeoutError("Too many pending Firestore operations")
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    async def _get(self, collection_name, document_name, field_paths=None):
+        async with self._semaphore:
+            document = self._collection(collection_name).document(document_name)
+            if field_paths is None:
+                snapshot = await document.get()
+            else:
+                snapshot = await document.get(field_paths=field_paths)
+            return snapshot.to_dict()
+
+    async def _set(self, collection_name, document_name):
+        async with self._semaphore:
+            # Take the latest payload only once a slot is free, so that saves
+            # queued behind the semaphore collapse into a single write.
+            with self._lock:
+                _, payload = self._queued_saves.pop((collection_name, document_name))
+            await self._collection(collection_name).document(document_name).set(
+                payload, merge=True
+            )
+
+    async def _delete(self, collection_name, document_name):
+        async with self._semaphore:
+            await self._collection(collection_name).document(document_name).delete()
+
+    def get(
+        self,
+        collection_name: str,
+        document_name: str,
+        field_paths: Optional[List[str]] = None,
+    ) -> Future:
+        """Fetch a document (or only `field_paths`). Resolves to a dict or None."""
+        return self._submit(self._get(collection_name, document_name, field_paths))
+
+    def set(
+        self,
+        collection_name: str,
+        document_name: str,
+        payload: dict,
+        timeout: Optional[float] = None,
+    ) -> Future:
+        """Merge `payload` into a document, coalescing with a queued save."""
+        key = (collection_name, document_name)
+        with self._lock:
+            if key in self._queued_saves:
+                future, _ = self._queued_saves[key]
+                self._queued_saves[key] = (future, payload)
+                return future
+            future = Future()
+            self._queued_saves[key] = (future, payload)
+        try:
+            inner = self._submit(self._set(collection_name, document_name), timeout)
+        except TimeoutError:
+            with self._lock:
+                self._queued_saves.pop(key, None)
+            raise
+        _chain(inner, future)
+        return future
+
+    def delete(self, collection_name: str, document_name: str) -> Future:
+        """Delete a document."""
+        return self._submit(self._delete(collection_name, document_name))
+
+    def close(self, timeout: Optional[float] = 10):
+        """Wait for pending operations to finish and stop the loop thread."""
+
+        async def _drain():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=timeout)
+            if self._client is not None and hasattr(self._client, "close"):
+                result = self._client.close()
+                if asyncio.iscoroutine(result):
+                    await result
+
+        if self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(_drain(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+
+
+def _gather(futures) -> Future:
+    """Return a future that resolves once all `futures` are done."""
+    result: Future = Future()
+    if not futures:
+        result.set_result(None)
+        return result
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _done(future):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if future.exception() is not None and not result.done():
+            result.set_exception(future.exception())
+        elif last and not result.done():
+            result.set_result(None)
+
+    for future in futures:
+        future.add_done_callback(_done)
+    return result
+
+
+def _then(source: Future, func: Callable[[Any], Any]) -> Future:
+    """
+    Return a future that resolves to `func(source.result())`, or with the
+    exception raised by `source` or by `func`.
+    """
+    result: Future = Future()
+
+    def _call(done):
+        try:
+            result.set_result(func(done.result()))
+        except BaseException as e:
+            result.set_exception(e)
+
+    source.add_done_callback(_call)
+    return result
+
+
+def _chain(source: Future, target: Future):
+    """Copy the outcome of `source` into `target` once it is done."""
+
+    def _copy(done):
+        if target.done():
+            return
+        if done.exception() is not None:
+            target.set_exception(done.exception())
+        else:
+            target.set_result(done.result())
+
+    source.add_done_callback(_copy)
+
+
+_backends: Dict[tuple, AsyncFirestore] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(
+    service_account_json: Optional[Union[str, Path]] = None,
+    streamlit_secrets_firestore_key: Optional[str] = None,
+    firestore_project_name: Optional[str] = None,
+) -> AsyncFirestore:
+    """Return the process-wide backend for the given credentials."""
+    key = (
+        str(service_account_json),
+        streamlit_secrets_firestore_key,
+        firestore_project_name,
+    )
+    with _backends_lock:
+        if key not in _backends:
+            if streamlit_secrets_firestore_key is not None:
+                key_dict = codec.loads(st.secrets[streamlit_secrets_firestore_key])
+                creds = service_account.Credentials.from_service_account_info(key_dict)
+
+                def factory():
+                    return firestore.AsyncClient(
+                        credentials=creds, project=firestore_project_name
+                    )
+
+            else:
+
+                def factory():
+                    return firestore.AsyncClient.from_service_account_json(
+                        service_account_json
+                    )
+
+            backend = AsyncFirestore(factory)
+            atexit.register(backend.close)
+            _backends[key] = backend
+        return _backends[key]
+
+
+def load(
+    data,  # noqa: F811
+    service_account_json: Optional[Union[str, Path]] = None,
+    collection_name: Optional[str] = None,
+    document_name: str = "counts",
+    streamlit_secrets_firestore_key: Optional[str] = None,
+    firestore_project_name: Optional[str] = None,
+    session_id: Optional[str] = None,
+    backend: Optional[AsyncFirestore] = None,
+    field_paths: Optional[List[str]] = None,
+) -> Future:
+    """
+    Load count data from firestore into `data` without blocking.
+
+    The returned future resolves once `data` (and `session_data` if a
+    `session_id` is given) have been updated. Pass `data=None` to only load
+    the session document, and `field_paths` to only load these fields of the
+    counts document.
+    """
+    if backend is None:
+        backend = get_backend(
+            service_account_json,
+            streamlit_secrets_firestore_key,
+            firestore_project_name,
+        )
+    collection = _collection_name(collection_name)
+
+    def _apply(target, loaded):
+        if loaded is not None:
+            schema.upgrade(loaded)
+            for key in loaded:
+                if key in target:
+                    target[key] = loaded[key]
+
+    # Applied in the future chain, so a failed load or apply fails the result.
+    futures = []
+    if data is not None:
+        document = backend.get(collection, document_name, field_paths)
+        futures.append(_then(document, partial(_apply, data)))
+    if session_id is not None:
+        # Resolved here, `_apply` runs on the loop thread.
+        session = backend.get(collection, session_id)
+        futures.append(_then(session, partial(_apply, current_session())))
+    return _gather(futures)
+
+
+def load_history(
+    service_account_json: Optional[Union[str, Path]] = None,
+    collection_name: Optional[str] = None,
+    document_name: str = "counts",
+    streamlit_secrets_firestore_key: Optional[str] = None,
+    firestore_project_name: Optional[str] = None,
+    backend: Optional[AsyncFirestore] = None,
+) -> Future:
+    """Fetch the `HISTORY_FIELDS` of the counts document without blocking."""
+    if backend is None:
+        backend = get_backend(
+            service_account_json,
+            streamlit_secrets_firestore_key,
+            firestore_project_name,
+        )
+    fields = HISTORY_FIELDS + ["schema_version"]
+    document = backend.get(_collection_name(collection_name), document_name, fields)
+    return _then(document, lambda loaded: schema.upgrade(loaded or {}))
+
+
+def save(
+    data,  # noqa: F811
+    service_account_json: Optional[Union[str, Path]] = None,
+    collection_name: Optional[str] = None,
+    document_name: str = "counts",
+    streamlit_secrets_firestore_key: Optional[str] = None,
+    firestore_project_name: Optional[str] = None,
+    session_id: Optional[str] = None,
+    backend: Optional[AsyncFirestore] = None,
+) -> Future:
+    """
+    Save count data from `data` to firestore without blocking.
+
+    The data is sanitized (and thereby copied) on the calling thread, so it
+    can keep changing while the write is in flight. Pass `data=None` to only
+    save the session document.
+    """
+    if backend is None:
+        backend = get_backend(
+            service_account_json,
+            streamlit_secrets_firestore_key,
+            firestore_project_name,
+        )
+    collection = _collection_name(collection_name)
+    futures = []
+    if data is not None:
+        with history_lock:
+            payload = sanitize_data(data)
+        futures.append(backend.set(collection, document_name, payload))
+    if session_id is not None:
+        with history_lock:
+            payload = sanitize_data(session_data)
+        futures.append(backend.set(collection, session_id, payload))
+    return _gather(futures)
+
+
+def save_sessions(
+    sessions: Dict[str, Dict[str, Any]],
+    service_account_json: Optional[Union[str, Path]] = None,
+    collection_name: Optional[str] = None,
+    streamlit_secrets_firestore_key: Optional[str] = None,
+    firestore_project_name: Optional[str] = None,
+    backend: Optional[AsyncFirestore] = None,
+) -> Future:
+    """Save the counters of several sessions, keyed by session id."""
+    if backend is None:
+        backend = get_backend(
+            service_account_json,
+            streamlit_secrets_firestore_key,
+            firestore_project_name,
+        )
+    collection = _collection_name(collection_name)
+    with history_lock:
+        payloads = {
+            session_id: sanitize_data(counters)
+            for session_id, counters in sessions.items()
+        }
+    return _gather(
+        [
+            backend.set(collection, session_id, payload)
+            for session_id, payload in payloads.items()
+        ]
+    )
+
+
+def delete(
+    document_name: str,  # noqa: F811
+    collection_name: str,
+    service_account_json: Optional[Union[str, Path]] = None,
+    streamlit_secrets_firestore_key: Optional[str] = None,
+    firestore_project_name: Optional[str] = None,
+    backend: Optional[AsyncFirestore] = None,
+) -> Future:
+    """Delete a document from firestore without blocking."""
+    if backend is None:
+        backend = get_backend(
+            service_account_json,
+            streamlit_secrets_firestore_key,
+            firestore_project_name,
+        )
+    return backend.delete(collection_name, document_name)
@@ -0,0 +1,91 @@
+"""
+Form-aware tracking of the widgets inside `st.form`.
+
+The values of the widgets in a form only change when the form is submitted.
+Instead of comparing every form widget against `state_dict` on every rerun,
+the wrappers hand their tracking to `defer`, which queues it under the form.
+The wrapped `st.form_submit_button` runs the queue as one batch when the form
+is submitted, otherwise `end` drops it at the end of the run.
+
+The first time a session renders a form, its queue runs anyway to record the
+initial values, as for widgets outside of forms.
+"""
+
+import threading
+from typing import Callable, Dict, List, Set, Tuple
+
+import streamlit as st
+from streamlit.delta_generator import DeltaGenerator
+
+from . import runlog
+
+try:
+    from streamlit.elements.lib.form_utils import current_form_id
+except ImportError:  # pragma: no cover - older streamlit, no batching
+
+    def current_form_id(dg: DeltaGenerator) -> str:
+        return ""
+
+
+# Tracks a widget and returns whether it counted an interaction.
+Track = Callable[[], bool]
+
+# Queued tracking and submitted forms of the run executing on this thread.
+_run = threading.local()
+
+
+def start():
+    """Start a run with empty queues."""
+    _run.pending = {}
+    _run.submitted = set()
+
+
+def current(dg=None) -> str:
+    """
+    ID of the form a widget of container `dg` (default `st`) renders into,
+    "" if none.
+    """
+    if getattr(_run, "pending", None) is None:
+        return ""
+    return current_form_id(st._main if dg is None else dg)
+
+
+def defer(form_id: str, label: str, track: Track):
+    """Queue `track` for widget `label` until form `form_id` is submitted."""
+    if form_id in _run.submitted:
+        # Rendered after the submit button, the batch already ran.
+        track()
+        return
+    _run.pending.setdefault(form_id, []).append((label, track))
+
+
+def _run_batch(batch: List[Tuple[str, Track]]) -> List[str]:
+    return [label for label, track in batch if track()]
+
+
+def submit(form_id: str, submitted: bool):
+    """Run the queue of `form_id` as one batch if the form was `submitted`."""
+    if not submitted or not form_id:
+        return
+    _run.submitted.add(form_id)
+    _seen().add(form_id)
+    changed = _run_batch(_run.pending.pop(form_id, []))
+    runlog.event("SA2: Form %s submitted, changed %s", form_id, changed)
+
+
+def _seen() -> Set[str]:
+    if "forms_seen" not in st.session_state:
+        st.session_state.forms_seen = set()
+    seen: Set[str] = st.session_state.forms_seen
+    return seen
+
+
+def end():
+    """Drop the queues of the forms that were not submitted in this run."""
+    pending: Dict[str, List[Tuple[str, Track]]] = getattr(_run, "pending", None) or {}
+    seen = _seen() if pending else set()
+    for form_id, batch in pending.items():
+        if form_id not in seen:
+            seen.add(form_id)
+            _run_batch(batch)
+    _run.pending = None
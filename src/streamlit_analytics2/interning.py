@@ -0,0 +1,175 @@
+"""
+Dictionary encoding for widget labels and values.
+
+Widget labels and values end up as keys in `data["widgets"]`,
+`session_data["widgets"]` and every day's `per_day["widgets"]` dict. The
+wrappers intern them in a `StringTable`, so all of these dicts share one
+string object per label or value instead of holding copies. `encode` and
+`decode` convert the counters to and from a compact form keyed by integer ids,
+with the strings stored once, which is how `jsonfile.save` writes them.
+
+The shared table only grows while tracking. `retain` rebuilds it from the
+strings that are still counted, after retention or session eviction dropped
+counters (see `state.compact_strings`).
+"""
+
+import threading
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from .columnar import HISTORY_KEYS, PerDay
+
+
+class StringTable:
+    """Table mapping strings to integer ids and back."""
+
+    def __init__(self, strings=()):
+        # (string -> id, id -> string), replaced as a whole by `retain`.
+        self._table: Tuple[Dict[str, int], List[str]] = ({}, [])
+        self._lock = threading.Lock()
+        for s in strings:
+            self.id(s)
+
+    def __len__(self) -> int:
+        return len(self._table[1])
+
+    def intern(self, s):
+        """Return the canonical instance of `s`. Non-strings are returned as is."""
+        if type(s) is not str:
+            return s
+        ids, strings = self._table
+        i = ids.get(s)
+        if i is None:
+            return self._add(s)[1]
+        return strings[i]
+
+    def id(self, s: str) -> int:
+        """Return the id of `s`, adding it to the table if needed."""
+        i = self._table[0].get(s)
+        if i is None:
+            i = self._add(s)[0]
+        return i
+
+    def _add(self, s: str) -> Tuple[int, str]:
+        with self._lock:
+            ids, strings = self._table
+            i = ids.get(s)
+            if i is None:
+                i = len(strings)
+                strings.append(s)
+                ids[s] = i
+            return i, strings[i]
+
+    def string(self, i: int) -> str:
+        return self._table[1][i]
+
+    def strings(self) -> List[str]:
+        return list(self._table[1])
+
+    def retain(self, keep: Iterable[str]):
+        """
+        Drop the strings not in `keep`, which gives the others new ids.
+
+        Kept strings stay canonical. A dropped one that is interned again is
+        added back as a new instance.
+        """
+        keep = set(keep)
+        with self._lock:
+            strings = [s for s in self._table[1] if s in keep]
+            self._table = ({s: i for i, s in enumerate(strings)}, strings)
+
+
+def counted_strings(d: Dict[str, Any]) -> Set[str]:
+    """The labels and values counted in the analytics dict `d`."""
+    found: Set[str] = set()
+    rows = [d.get("widgets", {})]
+    for key in HISTORY_KEYS:
+        if key in d:
+            rows.extend(list(d[key]["widgets"]))
+    for widgets in rows:
+        for label, counts in widgets.copy().items():
+            found.add(label)
+            if isinstance(counts, dict):
+                found.update(counts.copy())
+    return found
+
+
+def intern_widgets(widgets: Dict[Any, Any], table: StringTable) -> Dict[Any, Any]:
+    """Return `widgets` with all labels and values interned in `table`."""
+    result = {}
+    for label, counts in widgets.items():
+        if isinstance(counts, dict):
+            counts = {table.intern(v): n for v, n in counts.items()}
+        result[table.intern(label)] = counts
+    return result
+
+
+def intern_data(d: Dict[str, Any], table: StringTable):
+    """Intern the widget keys of an analytics dict in place, e.g. after a load."""
+    d["widgets"] = intern_widgets(d["widgets"], table)
+    for key in HISTORY_KEYS:
+        if key in d:
+            d[key]["widgets"] = [
+                intern_widgets(widgets, table) for widgets in d[key]["widgets"]
+            ]
+
+
+def _encode_widgets(widgets: Dict[Any, Any], table: StringTable) -> Dict[str, Any]:
+    result: Dict[str, Any] = {}
+    for label, counts in widgets.items():
+        key = str(table.id(str(label)))
+        if isinstance(counts, dict):
+            counts = {str(table.id(str(v))): n for v, n in counts.items()}
+        result[key] = counts
+    return result
+
+
+def _decode_widgets(widgets: Dict[str, Any], table: StringTable) -> Dict[str, Any]:
+    result: Dict[str, Any] = {}
+    for label, counts in widgets.items():
+        if isinstance(counts, dict):
+            counts = {table.string(int(v)): n for v, n in counts.items()}
+        result[table.string(int(label))] = counts
+    return result
+
+
+def encode(d: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return a dictionary-encoded copy of the analytics dict `d`.
+
+    Labels and values are replaced by ids into the `strings` list. Ids are
+    JSON object keys, so they are stored as strings of digits.
+    """
+    table = StringTable()
+    encoded = dict(d)
+    encoded["widgets"] = _encode_widgets(d["widgets"], table)
+    for key in HISTORY_KEYS:
+        if key in d:
+            history = d[key]
+            if isinstance(history, PerDay):
+                history = history.to_dict()
+            history = dict(history)
+            history["widgets"] = [
+                _encode_widgets(widgets, table) for widgets in history["widgets"]
+            ]
+            encoded[key] = history
+    encoded["strings"] = table.strings()
+    return encoded
+
+
+def decode(encoded: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverse of `encode`, returns the analytics dict in its usual shape."""
+    table = StringTable(encoded["strings"])
+    d = {k: v for k, v in encoded.items() if k != "strings"}
+    d["widgets"] = _decode_widgets(encoded["widgets"], table)
+    for key in HISTORY_KEYS:
+        if key in d:
+            history = dict(d[key])
+            history["widgets"] = [
+                _decode_widgets(widgets, table) for widgets in history["widgets"]
+            ]
+            d[key] = history
+    return d
+
+
+def is_encoded(d: Dict[str, Any]) -> bool:
+    return "strings" in d
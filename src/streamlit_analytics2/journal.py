@@ -0,0 +1,295 @@
+"""
+Local write-ahead journal of the increments of `data`.
+
+Every increment (see `state.record`) is appended to the journal as a small
+record with a sequence number, one JSON line per record. A writer thread
+writes and fsyncs the records in groups, so the runs of many sessions share
+one fsync. Runs do not wait for it unless they `commit`, which waits until
+their records are on disk.
+
+`data["journal"]` holds the sequence number of the last record, set together
+with the increment under `history_lock`, so every save of `data` stores up to
+which record it holds the increments. On start, `recover` replays the records
+after it, so a crash loses nothing that was committed. After a save, `compact`
+drops the records the backend now holds in the background.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from . import columnar
+from .state import observers
+
+# Seconds the writer waits to group records into one fsync.
+COMMIT_INTERVAL = 0.02
+
+_TOTALS = {
+    "pageviews": "total_pageviews",
+    "script_runs": "total_script_runs",
+    "session_time_seconds": "total_time_seconds",
+}
+
+
+def _key_part(part: Any) -> str:
+    """`part` as it ends up as a key of the saved data."""
+    if isinstance(part, bool) or part is None:
+        return json.dumps(part)
+    return str(part)
+
+
+def _increment(widgets: Dict[Any, Any], path: Tuple[Any, ...], amount: float):
+    label = path[0]
+    if len(path) == 1:
+        if not isinstance(widgets.get(label, 0), dict):
+            widgets[label] = widgets.get(label, 0) + amount
+        return
+    values = widgets.setdefault(label, {})
+    if isinstance(values, dict):
+        values[path[1]] = values.get(path[1], 0) + amount
+
+
+def apply(
+    d: Dict[str, Any],
+    day: str,
+    key: List[Any],
+    amount: float,
+    rows: Optional[Dict[str, int]] = None,
+):
+    """
+    Apply one increment as passed to `state.record` to `d`.
+
+    `rows` maps the days of `d["per_day"]` to their row, pass the same dict
+    to apply many increments.
+    """
+    history = d["per_day"]
+    if rows is None:
+        rows = {}
+    if not rows:
+        rows.update({day: i for i, day in enumerate(history["days"])})
+    if day in rows:
+        row: Optional[int] = rows[day]
+    elif not rows or day > max(rows):
+        history.append_day(day)
+        row = rows[day] = len(rows)
+    else:
+        # Already rolled up by the retention policy.
+        row = None
+    if key[0] == "widgets":
+        _increment(d["widgets"], tuple(key[1:]), amount)
+        if row is not None:
+            _increment(history["widgets"][row], tuple(key[1:]), amount)
+    else:
+        d[_TOTALS[key[0]]] += amount
+        if row is not None:
+            history[key[0]][row] += amount
+
+
+class Journal:
+    """Append-only journal at `path`, see the module docstring."""
+
+    def __init__(
+        self, path: Union[str, Path], commit_interval: float = COMMIT_INTERVAL
+    ):
+        self.path = Path(path)
+        self.name = self.path.name
+        self.commit_interval = commit_interval
+        self._records: List[Tuple[int, str, List[Any], float]] = []
+        self._cond = threading.Condition()
+        # Held while the file is written to or replaced.
+        self._io_lock = threading.Lock()
+        self._error: Optional[Exception] = None
+        self._seq = self._last_seq()
+        self._committed = self._seq
+        # The data dict `recover` replayed into, marked on every record.
+        self._data: Optional[Dict[str, Any]] = None
+        self._closed = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._writer = threading.Thread(
+            target=self._write_loop, name="sa2-journal", daemon=True
+        )
+        self._writer.start()
+
+    def _read(self):
+        """Yield the complete records in the file, a torn last line is skipped."""
+        try:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        seq, day, key, amount = json.loads(line)
+                    except ValueError:
+                        break
+                    yield seq, day, key, amount
+        except FileNotFoundError:
+            return
+
+    def _last_seq(self) -> int:
+        seq = 0
+        for seq, _, _, _ in self._read():
+            pass
+        return seq
+
+    @property
+    def seq(self) -> int:
+        """
+        Sequence number of the last appended record.
+
+        Increments are applied to `data` and recorded under `history_lock`,
+        so `data` holds every record up to it.
+        """
+        return self._seq
+
+    def observe(self, day: str, key: Tuple[Any, ...], amount: float = 1):
+        """
+        `state.record` observer that appends a record.
+
+        The caller holds `history_lock` since it applied the increment, so a
+        save, which copies `data` under it, sees the increment and its mark
+        together or neither.
+        """
+        with self._cond:
+            self._seq += 1
+            parts = [key[0]] + [_key_part(part) for part in key[1:]]
+            self._records.append((self._seq, day, parts, amount))
+            self._cond.notify()
+        if self._data is not None:
+            self._data.setdefault("journal", {})[self.name] = self._seq
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._records and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._records:
+                    return
+            # Let more records arrive to share the fsync.
+            time.sleep(self.commit_interval)
+            with self._cond:
+                records, self._records = self._records, []
+            error = None
+            try:
+                with self._io_lock:
+                    self._file.write(
+                        b"".join(json.dumps(r).encode() + b"\n" for r in records)
+                    )
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+            except (OSError, ValueError) as e:
+                error = e
+                logging.error(f"SA2: Could not write journal {self.path}: {e}")
+            with self._cond:
+                self._committed = records[-1][0]
+                self._error = error
+                self._cond.notify_all()
+
+    @property
+    def error(self) -> Optional[Exception]:
+        """Error of the last write, None once a write succeeded again."""
+        return self._error
+
+    def commit(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all records appended so far are written.
+
+        Returns
+        -------
+        bool
+            Whether they are on disk, False on a timeout or write error.
+        """
+        with self._cond:
+            target = self._seq
+            done = self._cond.wait_for(lambda: self._committed >= target, timeout)
+            return done and self._error is None
+
+    def recover(self, d: Dict[str, Any]) -> int:
+        """
+        Replay the records `d` does not hold yet into `d`, and mark in `d`
+        the records appended from now on.
+
+        Returns
+        -------
+        int
+            Number of replayed records.
+        """
+        after = d.setdefault("journal", {}).get(self.name, 0)
+        with self._cond:
+            # The records up to `after` may have been compacted away.
+            self._seq = max(self._seq, after)
+            self._committed = max(self._committed, after)
+        columnar.adopt(d)
+        rows: Dict[str, int] = {}
+        replayed = 0
+        for seq, day, key, amount in self._read():
+            if seq > after:
+                apply(d, day, key, amount, rows)
+                replayed += 1
+        d["journal"][self.name] = self._seq
+        self._data = d
+        return replayed
+
+    def compact(self, upto: int):
+        """Drop the records up to `upto` from the file, in the background."""
+        threading.Thread(
+            target=self._compact, args=(upto,), name="sa2-journal-compact", daemon=True
+        ).start()
+
+    def _compact(self, upto: int):
+        with self._io_lock:
+            try:
+                self._file.flush()
+                keep = [line for line in self._lines() if json.loads(line)[0] > upto]
+                tmp = self.path.with_name(f".{self.name}.tmp")
+                with open(tmp, "wb") as f:
+                    f.writelines(keep)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+                self._file.close()
+                self._file = open(self.path, "ab")
+            except (OSError, ValueError) as e:
+                logging.warning(f"SA2: Could not compact journal {self.path}: {e}")
+
+    def _lines(self) -> List[bytes]:
+        with open(self.path, "rb") as f:
+            return [line for line in f if line.endswith(b"\n")]
+
+    def close(self):
+        """Write the remaining records and stop the writer."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._file.close()
+        if self.observe in observers:
+            observers.remove(self.observe)
+
+
+_journals: Dict[str, Journal] = {}
+_lock = threading.Lock()
+
+
+def is_attached(path: Union[str, Path]) -> bool:
+    """Whether `attach` opened the journal at `path` in this process."""
+    return str(Path(path).resolve()) in _journals
+
+
+def attach(path: Union[str, Path], d: Dict[str, Any]) -> Journal:
+    """
+    Open the journal at `path` once per process, replay it into `d` and start
+    recording the increments to it.
+    """
+    key = str(Path(path).resolve())
+    with _lock:
+        if key not in _journals:
+            journal = Journal(path)
+            replayed = journal.recover(d)
+            if replayed:
+                logging.warning(f"SA2: Replayed {replayed} records from {path}")
+            observers.append(journal.observe)
+            _journals[key] = journal
+        return _journals[key]
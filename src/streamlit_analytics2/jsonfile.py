@@ -0,0 +1,187 @@
+"""
+Load and save the analytics data as a json file.
+
+A file is only parsed again when its modification time or size changed since
+this process last loaded or saved it, so reruns no longer re-read it. With
+`merge=True`, external changes to the file are added to the live counts
+instead of replacing them.
+
+`save_seq` is written first, so `save_seq` can read it without parsing the
+file.
+"""
+
+import bisect
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Set, Tuple, Union
+
+from . import codec, columnar, interning, schema
+from .state import history_lock
+
+TOTALS = ["total_pageviews", "total_script_runs", "total_time_seconds"]
+
+# Resolved path -> (mtime_ns, size) when last seen, and the file contents at
+# that point if the file is merged, possibly dictionary-encoded.
+_seen: Dict[str, Tuple[Tuple[int, int], Optional[Dict[str, Any]]]] = {}
+# Resolved paths of files that could not be loaded, see `is_unreadable`.
+_unreadable: Set[str] = set()
+_lock = threading.Lock()
+
+_SAVE_SEQ = re.compile(rb'\{\s*"save_seq"\s*:\s*(\d+)')
+
+
+def _signature(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _parse(raw: bytes) -> Dict[str, Any]:
+    json_data = codec.load_data(raw)
+    if interning.is_encoded(json_data):
+        json_data = interning.decode(json_data)
+    return schema.upgrade(json_data)
+
+
+def load(path: Union[str, Path], data: Dict[str, Any], merge: bool = False) -> bool:
+    """
+    Load the json file at `path` into `data` if it changed.
+
+    Returns
+    -------
+    bool
+        Whether the file was read. Raises FileNotFoundError if it is missing.
+    """
+    path = Path(path)
+    key = str(path.resolve())
+    with _lock:
+        signature = _signature(path)
+        seen = _seen.get(key)
+        if seen is not None and seen[0] == signature:
+            return False
+
+        try:
+            json_data = _parse(path.read_bytes())
+        except Exception:
+            _unreadable.add(key)
+            raise
+        _unreadable.discard(key)
+        if merge and seen is not None and seen[1] is not None:
+            old = seen[1]
+            if interning.is_encoded(old):
+                old = interning.decode(old)
+            columnar.adopt(data)
+            add_delta(data, json_data, old)
+            # Saves of other processes count too, see `save_seq`.
+            data["save_seq"] = max(
+                data.get("save_seq", 0), json_data.get("save_seq", 0)
+            )
+        else:
+            # This assumes you want json_data to overwrite existing keys in data
+            data.update({k: json_data[k] for k in json_data if k in data})
+        _seen[key] = (signature, json_data if merge else None)
+        return True
+
+
+def is_unreadable(path: Union[str, Path]) -> bool:
+    """
+    Whether the last `load` of `path` failed, e.g. it is corrupt or does not
+    match the schema. Saving would replace the counts it holds.
+    """
+    return str(Path(path).resolve()) in _unreadable
+
+
+def save_seq(path: Union[str, Path]) -> int:
+    """The `save_seq` of the data in the json file at `path`, 0 if it has none."""
+    path = Path(path)
+    with open(path, "rb") as f:
+        match = _SAVE_SEQ.match(f.read(64))
+    if match is not None:
+        return int(match.group(1))
+    # e.g. a file written by an older version or another tool.
+    return int(_parse(path.read_bytes()).get("save_seq", 0))
+
+
+def mark_seen(path: Union[str, Path], contents: Optional[Dict[str, Any]] = None):
+    """
+    Treat the file at `path` as loaded, e.g. after restoring it from a newer
+    checkpoint. With `merge=True`, `contents` is what it held.
+    """
+    path = Path(path)
+    with _lock:
+        _seen[str(path.resolve())] = (_signature(path), contents)
+
+
+def save(path: Union[str, Path], data: Dict[str, Any], merge: bool = False) -> int:
+    """
+    Write `data` to `path`, dictionary-encoded, and remember it as this
+    process's version.
+
+    Returns
+    -------
+    int
+        Number of bytes written.
+    """
+    path = Path(path)
+    # Ensure the directory containing the file exists
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with history_lock:
+        # Dictionary-encoded, see `interning.py`. The counters are copied.
+        encoded = {"save_seq": data.get("save_seq", 0), **interning.encode(data)}
+        raw = codec.dumps(encoded)
+    with _lock:
+        path.write_bytes(raw)
+        # Later changes to the file are measured against what we wrote,
+        # decoded only once the file changed.
+        _seen[str(path.resolve())] = (
+            _signature(path),
+            encoded if merge else None,
+        )
+    return len(raw)
+
+
+def _widgets_delta(live: Dict[Any, Any], new: Dict[Any, Any], old: Dict[Any, Any]):
+    for label, counts in new.items():
+        before = old.get(label, {} if isinstance(counts, dict) else 0)
+        if isinstance(counts, dict):
+            if not isinstance(before, dict):
+                before = {}
+            target = live.setdefault(label, {})
+            if not isinstance(target, dict):
+                continue
+            for value, n in counts.items():
+                target[value] = target.get(value, 0) + n - before.get(value, 0)
+        elif not isinstance(before, dict) and not isinstance(live.get(label, 0), dict):
+            live[label] = live.get(label, 0) + counts - before
+
+
+def add_delta(live: Dict[str, Any], new: Dict[str, Any], old: Dict[str, Any]):
+    """Add the changes from `old` to `new` (both file contents) to `live`."""
+    for key in TOTALS:
+        live[key] = live.get(key, 0) + new.get(key, 0) - old.get(key, 0)
+    _widgets_delta(live["widgets"], new.get("widgets", {}), old.get("widgets", {}))
+
+    history = live["per_day"]
+    old_rows = {day: i for i, day in enumerate(old.get("per_day", {}).get("days", []))}
+    new_history = new.get("per_day", {})
+    for i, day in enumerate(new_history.get("days", [])):
+        j = bisect.bisect_left(history["days"], day)
+        if j == len(history["days"]) or history["days"][j] != day:
+            history.insert_day(j, day)
+        k = old_rows.get(day)
+        for col in ["pageviews", "script_runs", "session_time_seconds"]:
+            after = _row(new_history, col, i, 0)
+            history[col][j] += after - _row(old.get("per_day", {}), col, k, 0)
+        _widgets_delta(
+            history["widgets"][j],
+            _row(new_history, "widgets", i, {}),
+            _row(old.get("per_day", {}), "widgets", k, {}),
+        )
+
+
+def _row(history: Dict[str, Any], col: str, i: Optional[int], default: Any):
+    """Entry `i` of a history column, `default` if it does not exist."""
+    values = history.get(col, [])
+    if i is None or i >= len(values):
+        return default
+    return values[i]
@@ -0,0 +1,57 @@
+"""
+Script run latency per page.
+
+`stop_tracking` measures how long each rerun took with a monotonic clock and
+counts it in a quantile sketch (see `sketches.py`) per page, overall and per
+day. Per-day sketches are kept for `LATENCY_DAYS` days.
+"""
+
+import datetime
+from typing import Any, Dict, List, Optional
+
+from . import sketches
+
+LATENCY_DAYS = 90
+
+
+def observe(d: Dict[str, Any], page: str, seconds: float, day: Optional[str] = None):
+    """Count a run of `page` that took `seconds` in `d["latency"]`."""
+    day = str(datetime.date.today()) if day is None else day
+    latency = d.setdefault("latency", {"pages": {}, "days": {}})
+    for buckets in [latency["pages"], latency["days"].setdefault(day, {})]:
+        if page not in buckets:
+            buckets[page] = sketches.new()
+        sketches.add(buckets[page], seconds)
+
+    if len(latency["days"]) > LATENCY_DAYS:
+        cutoff = str(
+            datetime.date.fromisoformat(day) - datetime.timedelta(LATENCY_DAYS)
+        )
+        for old in [k for k in latency["days"] if k <= cutoff]:
+            del latency["days"][old]
+
+
+def summary(d: Dict[str, Any], day: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Runs and p50/p95/p99 latency in ms per page, overall or for `day`."""
+    latency = d.get("latency", {"pages": {}, "days": {}})
+    pages = latency["pages"] if day is None else latency["days"].get(day, {})
+    rows = []
+    for page, sketch in pages.items():
+        row: Dict[str, Any] = {"page": page, "runs": sketch["count"]}
+        for p in [50, 95, 99]:
+            row[f"p{p}_ms"] = (sketches.quantile(sketch, p / 100) or 0.0) * 1000
+        rows.append(row)
+    return sorted(rows, key=lambda row: -row["p95_ms"])
+
+
+def merge(latency: Dict[str, Any], other: Dict[str, Any]):
+    """Add the sketches of `other` to those of `latency`, both `d["latency"]`."""
+    targets = [(latency["pages"], other.get("pages", {}))]
+    for day, pages in other.get("days", {}).items():
+        targets.append((latency["days"].setdefault(day, {}), pages))
+    for target, pages in targets:
+        for page, sketch in pages.items():
+            if page in target:
+                sketches.merge(target[page], sketch)
+            else:
+                target[page] = sketch
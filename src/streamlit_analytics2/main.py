@@ -2,18 +2,56 @@
 Main API functions for the user to start and stop analytics tracking.
 """
 
+import copy
 import datetime
-import json
 import logging
+import threading
+import time
 from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
-from typing import Optional, Union
+from typing import Any, Callable, Dict, Iterable, Optional, Union
 
 import streamlit as st
 
-from . import config, display, firestore, utils  # noqa: F811 F401
-from . import wrappers as _wrap
-from .state import data, reset_data, session_data
+from . import (  # noqa: F811 F401
+    aggregates,
+    checkpoint,
+    columnar,
+    config,
+    display,
+    firestore,
+    firestore_async,
+    forms,
+    interning,
+    journal,
+    jsonfile,
+    latency,
+    metrics,
+    policies,
+    retention,
+    runlog,
+    sampling,
+    shm,
+    snapshots,
+    uploads,
+    utils,
+    widgets,
+)
+from .state import (
+    activate_session,
+    compact_strings,
+    current_session,
+    data,
+    history_lock,
+    record,
+    reset_data,
+    session_data,
+    sessions,
+    set_tracked,
+    strings,
+    use_state_dict,
+)
 
 # from streamlit_searchbox import st_searchbox
 
@@ -27,14 +65,16 @@ from .state import data, reset_data, session_data
 # logging.info("SA2: Streamlit-analytics2 successfully imported")
 
 
-def update_session_stats():
+def update_session_stats(retention_policy: Optional[retention.Policy] = None):
     """
     Update the session data with the current state.
 
     Parameters
     ----------
-    data_dict : Dict[str, Any]
-        Data, either aggregate or session-specific.
+    retention_policy : retention.Policy, optional
+        `detail_days`, `weekly_days` and `value_horizon_days` for
+        `retention.compact`. If given, expired per-day history is rolled up
+        in the background.
 
     Returns
     -------
@@ -44,56 +84,263 @@ def update_session_stats():
     today = str(datetime.date.today())
     now = datetime.datetime.now()
 
-    dicts = [data, session_data]
-
-    for d in dicts:
-        # Allow backwards compatiability with old data structure and firestore
-        new_list = [0 for i in range(len(d["per_day"]["days"]))]
-        new_list_widgets = [{} for i in range(len(d["per_day"]["days"]))]
-
-        if d["per_day"]["days"][-1] != today:
-            # Fill in all but last missing day (which will be appended later)
-            if "session_time_seconds" not in d["per_day"]:
-                d["per_day"]["session_time_seconds"] = new_list
-            if "widgets" not in d["per_day"]:
-                d["per_day"]["widgets"] = new_list_widgets
-
-            # TODO: Insert 0 for all days between today and last entry.
-            d["per_day"]["days"].append(today)
-            d["per_day"]["pageviews"].append(0)
-            d["per_day"]["script_runs"].append(0)
-            d["per_day"]["session_time_seconds"].append(0)
-            d["per_day"]["widgets"].append({})
-
-        # Ensure all days have session_time_seconds and widgets even when
-        # per_day includes today already
-        if "session_time_seconds" not in d["per_day"] or len(
-            d["per_day"]["session_time_seconds"]
-        ) < len(d["per_day"]["days"]):
-            d["per_day"]["session_time_seconds"] = new_list
-        if "widgets" not in d["per_day"] or len(d["per_day"]["widgets"]) < len(
-            d["per_day"]["days"]
-        ):
-            d["per_day"]["widgets"] = new_list_widgets
-
-        d["total_script_runs"] += 1
-        d["per_day"]["script_runs"][-1] += 1
-        d["per_day"]["session_time_seconds"][-1] += (
-            now - st.session_state.last_time
-        ).total_seconds()
-
-        d["total_time_seconds"] += (now - st.session_state.last_time).total_seconds()
+    elapsed = (now - st.session_state.last_time).total_seconds()
+
+    # The session's own dict, as retention may compact it on another thread.
+    dicts = [data, current_session()]
+
+    # Applied and recorded together, see `journal.Journal.observe`.
+    with history_lock:
+        for d in dicts:
+            # Older data was upgraded when loaded, see `schema.py`.
+            new_day = d["per_day"]["days"][-1] != today
+            if new_day:
+                # TODO: Insert 0 for all days between today and last entry.
+                d["per_day"].append_day(today)
+
+            d["total_script_runs"] += 1
+            d["per_day"]["script_runs"][-1] += 1
+            d["per_day"]["session_time_seconds"][-1] += elapsed
+
+            d["total_time_seconds"] += elapsed
+            if not st.session_state.user_tracked:
+                d["total_pageviews"] += 1
+                d["per_day"]["pageviews"][-1] += 1
+
+            # Only look for expired history when a day or a session starts.
+            if retention_policy is not None and (
+                new_day or not st.session_state.user_tracked
+            ):
+                if retention.is_due(d, **retention_policy):
+                    retention.schedule(d, **retention_policy)
+
+        record(("script_runs",))
+        record(("session_time_seconds",), elapsed)
         if not st.session_state.user_tracked:
-            d["total_pageviews"] += 1
-            d["per_day"]["pageviews"][-1] += 1
+            record(("pageviews",))
 
     st.session_state.user_tracked = True
     st.session_state.last_time = now
 
 
-def _track_user():
+def _firestore_load(async_firestore, *args, **kwargs):
+    """Load from firestore, waiting for the async backend if it is used."""
+    metrics.inc("sa2_firestore_calls", op="load")
+    if async_firestore:
+        firestore_async.load(*args, **kwargs).result()
+    else:
+        firestore.load(*args, **kwargs)
+
+
+def _log_save_error(future):
+    if future.exception() is not None:
+        metrics.inc("sa2_write_errors", target="firestore")
+        logging.error(f"SA2: Error saving data to firestore: {future.exception()}")
+
+
+@contextmanager
+def _counting_errors():
+    """Count an error of a synchronous firestore write, then raise it."""
+    try:
+        yield
+    except Exception:
+        metrics.inc("sa2_write_errors", target="firestore")
+        raise
+
+
+def _firestore_save(async_firestore, *args, on_saved=None, **kwargs):
+    """
+    Save to firestore, in the background if the async backend is used.
+
+    `on_saved` is called once the data is stored.
+    """
+    metrics.inc("sa2_firestore_calls", op="save")
+    with metrics.timer("sa2_save_seconds", target="firestore"):
+        if async_firestore:
+            future = firestore_async.save(*args, **kwargs)
+            future.add_done_callback(_log_save_error)
+            if on_saved is not None:
+                future.add_done_callback(lambda f: f.exception() is None and on_saved())
+        else:
+            with _counting_errors():
+                firestore.save(*args, **kwargs)
+            if on_saved is not None:
+                on_saved()
+
+
+def _firestore_save_sessions(async_firestore, *args, **kwargs):
+    """Save evicted sessions, in the background if the async backend is used."""
+    metrics.inc("sa2_firestore_calls", op="save_sessions")
+    if async_firestore:
+        firestore_async.save_sessions(*args, **kwargs).add_done_callback(
+            _log_save_error
+        )
+    else:
+        with _counting_errors():
+            firestore.save_sessions(*args, **kwargs)
+
+
+# Monotonic time of the last save to the durable backends, see `journal.py`.
+_flushed = {"time": float("-inf")}
+
+
+def _flush_due(
+    journal_file, flush_interval: float, sync: bool = False
+) -> Optional[Callable[[], None]]:
+    """
+    Decide whether to save to the durable backends, after waiting until the
+    journal is committed if `sync` is set.
+
+    Returns a function that compacts the journal once saved if a save is due.
+    """
+    wal = journal.attach(journal_file, data)
+    # Otherwise the writer commits within `journal.COMMIT_INTERVAL`.
+    committed = wal.commit(timeout=5) if sync else wal.error is None
+    if not committed:
+        logging.error(f"SA2: Journal {journal_file} not committed, saving now")
+    elif time.monotonic() - _flushed["time"] < flush_interval:
+        return None
+    _flushed["time"] = time.monotonic()
+    # The save holds at least the records up to now, see `Journal.observe`.
+    return partial(wal.compact, wal.seq)
+
+
+def _drain_evicted() -> Dict[str, Dict[str, Any]]:
+    """Take the evicted sessions that were not written yet, see `sessions.py`."""
+    evicted = sessions.drain_evicted()
+    if evicted:
+        # Their labels and values may not be counted anywhere else.
+        compact_strings()
+    return evicted
+
+
+# Set by a `lazy_history` load until the history of the counts document has
+# been merged into `data`. `future` is the pending load on the async backend.
+_history = {"pending": False, "future": None}
+_history_lock = threading.Lock()
+
+
+def _merge_history(loaded):
+    """Add the history counted so far to the loaded history and keep that."""
+    for key in firestore.HISTORY_FIELDS:
+        if key == "latency" and key in loaded:
+            merged = {"pages": {}, "days": {}}
+            latency.merge(merged, loaded[key])
+            latency.merge(merged, data[key])
+            data[key] = merged
+        elif key == "uploads" and key in loaded:
+            merged = {}
+            uploads.merge(merged, loaded[key])
+            uploads.merge(merged, data[key])
+            data[key] = merged
+        elif key in loaded:
+            # Converted by `schema.upgrade` as it was loaded.
+            history = loaded[key]
+            columnar.add_history(history, data[key])
+            data[key] = history
+    interning.intern_data(data, strings)
+    _history["pending"] = False
+    _history["future"] = None
+
+
+def _load_history(async_firestore, wait, *args, **kwargs):
+    """
+    Merge the history left out by a `lazy_history` load into `data`.
+
+    This runs once the script has rendered. The async backend only starts the
+    load and merges it in a later run, unless `wait` is set, e.g. to show the
+    dashboard.
+    """
+    with _history_lock:
+        if not _history["pending"]:
+            return
+        if not async_firestore:
+            metrics.inc("sa2_firestore_calls", op="load_history")
+            _merge_history(firestore.load_history(*args, **kwargs))
+            return
+        if _history["future"] is None:
+            metrics.inc("sa2_firestore_calls", op="load_history")
+            _history["future"] = firestore_async.load_history(*args, **kwargs)
+        if not (wait or _history["future"].done()):
+            return
+        try:
+            loaded = _history["future"].result()
+        except Exception as e:
+            logging.error(f"SA2: Error loading history from firestore: {e}")
+            _history["future"] = None
+            return
+        _merge_history(loaded)
+
+
+def _persisted():
+    """`data` as it should be saved, without history that is not loaded yet."""
+    if not _history["pending"]:
+        return data
+    return {k: v for k, v in data.items() if k not in firestore.HISTORY_FIELDS}
+
+
+def _restore_checkpoint(
+    path: Union[str, Path],
+    load_from_json: Optional[Union[str, Path]],
+    merge_json: bool,
+    **firestore_kwargs,
+) -> bool:
+    """
+    Load the checkpoint at `path` into `data` unless the stored data is newer.
+
+    Every save to the durable backends increments `data["save_seq"]`, so the
+    stored data is newer if it was saved more often than the checkpointed.
+    """
+    taken = checkpoint.save_seq(path)
+    if taken is None:
+        return False
+    try:
+        if load_from_json is not None and Path(load_from_json).exists():
+            if jsonfile.save_seq(load_from_json) > taken:
+                return False
+        if (
+            firestore_kwargs["service_account_json"] is not None
+            or firestore_kwargs["streamlit_secrets_firestore_key"] is not None
+        ):
+            metrics.inc("sa2_firestore_calls", op="save_seq")
+            stored = firestore.save_seq(**firestore_kwargs)
+            if stored is not None and stored > taken:
+                return False
+        restored = checkpoint.load(path)[1]
+    except Exception as e:
+        logging.warning(f"SA2: Could not restore checkpoint {path}: {e}")
+        return False
+    data.update(restored)
+    _intern_loaded()
+    if load_from_json is not None and Path(load_from_json).exists():
+        # The file holds nothing the checkpoint does not, skip parsing it.
+        jsonfile.mark_seen(load_from_json, copy.deepcopy(data) if merge_json else None)
+    return True
+
+
+def _changed_in_place():
+    """Drop what the dashboard derived from counts changed without `record`."""
+    snapshots.invalidate()
+    aggregates.invalidate()
+
+
+def _store_keys():
+    """Number of widget and value counters in `data`."""
+    return sum(
+        len(counts) if isinstance(counts, dict) else 1
+        for counts in data["widgets"].values()
+    )
+
+
+def _intern_loaded():
+    """Share label and value strings of freshly loaded data with the wrappers."""
+    for d in [data, session_data]:
+        interning.intern_data(d, strings)
+
+
+def _track_user(retention_policy: Optional[retention.Policy] = None):
     """Track individual pageviews by storing user id to session state."""
-    update_session_stats()
+    update_session_stats(retention_policy)
 
 
 def start_tracking(
@@ -107,6 +354,23 @@ def start_tracking(
     streamlit_secrets_firestore_key: Optional[str] = None,
     session_id: Optional[str] = None,
     verbose=False,
+    async_firestore: bool = False,
+    retention_policy: Optional[retention.Policy] = None,
+    shared_memory: Optional[str] = None,
+    merge_json: bool = False,
+    max_sessions: int = 1000,
+    session_ttl_seconds: Optional[float] = None,
+    lazy_history: bool = False,
+    numeric_sketches: bool = False,
+    value_policy: Optional[Dict[str, Dict[str, Any]]] = None,
+    hash_uploads: bool = False,
+    metrics_file: Optional[Union[str, Path]] = None,
+    metrics_port: Optional[int] = None,
+    sample_rate: float = 1.0,
+    checkpoint_file: Optional[Union[str, Path]] = None,
+    checkpoint_interval: float = checkpoint.INTERVAL,
+    journal_file: Optional[Union[str, Path]] = None,
+    flush_interval: float = 10.0,
 ):
     """
     Start tracking user inputs to a streamlit app.
@@ -114,149 +378,174 @@ def start_tracking(
     If you call this function directly, you NEED to call `streamlit_analytics.
     stop_tracking()` at the end of your streamlit script. For a more convenient
     interface, wrap your streamlit calls in `with streamlit_analytics.track():`.
+
+    With `sample_rate` below 1, only that share of sessions is tracked, see
+    `sampling.py`. The others keep the original streamlit functions. With
+    `hash_uploads`, uploaded files are hashed in the background to count
+    duplicates, see `uploads.py`. With `journal_file`, increments are written
+    to a local journal and the durable backends are only saved every
+    `flush_interval` seconds, see `journal.py`.
     """
 
+    sampling.validate(sample_rate)
+    tracked = sampling.is_sampled(sampling.session_key(session_id), sample_rate)
+    # Widgets patched for other sessions call through for this one if unset.
+    set_tracked(tracked)
+    if not tracked:
+        return
+
+    metrics.start_run()
+    runlog.start(verbose)
+    if metrics_port is not None:
+        metrics.serve(metrics_port)
+
+    # Every worker loads the stored data: the counts are then taken from the
+    # segment, but the rest (e.g. per_week, sketches) is saved as loaded by
+    # whichever worker leads.
+    counters = None
+    if shared_memory is not None:
+        counters = shm.attach(shared_memory)
+
+    # Each session_id counts into its own session_data, see `sessions.py`.
+    if session_id is not None:
+        sessions.max_sessions = max_sessions
+        sessions.ttl_seconds = session_ttl_seconds
+        activate_session(sessions.get(session_id)[0])
+    else:
+        activate_session()
+    load_data = not data["loaded_from_firestore"]
+    load_session = session_id is not None and not session_data["loaded_from_firestore"]
+    if journal_file is not None:
+        if shared_memory is not None:
+            raise ValueError("journal_file cannot be used with shared_memory")
+        # Loaded with the data, the journal is replayed from there.
+        data.setdefault("journal", {})
+
+    # A checkpoint newer than the stored data replaces loading it.
     if (
-        streamlit_secrets_firestore_key is not None
-        and not data["loaded_from_firestore"]
+        load_data
+        and checkpoint_file is not None
+        and _restore_checkpoint(
+            checkpoint_file,
+            load_from_json,
+            merge_json,
+            service_account_json=firestore_key_file,
+            collection_name=firestore_collection_name,
+            document_name=firestore_document_name,
+            streamlit_secrets_firestore_key=streamlit_secrets_firestore_key,
+            firestore_project_name=firestore_project_name,
+        )
     ):
+        data["loaded_from_firestore"] = True
+        load_data = False
+
+    if streamlit_secrets_firestore_key is not None and (load_data or load_session):
         # Load both global and session data in a single call
-        firestore.load(
-            data=data,
+        _firestore_load(
+            async_firestore,
+            data=data if load_data else None,
             service_account_json=None,
             collection_name=firestore_collection_name,
             document_name=firestore_document_name,
             streamlit_secrets_firestore_key=streamlit_secrets_firestore_key,
             firestore_project_name=firestore_project_name,
             session_id=session_id,  # This will load global and session data
+            field_paths=firestore.TRACKING_FIELDS if lazy_history else None,
         )
-        data["loaded_from_firestore"] = True
+        if load_data:
+            data["loaded_from_firestore"] = True
+            _history["pending"] = lazy_history
         session_data["loaded_from_firestore"] = True
-        if verbose:
-            print("Loaded count data from firestore:")
-            print(data)
-            if session_id:
-                print("Loaded session count data from firestore:")
-                print(session_data)
-            print()
-
-    elif firestore_key_file and not data["loaded_from_firestore"]:
-        firestore.load(
-            data,
+        _intern_loaded()
+        runlog.event(
+            "SA2: Loaded from firestore: %s widgets, session %s",
+            len(data["widgets"]),
+            session_id,
+        )
+
+    elif firestore_key_file and (load_data or load_session):
+        _firestore_load(
+            async_firestore,
+            data if load_data else None,
             firestore_key_file,
             firestore_collection_name,
             firestore_document_name,
             streamlit_secrets_firestore_key=None,
             firestore_project_name=None,
             session_id=session_id,
+            field_paths=firestore.TRACKING_FIELDS if lazy_history else None,
         )
-        data["loaded_from_firestore"] = True
+        if load_data:
+            data["loaded_from_firestore"] = True
+            _history["pending"] = lazy_history
         session_data["loaded_from_firestore"] = True
-        if verbose:
-            print("Loaded count data from firestore:")
-            print(data)
-            print()
+        _intern_loaded()
+        runlog.event(
+            "SA2: Loaded from firestore: %s widgets, session %s",
+            len(data["widgets"]),
+            session_id,
+        )
 
     if load_from_json is not None:
         log_msg_prefix = "Loading data from json: "
         try:
-            # Using Path's read_text method simplifies file reading
-            json_contents = Path(load_from_json).read_text()
-            json_data = json.loads(json_contents)
-
-            # Use dict.update() for a cleaner way to merge the data
-            # This assumes you want json_data to overwrite existing keys in data
-            data.update({k: json_data[k] for k in json_data if k in data})
-
-            if verbose:
-                logging.info(f"{log_msg_prefix}{load_from_json}")
-                logging.info("SA2: Success! Loaded data:")
-                logging.info(data)
+            # The file is only parsed again if it changed since the last rerun.
+            if jsonfile.load(load_from_json, data, merge=merge_json):
+                interning.intern_data(data, strings)
+                # Merging changes the counts in place.
+                _changed_in_place()
+
+                runlog.event(
+                    "SA2: %s%s (%s widgets)",
+                    log_msg_prefix,
+                    load_from_json,
+                    len(data["widgets"]),
+                )
 
         except FileNotFoundError:
-            if verbose:
-                logging.warning(f"SA2: File {load_from_json} not found")
-                logging.warning("Proceeding with empty data.")
+            runlog.event(
+                "SA2: File %s not found, proceeding with empty data", load_from_json
+            )
 
         except Exception as e:
             # Catch-all for any other exceptions, log the error
             logging.error(f"SA2: Error loading data from {load_from_json}: {e}")
 
+    if journal_file is not None and not journal.is_attached(journal_file):
+        journal.attach(journal_file, data)
+        # Replaying changes the counts in place.
+        _changed_in_place()
+
+    if counters is not None:
+        counters.share(data)
+
     # Reset session state.
     if "user_tracked" not in st.session_state:
         st.session_state.user_tracked = False
     if "state_dict" not in st.session_state:
         st.session_state.state_dict = {}
+    use_state_dict(st.session_state.state_dict)
     if "last_time" not in st.session_state:
         st.session_state.last_time = datetime.datetime.now()
-    _track_user()
-
-    # widgets.monkey_patch()
-    # Monkey-patch streamlit to call the wrappers above.
-    st.button = _wrap.button(_orig_button)
-    st.checkbox = _wrap.checkbox(_orig_checkbox)
-    st.radio = _wrap.select(_orig_radio)
-    st.selectbox = _wrap.select(_orig_selectbox)
-    st.multiselect = _wrap.multiselect(_orig_multiselect)
-    st.slider = _wrap.value(_orig_slider)
-    st.select_slider = _wrap.select(_orig_select_slider)
-    st.text_input = _wrap.value(_orig_text_input)
-    st.number_input = _wrap.value(_orig_number_input)
-    st.text_area = _wrap.value(_orig_text_area)
-    st.date_input = _wrap.value(_orig_date_input)
-    st.time_input = _wrap.value(_orig_time_input)
-    st.file_uploader = _wrap.file_uploader(_orig_file_uploader)
-    st.color_picker = _wrap.value(_orig_color_picker)
-    # new elements, testing
-    # st.download_button = _wrap.value(_orig_download_button)
-    # st.link_button = _wrap.value(_orig_link_button)
-    # st.page_link = _wrap.value(_orig_page_link)
-    # st.toggle = _wrap.value(_orig_toggle)
-    # st.camera_input = _wrap.value(_orig_camera_input)
-    st.chat_input = _wrap.chat_input(_orig_chat_input)
-    # st_searchbox = _wrap.searchbox(_orig_searchbox)
-
-    st.sidebar.button = _wrap.button(_orig_sidebar_button)  # type: ignore
-    st.sidebar.radio = _wrap.select(_orig_sidebar_radio)  # type: ignore
-    st.sidebar.selectbox = _wrap.select(_orig_sidebar_selectbox)  # type: ignore
-    st.sidebar.multiselect = _wrap.multiselect(_orig_sidebar_multiselect)  # type: ignore
-    st.sidebar.slider = _wrap.value(_orig_sidebar_slider)  # type: ignore
-    st.sidebar.select_slider = _wrap.select(_orig_sidebar_select_slider)  # type: ignore
-    st.sidebar.text_input = _wrap.value(_orig_sidebar_text_input)  # type: ignore
-    st.sidebar.number_input = _wrap.value(_orig_sidebar_number_input)  # type: ignore
-    st.sidebar.text_area = _wrap.value(_orig_sidebar_text_area)  # type: ignore
-    st.sidebar.date_input = _wrap.value(_orig_sidebar_date_input)  # type: ignore
-    st.sidebar.time_input = _wrap.value(_orig_sidebar_time_input)  # type: ignore
-    st.sidebar.file_uploader = _wrap.file_uploader(_orig_sidebar_file_uploader)  # type: ignore
-    st.sidebar.color_picker = _wrap.value(_orig_sidebar_color_picker)  # type: ignore
-    # st.sidebar.st_searchbox = _wrap.searchbox(_orig_sidebar_searchbox)
-
-    # new elements, testing
-    # st.sidebar.download_button = _wrap.value(_orig_sidebar_download_button)
-    # st.sidebar.link_button = _wrap.value(_orig_sidebar_link_button)
-    # st.sidebar.page_link = _wrap.value(_orig_sidebar_page_link)
-    # st.sidebar.toggle = _wrap.value(_orig_sidebar_toggle)
-    # st.sidebar.camera_input = _wrap.value(_orig_sidebar_camera_input)
-
-    # replacements = {
-    #     "button": _wrap.bool,
-    #     "checkbox": _wrap.bool,
-    #     "radio": _wrap.select,
-    #     "selectbox": _wrap.select,
-    #     "multiselect": _wrap.multiselect,
-    #     "slider": _wrap.value,
-    #     "select_slider": _wrap.select,
-    #     "text_input": _wrap.value,
-    #     "number_input": _wrap.value,
-    #     "text_area": _wrap.value,
-    #     "date_input": _wrap.value,
-    #     "time_input": _wrap.value,
-    #     "file_uploader": _wrap.file_uploader,
-    #     "color_picker": _wrap.value,
-    # }
-
-    if verbose:
-        logging.info("\nSA2:  streamlit-analytics2 verbose logging")
+    # Monotonic start of this run, see `latency.py`.
+    st.session_state.run_started = time.perf_counter()
+    # Counts are scaled up by the rate of their day when shown.
+    sampling.record_rate(
+        data.setdefault("sample_rates", {}), str(datetime.date.today()), sample_rate
+    )
+    with metrics.timer("sa2_update_session_stats_seconds"):
+        _track_user(retention_policy)
+
+    # Bounds on the size of recorded text values, see `policies.py`.
+    policy = value_policy or {}
+    for widget_policy in policy.values():
+        policies.validate(widget_policy)
+
+    # Widgets in forms are tracked when the form is submitted.
+    forms.start()
+
+    # Monkey-patch streamlit to call the wrappers, see `widgets.py`.
+    widgets.monkey_patch(numeric_sketches, policy, hash_uploads)
 
 
 def stop_tracking(
@@ -270,149 +559,209 @@ def stop_tracking(
     streamlit_secrets_firestore_key: Optional[str] = None,
     session_id: Optional[str] = None,
     verbose=False,
+    async_firestore: bool = False,
+    shared_memory: Optional[str] = None,
+    merge_json: bool = False,
+    metrics_file: Optional[Union[str, Path]] = None,
+    sample_rate: float = 1.0,
+    checkpoint_file: Optional[Union[str, Path]] = None,
+    checkpoint_interval: float = checkpoint.INTERVAL,
+    journal_file: Optional[Union[str, Path]] = None,
+    flush_interval: float = 10.0,
+    sync_journal: bool = False,
 ):
     """
     Stop tracking user inputs to a streamlit app.
 
     Should be called after `streamlit-analytics.start_tracking()`.
     This method also shows the analytics results below your app if you attach
-    `?analytics=on` to the URL.
+    `?analytics=on` to the URL. With `sync_journal`, it waits until the
+    increments of the run are written to `journal_file`.
     """
 
-    if verbose:
-        logging.info("SA2: Finished script execution. New data:")
-        logging.info(
-            "%s", data
-        )  # Use %s and pass data to logging to handle complex objects
-        logging.info("%s", "-" * 80)  # For separators or multi-line messages
+    query_params = st.query_params
+    show_results = "analytics" in query_params and "on" in query_params["analytics"]
 
-    # widgets.reset_widgets()
+    # Sessions left out of the sample were never tracked.
+    if not sampling.is_sampled(sampling.session_key(session_id), sample_rate):
+        if show_results:
+            _show_results(unsafe_password)
+        return
 
     # Reset streamlit functions.
-    st.button = _orig_button
-    st.checkbox = _orig_checkbox
-    st.radio = _orig_radio
-    st.selectbox = _orig_selectbox
-    st.multiselect = _orig_multiselect
-    st.slider = _orig_slider
-    st.select_slider = _orig_select_slider
-    st.text_input = _orig_text_input
-    st.number_input = _orig_number_input
-    st.text_area = _orig_text_area
-    st.date_input = _orig_date_input
-    st.time_input = _orig_time_input
-    st.file_uploader = _orig_file_uploader
-    st.color_picker = _orig_color_picker
-    # new elements, testing
-    # st.download_button = _orig_download_button
-    # st.link_button = _orig_link_button
-    # st.page_link = _orig_page_link
-    # st.toggle = _orig_toggle
-    # st.camera_input = _orig_camera_input
-    st.chat_input = _orig_chat_input
-    # st.searchbox = _orig_searchbox
-    st.sidebar.button = _orig_sidebar_button  # type: ignore
-    st.sidebar.checkbox = _orig_sidebar_checkbox  # type: ignore
-    st.sidebar.radio = _orig_sidebar_radio  # type: ignore
-    st.sidebar.selectbox = _orig_sidebar_selectbox  # type: ignore
-    st.sidebar.multiselect = _orig_sidebar_multiselect  # type: ignore
-    st.sidebar.slider = _orig_sidebar_slider  # type: ignore
-    st.sidebar.select_slider = _orig_sidebar_select_slider  # type: ignore
-    st.sidebar.text_input = _orig_sidebar_text_input  # type: ignore
-    st.sidebar.number_input = _orig_sidebar_number_input  # type: ignore
-    st.sidebar.text_area = _orig_sidebar_text_area  # type: ignore
-    st.sidebar.date_input = _orig_sidebar_date_input  # type: ignore
-    st.sidebar.time_input = _orig_sidebar_time_input  # type: ignore
-    st.sidebar.file_uploader = _orig_sidebar_file_uploader  # type: ignore
-    st.sidebar.color_picker = _orig_sidebar_color_picker  # type: ignore
-    # new elements, testing
-    # st.sidebar.download_button = _orig_sidebar_download_button
-    # st.sidebar.link_button = _orig_sidebar_link_button
-    # st.sidebar.page_link = _orig_sidebar_page_link
-    # st.sidebar.toggle = _orig_sidebar_toggle
-    # st.sidebar.camera_input = _orig_sidebar_camera_input
-    # st.sidebar.searchbox = _orig_sidebar_searchbox
+    widgets.reset_widgets()
+    set_tracked(False)
+    use_state_dict(None)
+    forms.end()
     # Save count data to firestore.
     # TODO: Maybe don't save on every iteration but on regular intervals in a
     # background thread.
 
-    if (
+    # Record how long this run of the script took, per page.
+    if "run_started" in st.session_state:
+        elapsed = time.perf_counter() - st.session_state.run_started
+        page = utils.page_name()
+        for d in [data, current_session()]:
+            latency.observe(d, page, elapsed)
+
+    # With shared memory, only the leader worker persists the aggregate counts.
+    persist = True
+    if shared_memory is not None:
+        counters = shm.attach(shared_memory)
+        with metrics.timer("sa2_flush_seconds"):
+            counters.flush()
+        metrics.set_gauge("sa2_lost_increments", counters.lost())
+        persist = counters.is_leader()
+        if persist:
+            counters.apply(data)
+            _changed_in_place()
+
+    # With a journal, increments are safe on local disk once committed, and
+    # the durable backends are only saved every `flush_interval` seconds.
+    on_saved = None
+    flush = True
+    if journal_file is not None:
+        on_saved = _flush_due(journal_file, flush_interval, sync_journal)
+        flush = on_saved is not None
+    if flush and persist:
+        # Newer than any checkpoint of the data so far, see `_restore_checkpoint`.
+        data["save_seq"] = data.get("save_seq", 0) + 1
+
+    secrets_firestore = (
         streamlit_secrets_firestore_key is not None
         and firestore_project_name is not None
-    ):
-        if verbose:
-            print("Saving count data to firestore:")
-            print(data)
-            print("Saving session count data to firestore:")
-            print(session_data)
-            print()
+    )
+    key_file_firestore = (
+        streamlit_secrets_firestore_key is None
+        and firestore_project_name is None
+        and firestore_key_file
+    )
+    if not (secrets_firestore or key_file_firestore):
+        # Evicted sessions are only kept to be written to Firestore.
+        _drain_evicted()
+
+    if flush and secrets_firestore:
+        _load_history(
+            async_firestore,
+            show_results,
+            service_account_json=None,
+            collection_name=firestore_collection_name,
+            document_name=firestore_document_name,
+            streamlit_secrets_firestore_key=streamlit_secrets_firestore_key,
+            firestore_project_name=firestore_project_name,
+        )
+        runlog.event("SA2: Saving to firestore, session %s", session_id)
 
         # Save both global and session data in a single call
-        firestore.save(
-            data=data,
+        _firestore_save(
+            async_firestore,
+            data=_persisted() if persist else None,
             service_account_json=None,
             collection_name=firestore_collection_name,
             document_name=firestore_document_name,
             streamlit_secrets_firestore_key=streamlit_secrets_firestore_key,
             firestore_project_name=firestore_project_name,
             session_id=session_id,  # This will save global and session data
+            on_saved=on_saved,
         )
-
-    elif (
-        streamlit_secrets_firestore_key is None
-        and firestore_project_name is None
-        and firestore_key_file
-    ):
-        if verbose:
-            print("Saving count data to firestore:")
-            print(data)
-            print()
-        firestore.save(
-            data,
+        # Sessions evicted from memory are written one last time, in one batch.
+        evicted = _drain_evicted()
+        if evicted:
+            _firestore_save_sessions(
+                async_firestore,
+                evicted,
+                service_account_json=None,
+                collection_name=firestore_collection_name,
+                streamlit_secrets_firestore_key=streamlit_secrets_firestore_key,
+                firestore_project_name=firestore_project_name,
+            )
+
+    elif flush and key_file_firestore:
+        _load_history(
+            async_firestore,
+            show_results,
+            firestore_key_file,
+            firestore_collection_name,
+            firestore_document_name,
+        )
+        runlog.event("SA2: Saving to firestore, session %s", session_id)
+        _firestore_save(
+            async_firestore,
+            _persisted() if persist else None,
             firestore_key_file,
             firestore_collection_name,
             firestore_document_name,
             streamlit_secrets_firestore_key=None,
             firestore_project_name=None,
             session_id=session_id,
+            on_saved=on_saved,
         )
+        evicted = _drain_evicted()
+        if evicted:
+            _firestore_save_sessions(
+                async_firestore,
+                evicted,
+                firestore_key_file,
+                firestore_collection_name,
+            )
 
     # Dump the data to json file if `save_to_json` is set.
     # TODO: Make sure this is not locked if writing from multiple threads.
 
     # Assuming 'data' is your data to be saved and 'save_to_json' is the path
     # to your json file.
-    if save_to_json is not None:
-        # Create a Path object for the file
-        file_path = Path(save_to_json)
-
-        # Ensure the directory containing the file exists
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-
-        # Open the file and dump the json data
-        with file_path.open("w") as f:
-            json.dump(data, f)
-
-        if verbose:
-            print("Storing results to file:", save_to_json)
+    if save_to_json is not None and jsonfile.is_unreadable(save_to_json):
+        # Its counts were never loaded, a save would replace them.
+        logging.error(f"SA2: Not saving over {save_to_json}, it failed to load")
+    elif save_to_json is not None and persist and flush:
+        with metrics.timer("sa2_save_seconds", target="json"):
+            written = jsonfile.save(save_to_json, data, merge=merge_json)
+        metrics.inc("sa2_bytes_written", written)
+        if on_saved is not None:
+            on_saved()
+
+        runlog.event("SA2: Stored %s bytes to %s", written, save_to_json)
+
+    # Unloaded lazy history would be missing from the checkpoint.
+    if checkpoint_file is not None and persist and not _history["pending"]:
+        checkpoint.periodic(checkpoint_file, data, checkpoint_interval)
+
+    metrics.set_gauge("sa2_store_keys", _store_keys())
+    metrics.set_gauge("sa2_sessions", len(sessions))
+    metrics.end_run()
+    if runlog.sampled():
+        runlog.end(page=utils.page_name(), sessions=len(sessions))
+    if metrics_file is not None:
+        metrics.write(metrics_file)
 
     # Show analytics results in the streamlit app if `?analytics=on` is set in
     # the URL.
-    query_params = st.query_params
-    if "analytics" in query_params and "on" in query_params["analytics"]:
+    if show_results:
+        if shared_memory is not None and not persist:
+            counters.apply(data)
+            _changed_in_place()
+        _show_results(unsafe_password)
+
+
+def _show_results(unsafe_password: Optional[str] = None):
+    @st.dialog("Streamlit-Analytics2", width="large")
+    def show_sa2(data, reset_data, unsafe_password):
 
-        @st.dialog("Streamlit-Analytics2", width="large")
-        def show_sa2(data, reset_data, unsafe_password):
+        tab1, tab2 = st.tabs(["Data", "Config"])
 
-            tab1, tab2 = st.tabs(["Data", "Config"])
+        with tab1:
+            display.show_results(data, reset_data, unsafe_password)
 
-            with tab1:
-                display.show_results(data, reset_data, unsafe_password)
+        with tab2:
+            config.show_config()
 
-            with tab2:
-                config.show_config()
+    def reset():
+        reset_data()
+        compact_strings(force=True)
+        _changed_in_place()
 
-        show_sa2(data, reset_data, unsafe_password)
+    # Render from a snapshot, other sessions keep changing `data` meanwhile.
+    show_sa2(snapshots.current(), reset, unsafe_password)
 
 
 @contextmanager
@@ -427,6 +776,24 @@ def track(
     streamlit_secrets_firestore_key: Optional[str] = None,
     session_id: Optional[str] = None,
     verbose=False,
+    async_firestore: bool = False,
+    retention_policy: Optional[retention.Policy] = None,
+    shared_memory: Optional[str] = None,
+    merge_json: bool = False,
+    max_sessions: int = 1000,
+    session_ttl_seconds: Optional[float] = None,
+    lazy_history: bool = False,
+    numeric_sketches: bool = False,
+    value_policy: Optional[Dict[str, Dict[str, Any]]] = None,
+    hash_uploads: bool = False,
+    metrics_file: Optional[Union[str, Path]] = None,
+    metrics_port: Optional[int] = None,
+    sample_rate: float = 1.0,
+    checkpoint_file: Optional[Union[str, Path]] = None,
+    checkpoint_interval: float = checkpoint.INTERVAL,
+    journal_file: Optional[Union[str, Path]] = None,
+    flush_interval: float = 10.0,
+    sync_journal: bool = False,
 ):
     """
     Context manager to start and stop tracking user inputs to a streamlit app.
@@ -446,6 +813,22 @@ def track(
             firestore_project_name=firestore_project_name,
             session_id=session_id,
             verbose=verbose,
+            async_firestore=async_firestore,
+            shared_memory=shared_memory,
+            retention_policy=retention_policy,
+            merge_json=merge_json,
+            max_sessions=max_sessions,
+            session_ttl_seconds=session_ttl_seconds,
+            lazy_history=lazy_history,
+            numeric_sketches=numeric_sketches,
+            value_policy=value_policy,
+            hash_uploads=hash_uploads,
+            metrics_port=metrics_port,
+            sample_rate=sample_rate,
+            checkpoint_file=checkpoint_file,
+            checkpoint_interval=checkpoint_interval,
+            journal_file=journal_file,
+            flush_interval=flush_interval,
         )
 
     else:
@@ -456,6 +839,22 @@ def track(
             load_from_json=load_from_json,
             session_id=session_id,
             verbose=verbose,
+            async_firestore=async_firestore,
+            shared_memory=shared_memory,
+            retention_policy=retention_policy,
+            merge_json=merge_json,
+            max_sessions=max_sessions,
+            session_ttl_seconds=session_ttl_seconds,
+            lazy_history=lazy_history,
+            numeric_sketches=numeric_sketches,
+            value_policy=value_policy,
+            hash_uploads=hash_uploads,
+            metrics_port=metrics_port,
+            sample_rate=sample_rate,
+            checkpoint_file=checkpoint_file,
+            checkpoint_interval=checkpoint_interval,
+            journal_file=journal_file,
+            flush_interval=flush_interval,
         )
     # Yield here to execute the code in the with statement. This will call the
     # wrappers above, which track all inputs.
@@ -472,6 +871,16 @@ def track(
             firestore_project_name=firestore_project_name,
             session_id=session_id,
             verbose=verbose,
+            async_firestore=async_firestore,
+            shared_memory=shared_memory,
+            merge_json=merge_json,
+            metrics_file=metrics_file,
+            sample_rate=sample_rate,
+            checkpoint_file=checkpoint_file,
+            checkpoint_interval=checkpoint_interval,
+            journal_file=journal_file,
+            flush_interval=flush_interval,
+            sync_journal=sync_journal,
         )
     else:
         stop_tracking(
@@ -482,63 +891,22 @@ def track(
             firestore_document_name=firestore_document_name,
             verbose=verbose,
             session_id=session_id,
+            async_firestore=async_firestore,
+            shared_memory=shared_memory,
+            merge_json=merge_json,
+            metrics_file=metrics_file,
+            sample_rate=sample_rate,
+            checkpoint_file=checkpoint_file,
+            checkpoint_interval=checkpoint_interval,
+            journal_file=journal_file,
+            flush_interval=flush_interval,
+            sync_journal=sync_journal,
         )
 
 
 if __name__ == "streamlit_analytics2.main":
     reset_data()
 
-    # widgets.copy_original()
-    # TODO need to fix the scope for this function call and then we can move
-    # these variable assignments to widgets.py
-
-    # Store original streamlit functions. They will be monkey-patched with some
-    # wrappers in `start_tracking` (see wrapper functions below).
-    _orig_button = st.button
-    _orig_checkbox = st.checkbox
-    _orig_radio = st.radio
-    _orig_selectbox = st.selectbox
-    _orig_multiselect = st.multiselect
-    _orig_slider = st.slider
-    _orig_select_slider = st.select_slider
-    _orig_text_input = st.text_input
-    _orig_number_input = st.number_input
-    _orig_text_area = st.text_area
-    _orig_date_input = st.date_input
-    _orig_time_input = st.time_input
-    _orig_file_uploader = st.file_uploader
-    _orig_color_picker = st.color_picker
-    # new elements, testing
-    # _orig_download_button = st.download_button
-    # _orig_link_button = st.link_button
-    # _orig_page_link = st.page_link
-    # _orig_toggle = st.toggle
-    # _orig_camera_input = st.camera_input
-    _orig_chat_input = st.chat_input
-    # _orig_searchbox = st_searchbox
-
-    _orig_sidebar_button = st.sidebar.button
-    _orig_sidebar_checkbox = st.sidebar.checkbox
-    _orig_sidebar_radio = st.sidebar.radio
-    _orig_sidebar_selectbox = st.sidebar.selectbox
-    _orig_sidebar_multiselect = st.sidebar.multiselect
-    _orig_sidebar_slider = st.sidebar.slider
-    _orig_sidebar_select_slider = st.sidebar.select_slider
-    _orig_sidebar_text_input = st.sidebar.text_input
-    _orig_sidebar_number_input = st.sidebar.number_input
-    _orig_sidebar_text_area = st.sidebar.text_area
-    _orig_sidebar_date_input = st.sidebar.date_input
-    _orig_sidebar_time_input = st.sidebar.time_input
-    _orig_sidebar_file_uploader = st.sidebar.file_uploader
-    _orig_sidebar_color_picker = st.sidebar.color_picker
-    # _orig_sidebar_searchbox = st.sidebar.st_searchbox
-    # new elements, testing
-    # _orig_sidebar_download_button = st.sidebar.download_button
-    # _orig_sidebar_link_button = st.sidebar.link_button
-    # _orig_sidebar_page_link = st.sidebar.page_link
-    # _orig_sidebar_toggle = st.sidebar.toggle
-    # _orig_sidebar_camera_input = st.sidebar.camera_input
-
 
 def delete_session_data(
     session_id: str,
@@ -553,12 +921,14 @@ def delete_session_data(
     if session_id is None or session_id == "":
         print("No session ID provided, skipping deletion")
         return
+    sessions.pop(session_id)
 
     if session_data["loaded_from_firestore"] and firestore_collection_name is None:
         raise ValueError(
             "firestore_collection_name must be provided if session data was loaded from firestore"
         )
     elif session_data["loaded_from_firestore"]:
+        metrics.inc("sa2_firestore_calls", op="delete")
         firestore.delete(
             session_id,
             firestore_collection_name,
@@ -566,3 +936,63 @@ def delete_session_data(
             streamlit_secrets_firestore_key=streamlit_secrets_firestore_key,
             firestore_project_name=firestore_project_name,
         )
+
+
+def delete_sessions_data(
+    firestore_collection_name: str,
+    session_ids: Optional[Iterable[str]] = None,
+    inactive_days: Optional[int] = None,
+    firestore_document_name: Optional[str] = "counts",
+    firestore_project_name: Optional[str] = None,
+    firestore_key_file: Optional[str] = None,
+    streamlit_secrets_firestore_key: Optional[str] = None,
+    max_workers: int = 4,
+    verbose=False,
+) -> Dict[str, float]:
+    """
+    Delete the data of many sessions from firestore.
+
+    Pass the `session_ids` to delete, e.g. a batch of erasure requests, or
+    `inactive_days` to delete every session without activity in that many
+    days. Deletes are committed in batches, `max_workers` at a time.
+
+    Returns
+    -------
+    Dict[str, float]
+        Number of `deleted` documents, elapsed `seconds` and `per_second`.
+    """
+    if (session_ids is None) == (inactive_days is None):
+        raise ValueError("Pass either session_ids or inactive_days")
+
+    predicate = None
+    if inactive_days is not None:
+        predicate = firestore.inactive_for(inactive_days)
+    else:
+
+        def _forget(ids):
+            for session_id in ids:
+                sessions.pop(session_id)
+                yield session_id
+
+        session_ids = _forget(session_ids)
+
+    def _progress(report):
+        if verbose:
+            logging.info(
+                "SA2: Deleted %d session documents (%.0f/s)",
+                report["deleted"],
+                report["per_second"],
+            )
+
+    metrics.inc("sa2_firestore_calls", op="bulk_delete")
+    return firestore.delete_many(
+        firestore_collection_name,
+        session_ids,
+        predicate,
+        service_account_json=firestore_key_file,
+        streamlit_secrets_firestore_key=streamlit_secrets_firestore_key,
+        firestore_project_name=firestore_project_name,
+        keep=[firestore_document_name],
+        max_workers=max_workers,
+        progress=_progress,
+    )
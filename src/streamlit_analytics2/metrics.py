@@ -0,0 +1,195 @@
+"""
+Metrics about streamlit-analytics2 itself, in OpenMetrics text format.
+
+Counters, gauges and summaries (count and sum of observed seconds) are kept
+in this process and can be rendered with `render`, written to a file with
+`write` or served over HTTP with `serve`, e.g. to alert when the tracking
+overhead exceeds a budget.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Name -> (type, help).
+METRICS = {
+    "sa2_runs": ("counter", "Tracked script runs."),
+    "sa2_wrapper_seconds": (
+        "summary",
+        "Time spent in the widget wrappers per run, without the widgets.",
+    ),
+    "sa2_update_session_stats_seconds": (
+        "summary",
+        "Time spent updating the session stats per run.",
+    ),
+    "sa2_save_seconds": ("summary", "Time spent saving, by target."),
+    "sa2_flush_seconds": ("summary", "Time spent flushing to shared memory."),
+    "sa2_bytes_written": ("counter", "Bytes written to the json file."),
+    "sa2_firestore_calls": ("counter", "Firestore calls, by operation."),
+    "sa2_write_errors": ("counter", "Saves that failed."),
+    "sa2_lost_increments": (
+        "gauge",
+        "Increments dropped because the shared memory segment was full.",
+    ),
+    "sa2_store_keys": ("gauge", "Widget and value counters in the data."),
+    "sa2_sessions": ("gauge", "Sessions held in memory."),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_values: Dict[Tuple[str, Labels], List[float]] = {}
+_lock = threading.Lock()
+# Wrapper time of the run executing on this thread.
+_run = threading.local()
+
+
+def _key(name: str, labels: Dict[str, str]) -> Tuple[str, Labels]:
+    if name not in METRICS:
+        raise KeyError(f"Unknown metric {name}")
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels: str):
+    """Increment counter `name`."""
+    key = _key(name, labels)
+    with _lock:
+        _values.setdefault(key, [0.0])[0] += amount
+
+
+def set_gauge(name: str, value: float, **labels: str):
+    """Set gauge `name` to `value`."""
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = [value]
+
+
+def observe(name: str, seconds: float, **labels: str):
+    """Add an observation to summary `name`."""
+    key = _key(name, labels)
+    with _lock:
+        summary = _values.setdefault(key, [0.0, 0.0])
+        summary[0] += 1
+        summary[1] += seconds
+
+
+@contextmanager
+def timer(name: str, **labels: str):
+    """Observe the time spent in the `with` block in summary `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def start_run():
+    """Start accumulating wrapper time for the run on this thread."""
+    _run.wrapper_seconds = 0.0
+
+
+def add_wrapper_time(seconds: float):
+    """Count `seconds` of wrapper time for the run on this thread."""
+    _run.wrapper_seconds = getattr(_run, "wrapper_seconds", 0.0) + seconds
+
+
+def end_run():
+    """Record the wrapper time of the run on this thread."""
+    inc("sa2_runs")
+    observe("sa2_wrapper_seconds", getattr(_run, "wrapper_seconds", 0.0))
+    _run.wrapper_seconds = 0.0
+
+
+def snapshot() -> Dict[str, float]:
+    """Current values as `{sample name: value}`, e.g. for the dashboard."""
+    samples = {}
+    for line in render().splitlines():
+        if not line.startswith("#"):
+            sample, value = line.rsplit(" ", 1)
+            samples[sample] = float(value)
+    return samples
+
+
+def _sample(name: str, labels: Labels, value: float) -> str:
+    if labels:
+        text = ",".join(f'{k}="{v}"' for k, v in labels)
+        name = f"{name}{{{text}}}"
+    return f"{name} {value:g}"
+
+
+def render() -> str:
+    """Return all metrics in OpenMetrics text format."""
+    with _lock:
+        values = {key: list(value) for key, value in _values.items()}
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        samples = sorted((k, v) for k, v in values.items() if k[0] == name)
+        if not samples:
+            continue
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"# HELP {name} {help_text}")
+        for (_, labels), value in samples:
+            if kind == "counter":
+                lines.append(_sample(f"{name}_total", labels, value[0]))
+            elif kind == "gauge":
+                lines.append(_sample(name, labels, value[0]))
+            else:
+                lines.append(_sample(f"{name}_count", labels, value[0]))
+                lines.append(_sample(f"{name}_sum", labels, value[1]))
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+_written: Dict[str, float] = {}
+
+
+def write(path: Union[str, Path], min_interval: float = 1.0):
+    """Write `render()` to `path` atomically, at most every `min_interval` s."""
+    now = time.monotonic()
+    if now - _written.get(str(path), -min_interval) < min_interval:
+        return
+    _written[str(path)] = now
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(render())
+    os.replace(tmp, path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_servers: Dict[int, ThreadingHTTPServer] = {}
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve `render()` over HTTP on a background thread, once per port."""
+    with _lock:
+        if port not in _servers:
+            server = ThreadingHTTPServer((host, port), _Handler)
+            threading.Thread(
+                target=server.serve_forever, name="sa2-metrics", daemon=True
+            ).start()
+            _servers[port] = server
+        return _servers[port]
+
+
+def reset():
+    """Forget all values, e.g. between tests."""
+    with _lock:
+        _values.clear()
@@ -0,0 +1,75 @@
+"""
+Policies that bound the size of recorded widget values.
+
+A policy is a dict with a `mode`:
+
+- `"keep"`: record the value as it is (the default).
+- `"truncate"`: record the first `max_chars` characters.
+- `"digest"`: record a fixed-size hash of the value. With `side_store`, the
+  full text is also written once per distinct value to that directory, named
+  after the hash.
+- `"ignore"`: count the interaction but not the value.
+
+Only string values are affected, e.g. of st.text_area or st.chat_input.
+"""
+
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+MODES = ["keep", "truncate", "digest", "ignore"]
+DEFAULT_MAX_CHARS = 200
+# Recorded instead of the value by the "ignore" mode.
+IGNORED = "(value not recorded)"
+
+
+def validate(policy: Optional[Dict[str, Any]]):
+    """Raise a ValueError if `policy` is malformed."""
+    if policy is None:
+        return
+    if policy.get("mode") not in MODES:
+        raise ValueError(f"Value policy mode must be one of {MODES}, got {policy}")
+    if int(policy.get("max_chars", DEFAULT_MAX_CHARS)) < 1:
+        raise ValueError(f"max_chars must be positive, got {policy}")
+
+
+def _digest(value: str) -> str:
+    return hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+
+
+def _store(side_store, digest: str, value: str):
+    path = Path(side_store) / f"{digest}.txt"
+    if path.exists():
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(value)
+    except OSError as e:
+        logging.warning(f"SA2: Could not store value {digest}: {e}")
+
+
+def apply(value: Any, policy: Optional[Dict[str, Any]]) -> Tuple[Any, Any]:
+    """
+    Apply `policy` to a widget value.
+
+    Returns
+    -------
+    Tuple[Any, Any]
+        The key to count the value under, and a token of bounded size to
+        detect whether the value changed since the last run.
+    """
+    if policy is None or policy["mode"] == "keep" or not isinstance(value, str):
+        return value, value
+    digest = _digest(value)
+    mode = policy["mode"]
+    if mode == "truncate":
+        max_chars = int(policy.get("max_chars", DEFAULT_MAX_CHARS))
+        key = value if len(value) <= max_chars else value[:max_chars] + "…"
+    elif mode == "digest":
+        key = f"#{digest}"
+        if policy.get("side_store") is not None:
+            _store(policy["side_store"], digest, value)
+    else:
+        key = IGNORED
+    return key, digest
@@ -0,0 +1,306 @@
+"""
+Merge the analytics of several replicas, e.g. one json file per server.
+
+Every counter only grows, so the data of a replica is a G-counter: two
+versions of the same replica are joined by taking the larger value of every
+counter (per day and per widget value), and the replicas are then added up.
+A replica is identified by the `replica_id` stored in its data when it was
+created, so a copied or moved file is still the same replica. Before two
+versions are joined, the days and weeks one of them already rolled up (see
+`retention.py`) are rolled up in the other one as well, and values one of
+them dropped are collapsed into totals, so each count is joined with the same
+count of the other version.
+Merging is thereby commutative, associative and idempotent. The same file can
+be merged twice, or merged results merged again, without counting anything
+twice.
+
+The merged file holds the combined data, which can be loaded like any other
+analytics file, plus the state of every replica under `replicas`.
+
+Run `python -m streamlit_analytics2.replicas OUTPUT INPUT...` to merge files,
+parsed in parallel by a process pool.
+"""
+
+import argparse
+import copy
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from . import (
+    codec,
+    columnar,
+    interning,
+    latency,
+    retention,
+    schema,
+    sketches,
+    uploads,
+)
+from .jsonfile import TOTALS
+
+# Replica id -> data of that replica, as json.
+States = Dict[str, Dict[str, Any]]
+
+_COLUMNS = ["pageviews", "script_runs", "session_time_seconds"]
+# Format of `start_time`, see `state._reset`.
+_START_FORMAT = "%d %b %Y, %H:%M:%S"
+
+
+def _earliest(starts: List[str]) -> str:
+    def parse(start):
+        try:
+            return datetime.datetime.strptime(start, _START_FORMAT)
+        except ValueError:
+            return datetime.datetime.max
+
+    return min(starts, key=parse)
+
+
+def _join_widgets(a: Dict[Any, Any], b: Dict[Any, Any]) -> Dict[Any, Any]:
+    joined = dict(a)
+    for label, counts in b.items():
+        mine = joined.get(label)
+        if isinstance(counts, dict) and isinstance(mine, dict):
+            joined[label] = {
+                value: max(n, mine.get(value, 0)) for value, n in counts.items()
+            }
+            for value, n in mine.items():
+                joined[label].setdefault(value, n)
+        elif mine is None:
+            joined[label] = counts
+        else:
+            # Values were dropped in one version, see `retention._drop_values`.
+            joined[label] = max(_total(counts), _total(mine))
+    return joined
+
+
+def _total(counts: Any) -> Any:
+    return sum(counts.values()) if isinstance(counts, dict) else counts
+
+
+# History key -> the key its old entries are rolled up into, by bucket.
+_ROLLUPS = [
+    ("per_day", "per_week", retention._week_start),
+    ("per_week", "per_month", retention._month_start),
+]
+
+
+def _align(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return `a`, with the entries `b` already rolled up rolled up as well.
+
+    `b` rolled up everything before the first entry it kept. `a` is copied
+    before it is changed.
+    """
+    copied = False
+    for src, dst, bucket_of in _ROLLUPS:
+        kept = b.get(src, {}).get("days", [])
+        days = a.get(src, {}).get("days", [])
+        if not (kept and b.get(dst, {}).get("days") and days and days[0] < kept[0]):
+            continue
+        if not copied:
+            histories = [key for key in columnar.HISTORY_KEYS if key in a]
+            a = {**a, **{key: copy.deepcopy(a[key]) for key in histories}}
+            copied = True
+        a.setdefault(dst, {"days": [], "widgets": [], **{c: [] for c in _COLUMNS}})
+        retention._roll(
+            a[src],
+            a[dst],
+            datetime.date.fromisoformat(kept[0]),
+            bucket_of,
+            len(days),
+        )
+    return a
+
+
+def _join_history(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    rows: Dict[str, Dict[str, Any]] = {}
+    for history in [a, b]:
+        for i, day in enumerate(history.get("days", [])):
+            row = {col: history[col][i] for col in _COLUMNS}
+            row["widgets"] = history["widgets"][i]
+            if day in rows:
+                for col in _COLUMNS:
+                    row[col] = max(row[col], rows[day][col])
+                row["widgets"] = _join_widgets(rows[day]["widgets"], row["widgets"])
+            rows[day] = row
+    days = sorted(rows)
+    joined: Dict[str, Any] = {"days": days}
+    for col in _COLUMNS + ["widgets"]:
+        joined[col] = [rows[day][col] for day in days]
+    return joined
+
+
+def _larger(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    """Per key, the sketch that counted more values."""
+    joined = dict(a)
+    for key, sketch in b.items():
+        if key not in joined or sketch["count"] > joined[key]["count"]:
+            joined[key] = sketch
+    return joined
+
+
+def _larger_uploads(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    """Per widget, the upload statistics that counted more files."""
+    joined = dict(a)
+    for label, stats in b.items():
+        if label not in joined or stats["files"] > joined[label]["files"]:
+            joined[label] = stats
+    return joined
+
+
+def _join_latency(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    a_days, b_days = a.get("days", {}), b.get("days", {})
+    days = {
+        day: _larger(a_days.get(day, {}), b_days.get(day, {}))
+        for day in set(a_days) | set(b_days)
+    }
+    return {"pages": _larger(a.get("pages", {}), b.get("pages", {})), "days": days}
+
+
+def join(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    """Join two versions of the data of the same replica, counter by counter."""
+    a, b = _align(a, b), _align(b, a)
+    joined = {**a, **b}
+    for key in TOTALS:
+        joined[key] = max(a.get(key, 0), b.get(key, 0))
+    joined["widgets"] = _join_widgets(a.get("widgets", {}), b.get("widgets", {}))
+    for key in columnar.HISTORY_KEYS:
+        if key in joined:
+            joined[key] = _join_history(a.get(key, {}), b.get(key, {}))
+    if "sketches" in joined:
+        joined["sketches"] = _larger(a.get("sketches", {}), b.get("sketches", {}))
+    if "latency" in joined:
+        joined["latency"] = _join_latency(a.get("latency", {}), b.get("latency", {}))
+    if "uploads" in joined:
+        joined["uploads"] = _larger_uploads(a.get("uploads", {}), b.get("uploads", {}))
+    if "sample_rates" in joined:
+        joined["sample_rates"] = {
+            **a.get("sample_rates", {}),
+            **b.get("sample_rates", {}),
+        }
+    starts = [d["start_time"] for d in [a, b] if "start_time" in d]
+    if starts:
+        joined["start_time"] = _earliest(starts)
+    joined.pop("replicas", None)
+    return joined
+
+
+def join_states(a: States, b: States) -> States:
+    """Join two sets of replica states, replica by replica."""
+    joined = dict(a)
+    for replica, state in b.items():
+        joined[replica] = join(joined[replica], state) if replica in a else state
+    return joined
+
+
+def combine(states: States) -> Dict[str, Any]:
+    """Add up the data of all replicas."""
+    combined: Dict[str, Any] = {
+        "loaded_from_firestore": False,
+        "widgets": {},
+        "sketches": {},
+        "latency": {"pages": {}, "days": {}},
+        "uploads": {},
+        **{key: 0 for key in TOTALS},
+        **{key: columnar.PerDay() for key in columnar.HISTORY_KEYS},
+    }
+    starts = []
+    for state in states.values():
+        for key in TOTALS:
+            combined[key] += state.get(key, 0)
+        columnar._add_widgets(combined["widgets"], state.get("widgets", {}))
+        for key in columnar.HISTORY_KEYS:
+            history = state.get(key)
+            if history and history.get("days"):
+                columnar.add_history(combined[key], history)
+        for label, sketch in state.get("sketches", {}).items():
+            if label in combined["sketches"]:
+                sketches.merge(combined["sketches"][label], sketch)
+            else:
+                combined["sketches"][label] = copy.deepcopy(sketch)
+        latency.merge(combined["latency"], copy.deepcopy(state.get("latency", {})))
+        uploads.merge(combined["uploads"], copy.deepcopy(state.get("uploads", {})))
+        if "start_time" in state:
+            starts.append(state["start_time"])
+        # Replicas are expected to sample at the same rates.
+        combined.setdefault("sample_rates", {}).update(state.get("sample_rates", {}))
+    combined["start_time"] = (
+        _earliest(starts) if starts else datetime.datetime.now().strftime(_START_FORMAT)
+    )
+    return combined
+
+
+def load_states(path: Union[str, Path], replica_id: Optional[str] = None) -> States:
+    """
+    Return the replica states in the file at `path`.
+
+    A merged file holds its replicas, any other analytics file is the data of
+    the replica `replica_id`, by default the `replica_id` stored in the file.
+    Files written before replicas stored their id fall back to the resolved
+    path of the file, so `a.json` and `./a.json` are the same replica.
+    """
+    raw = codec.loads(Path(path).read_bytes())
+    if interning.is_encoded(raw):
+        raw = interning.decode(raw)
+    if "replicas" in raw:
+        return {r: schema.upgrade(state) for r, state in raw["replicas"].items()}
+    replica_id = replica_id or raw.get("replica_id") or str(Path(path).resolve())
+    return {replica_id: schema.upgrade(raw)}
+
+
+def _load_chunk(paths: Iterable[str]) -> States:
+    states: States = {}
+    for path in paths:
+        states = join_states(states, load_states(path))
+    return states
+
+
+def merge_files(
+    paths: Iterable[Union[str, Path]], max_workers: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Merge the analytics files at `paths`.
+
+    Files are parsed and joined in chunks by `max_workers` processes, by
+    default one per CPU.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The combined data, with the replica states under `replicas`.
+    """
+    names = [str(path) for path in paths]
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(names)))
+    states: States = {}
+    if workers == 1:
+        states = _load_chunk(names)
+    else:
+        chunks = [names[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(workers) as executor:
+            for chunk_states in executor.map(_load_chunk, chunks):
+                states = join_states(states, chunk_states)
+    merged = combine(states)
+    merged["replicas"] = states
+    return merged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m streamlit_analytics2.replicas",
+        description="Merge streamlit-analytics2 json files of several replicas.",
+    )
+    parser.add_argument("output", help="merged file to write")
+    parser.add_argument("inputs", nargs="+", help="json files to merge")
+    parser.add_argument("--workers", type=int, default=None, help="processes")
+    args = parser.parse_args(argv)
+    merged = merge_files(args.inputs, args.workers)
+    Path(args.output).write_bytes(codec.dumps(merged))
+    print(f"Merged {len(merged['replicas'])} replicas into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
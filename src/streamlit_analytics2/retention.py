@@ -0,0 +1,224 @@
+"""
+Bounded retention for the per-day history.
+
+Recent days keep full widget detail in `per_day`. Older days are rolled up
+into weekly buckets (`per_week`), older weeks into monthly buckets
+(`per_month`), and monthly buckets past a horizon only keep per-widget totals
+instead of per-value counts. All three share the `per_day` layout, with the
+first day of the bucket in `days`, so the dashboard can chart them together.
+"""
+
+import bisect
+import datetime
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Set, TypedDict
+
+from .columnar import PerDay
+from .state import compact_strings, history_lock
+
+DETAIL_DAYS = 90
+WEEKLY_DAYS = 365
+VALUE_HORIZON_DAYS = 730
+
+# Number of entries moved per compaction step, so each step stays short.
+BATCH = 30
+
+COLUMNS = ["pageviews", "script_runs", "session_time_seconds"]
+
+_running: Set[int] = set()
+_running_lock = threading.Lock()
+
+
+class Policy(TypedDict, total=False):
+    """The `retention_policy` of `start_tracking`, arguments of `compact`."""
+
+    detail_days: int
+    weekly_days: int
+    value_horizon_days: int
+
+
+def _week_start(day: datetime.date) -> datetime.date:
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def _month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def _add_widgets(target: Dict[str, Any], widgets: Dict[str, Any]):
+    """Add the widget counters of `widgets` into `target`."""
+    for label, counts in widgets.items():
+        if isinstance(counts, dict):
+            bucket = target.setdefault(label, {})
+            if not isinstance(bucket, dict):
+                # Value detail was already dropped for this label.
+                target[label] = bucket + sum(counts.values())
+                continue
+            for value, n in counts.items():
+                bucket[value] = bucket.get(value, 0) + n
+        else:
+            target[label] = target.get(label, 0) + counts
+
+
+def _roll(
+    src: Dict[str, list],
+    dst: Dict[str, list],
+    cutoff: datetime.date,
+    bucket_of: Callable[[datetime.date], datetime.date],
+    limit: int,
+    keep_last: bool = False,
+) -> int:
+    """Move up to `limit` leading entries of `src` older than `cutoff`."""
+    days = src["days"]
+    # `keep_last` protects today's entry, the tracker keeps writing into it.
+    end = len(days) - 1 if keep_last else len(days)
+    k = 0
+    while k < limit and k < end and datetime.date.fromisoformat(days[k]) < cutoff:
+        k += 1
+
+    widgets = src.get("widgets", [])
+    for i in range(k):
+        bucket = str(bucket_of(datetime.date.fromisoformat(days[i])))
+        j = bisect.bisect_left(dst["days"], bucket)
+        if j == len(dst["days"]) or dst["days"][j] != bucket:
+            if isinstance(dst, PerDay):
+                dst.insert_day(j, bucket)
+            else:
+                dst["days"].insert(j, bucket)
+                for col in COLUMNS:
+                    dst[col].insert(j, 0)
+                dst["widgets"].insert(j, {})
+        for col in COLUMNS:
+            if i < len(src.get(col, [])):
+                dst[col][j] += src[col][i]
+        if i < len(widgets):
+            _add_widgets(dst["widgets"][j], widgets[i])
+
+    # Delete in place so that concurrent `[-1]` updates are not lost.
+    if k and isinstance(src, PerDay):
+        src.delete_front(k)
+    elif k:
+        for col in ["days", "widgets"] + COLUMNS:
+            if col in src:
+                del src[col][:k]
+    return k
+
+
+def _drop_values(history: Dict[str, list], cutoff: datetime.date, limit: int) -> int:
+    """Collapse per-value counts into totals for buckets older than `cutoff`."""
+    done = 0
+    for day, widgets in zip(history["days"], history["widgets"]):
+        if done >= limit or datetime.date.fromisoformat(day) >= cutoff:
+            break
+        for label, counts in widgets.items():
+            if isinstance(counts, dict):
+                widgets[label] = sum(counts.values())
+                done += 1
+    return done
+
+
+def is_due(
+    d: Dict[str, Any],
+    detail_days: int = DETAIL_DAYS,
+    weekly_days: int = WEEKLY_DAYS,
+    value_horizon_days: int = VALUE_HORIZON_DAYS,
+    today: Optional[datetime.date] = None,
+) -> bool:
+    """Check whether `d` holds entries that should be rolled up."""
+    today = today or datetime.date.today()
+    days = d["per_day"]["days"]
+    if len(days) > 1 and days[0] < str(today - datetime.timedelta(detail_days)):
+        return True
+    weeks = d["per_week"]["days"]
+    if weeks and weeks[0] < str(today - datetime.timedelta(weekly_days)):
+        return True
+    # Values are dropped oldest first, so only the newest expired month counts.
+    months = d["per_month"]
+    i = bisect.bisect_left(
+        months["days"], str(today - datetime.timedelta(value_horizon_days))
+    )
+    return i > 0 and any(isinstance(v, dict) for v in months["widgets"][i - 1].values())
+
+
+def compact(
+    d: Dict[str, Any],
+    detail_days: int = DETAIL_DAYS,
+    weekly_days: int = WEEKLY_DAYS,
+    value_horizon_days: int = VALUE_HORIZON_DAYS,
+    max_entries: int = BATCH,
+    today: Optional[datetime.date] = None,
+) -> int:
+    """
+    Run one bounded compaction step on the analytics dict `d`.
+
+    Returns
+    -------
+    int
+        Number of entries that were rolled up. 0 means nothing is left to do.
+    """
+    if detail_days < 1:
+        raise ValueError("detail_days must be at least 1")
+    today = today or datetime.date.today()
+    moved = _roll(
+        d["per_day"],
+        d["per_week"],
+        today - datetime.timedelta(days=detail_days),
+        _week_start,
+        max_entries,
+        keep_last=True,
+    )
+    moved += _roll(
+        d["per_week"],
+        d["per_month"],
+        today - datetime.timedelta(days=weekly_days),
+        _month_start,
+        max_entries - moved,
+    )
+    moved += _drop_values(
+        d["per_month"],
+        today - datetime.timedelta(days=value_horizon_days),
+        max_entries - moved,
+    )
+    return moved
+
+
+def _compact_all(d: Dict[str, Any], policy: Policy):
+    total = 0
+    try:
+        while True:
+            # Saves copy or encode the history under the same lock.
+            with history_lock:
+                moved = compact(d, **policy)
+            if not moved:
+                break
+            total += moved
+            # Give the script threads a chance to run between steps.
+            time.sleep(0.001)
+        if total:
+            # Dropped values no longer need their strings.
+            compact_strings()
+    finally:
+        with _running_lock:
+            _running.discard(id(d))
+
+
+def schedule(
+    d: Dict[str, Any],
+    detail_days: int = DETAIL_DAYS,
+    weekly_days: int = WEEKLY_DAYS,
+    value_horizon_days: int = VALUE_HORIZON_DAYS,
+):
+    """Compact `d` on a background thread unless a pass is already running."""
+    policy: Policy = {
+        "detail_days": detail_days,
+        "weekly_days": weekly_days,
+        "value_horizon_days": value_horizon_days,
+    }
+    with _running_lock:
+        if id(d) in _running:
+            return
+        _running.add(id(d))
+    threading.Thread(
+        target=_compact_all, args=(d, policy), name="sa2-retention", daemon=True
+    ).start()
@@ -0,0 +1,80 @@
+"""
+Verbose logging of tracked script runs.
+
+Instead of the whole data, a sampled run logs what it changed: the counters
+it incremented (collected through a `state.record` observer) and its timing.
+Messages go to the "streamlit_analytics2.runlog" logger and are only
+formatted if its level is enabled, so verbose logging stays cheap however
+large the data grows.
+"""
+
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .state import observers
+
+logger = logging.getLogger(__name__)
+
+# State of the run executing on this thread.
+_run = threading.local()
+_runs = itertools.count()
+
+
+def _observe(day: str, key: tuple, amount: float):
+    """`state.record` observer that collects the increments of a sampled run."""
+    delta: Optional[Dict[str, float]] = getattr(_run, "delta", None)
+    if delta is not None:
+        name = "/".join(str(part) for part in key)
+        delta[name] = delta.get(name, 0) + amount
+
+
+def _configure():
+    # Without any logging set up, verbose=True should still show something.
+    if logger.level == logging.NOTSET and not logging.getLogger().handlers:
+        logger.setLevel(logging.INFO)
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+        logger.addHandler(handler)
+
+
+def start(verbose=False):
+    """
+    Decide whether the run starting on this thread is logged.
+
+    `verbose` is False, True to log every run or N to log one in N runs.
+    """
+    _run.delta = None
+    if not verbose:
+        return
+    _configure()
+    if not logger.isEnabledFor(logging.INFO) or next(_runs) % int(verbose):
+        return
+    if _observe not in observers:
+        observers.append(_observe)
+    _run.delta = {}
+    _run.started = time.perf_counter()
+
+
+def sampled() -> bool:
+    """Whether the run executing on this thread is logged."""
+    return getattr(_run, "delta", None) is not None
+
+
+def event(msg: str, *args: Any):
+    """Log `msg % args` if this run is sampled."""
+    if sampled():
+        logger.info(msg, *args)
+
+
+def end(**extra: Any):
+    """Log the increments, timing and `extra` fields of this run if sampled."""
+    if not sampled():
+        return
+    elapsed = time.perf_counter() - _run.started
+    fields = {"elapsed_ms": round(elapsed * 1000, 3), "delta": _run.delta}
+    fields.update(extra)
+    logger.info("SA2: Finished script run %s", fields, extra={"sa2": fields})
+    _run.delta = None
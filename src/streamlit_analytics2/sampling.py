@@ -0,0 +1,93 @@
+"""
+Statistical sampling of sessions for high-traffic apps.
+
+With a `sample_rate` below 1, a session is only tracked with that probability.
+The decision is derived from a hash of the session id, so a session is either
+always or never tracked. Counts of the tracked sessions are scaled up by
+`1 / sample_rate` when shown, with a confidence interval.
+
+The rate may change between deploys, so `data["sample_rates"]` maps each day
+the rate changed on to the new rate. Counts are scaled by the rate of the day
+they were counted on, and days before the first entry were not sampled. On
+the day of a change, all counts are taken to be sampled at the new rate.
+"""
+
+import bisect
+import hashlib
+import math
+from typing import Dict, Iterable, Optional, Tuple
+
+# z-score of a two-sided 95% confidence interval.
+Z_95 = 1.96
+
+
+def validate(rate: float):
+    """Raise a ValueError unless `0 < rate <= 1`."""
+    if not 0 < rate <= 1:
+        raise ValueError(f"sample_rate must be in (0, 1], got {rate}")
+
+
+def session_key(session_id: Optional[str] = None) -> str:
+    """`session_id`, or the id streamlit gave the running session."""
+    if session_id is not None:
+        return session_id
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    return "" if ctx is None else ctx.session_id
+
+
+def is_sampled(key: str, rate: float) -> bool:
+    """Whether the session `key` is tracked at `rate`."""
+    if rate >= 1:
+        return True
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") < rate * 2**64
+
+
+def record_rate(rates: Dict[str, float], day: str, rate: float):
+    """Note in `rates` that sessions are sampled at `rate` from `day` on."""
+    if rate_on(rates, day) != rate:
+        rates[day] = rate
+
+
+def rate_on(rates: Dict[str, float], day: str) -> float:
+    """The rate sessions were sampled at on `day`, see the module docstring."""
+    changes = sorted(rates)
+    i = bisect.bisect_right(changes, day)
+    return rates[changes[i - 1]] if i else 1.0
+
+
+def effective_rate(
+    counts: Iterable[Tuple[float, float]], default: float = 1.0
+) -> float:
+    """
+    The single rate that scales the sum of several counts to the sum of their
+    estimates, given `(count, rate)` pairs. `default` if nothing was counted.
+    """
+    total = 0.0
+    estimated = 0.0
+    for count, rate in counts:
+        total += count
+        estimated += count / rate
+    return total / estimated if estimated else default
+
+
+def estimate(count: float, rate: float, z: float = Z_95) -> Tuple[float, float, float]:
+    """
+    Estimate a total from the `count` of the sampled sessions.
+
+    Every counted event is treated as sampled independently with probability
+    `rate`. Events of one session are sampled together, so for e.g. script
+    runs the interval is a lower bound on the uncertainty.
+
+    Returns
+    -------
+    Tuple[float, float, float]
+        The estimate and the lower and upper bound of its confidence interval.
+    """
+    if rate >= 1:
+        return count, count, count
+    total = count / rate
+    half_width = z * math.sqrt(count * (1 - rate)) / rate
+    return total, max(count, total - half_width), total + half_width
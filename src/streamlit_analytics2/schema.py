@@ -0,0 +1,74 @@
+"""
+Versioned shape of the analytics data.
+
+Saved data carries a `schema_version`. `upgrade` runs the migrations from a
+document's version to `VERSION` once, when it is loaded from JSON, Firestore
+or a checkpoint, so the tracking code can rely on the current shape instead
+of checking it on every rerun.
+
+Versions
+--------
+0
+    No `schema_version`. The history columns `session_time_seconds` and
+    `widgets` were added later and may be missing or shorter than `days`.
+1
+    Every history column has one entry per day.
+"""
+
+import logging
+from typing import Any, Callable, Dict, List
+
+from .columnar import HISTORY_KEYS, PerDay, adopt
+
+VERSION = 1
+
+_COLUMNS = ["pageviews", "script_runs", "session_time_seconds"]
+
+
+def _complete_history(d: Dict[str, Any]):
+    """
+    Give every history column one entry per day.
+
+    Columns that were added later cover the most recent days, so missing
+    entries are filled in at the front.
+    """
+    for key in HISTORY_KEYS:
+        history = d.get(key)
+        if not history or isinstance(history, PerDay):
+            continue
+        n = len(history.get("days", []))
+        for name in _COLUMNS + ["widgets"]:
+            values = list(history.get(name) or [])
+            if len(values) > n:
+                # Entries beyond the days cannot be placed, keep the latest.
+                values = values[-n:] if n else []
+            missing = n - len(values)
+            if name == "widgets":
+                history[name] = [{} for _ in range(missing)] + values
+            else:
+                history[name] = [0] * missing + values
+
+
+# MIGRATIONS[i] upgrades data of version i to version i + 1.
+MIGRATIONS: List[Callable[[Dict[str, Any]], None]] = [_complete_history]
+
+
+def upgrade(d: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Upgrade loaded data `d` to `VERSION` in place and return it.
+
+    Its histories are converted to `PerDay` here, once per load, instead of
+    on every rerun.
+    """
+    version = d.get("schema_version", 0)
+    if version > VERSION:
+        logging.warning(
+            f"SA2: Data has schema version {version}, newer than {VERSION}. "
+            "Upgrade streamlit-analytics2 to read it."
+        )
+        return d
+    for migrate in MIGRATIONS[version:]:
+        migrate(d)
+    d["schema_version"] = VERSION
+    adopt(d)
+    return d
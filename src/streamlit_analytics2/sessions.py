@@ -0,0 +1,111 @@
+"""
+Per-session counters, keyed by `session_id`.
+
+Every session that passes a `session_id` gets its own counters dict, so
+concurrent users no longer overwrite each other's session document. The store
+keeps at most `max_sessions` of them and evicts the least recently used, as
+well as sessions idle for longer than `ttl_seconds`. Evicted sessions are
+queued until `drain_evicted` hands them over to be written in one batch.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class SessionStore:
+    """
+    LRU/TTL cache of session counters.
+
+    Parameters
+    ----------
+    factory : Callable[[], Dict[str, Any]]
+        Returns fresh counters for a session that is not in the store.
+    max_sessions : int
+        Maximum number of sessions held in memory.
+    ttl_seconds : float, optional
+        Evict sessions that were not used for this long.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Dict[str, Any]],
+        max_sessions: int = 1000,
+        ttl_seconds: Optional[float] = None,
+    ):
+        self._factory = factory
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        # session_id -> (last used, counters), least recently used first.
+        self._sessions: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._evicted: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, session_id: str, now: Optional[float] = None
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Return the counters of `session_id` and whether they were just created.
+
+        Using a session marks it as most recently used, and may evict others.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if session_id in self._sessions:
+                _, counters = self._sessions.pop(session_id)
+                created = False
+            elif session_id in self._evicted:
+                # Evicted but not flushed yet, take it back.
+                counters = self._evicted.pop(session_id)
+                created = False
+            else:
+                counters = self._factory()
+                created = True
+            self._sessions[session_id] = (now, counters)
+            self._evict(now)
+            return counters, created
+
+    def _evict(self, now: float):
+        while self._sessions:
+            session_id, (used, counters) = next(iter(self._sessions.items()))
+            idle = self.ttl_seconds is not None and now - used > self.ttl_seconds
+            if len(self._sessions) <= self.max_sessions and not idle:
+                break
+            del self._sessions[session_id]
+            self._evicted[session_id] = counters
+
+    def evict_idle(self, now: Optional[float] = None):
+        """Evict the sessions that exceeded `ttl_seconds`."""
+        with self._lock:
+            self._evict(time.monotonic() if now is None else now)
+
+    def drain_evicted(self) -> Dict[str, Dict[str, Any]]:
+        """Return the evicted sessions that were not flushed yet."""
+        with self._lock:
+            evicted, self._evicted = self._evicted, {}
+            return evicted
+
+    def pop(self, session_id: str):
+        """Forget `session_id`, e.g. after its data was deleted."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._evicted.pop(session_id, None)
+
+    def counters(self) -> List[Dict[str, Any]]:
+        """Counters of the sessions in memory, including unflushed evicted ones."""
+        with self._lock:
+            return [c for _, c in self._sessions.values()] + list(
+                self._evicted.values()
+            )
+
+    def ids(self) -> List[str]:
+        """Session ids in memory, least recently used first."""
+        with self._lock:
+            return list(self._sessions)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: object) -> bool:
+        return session_id in self._sessions
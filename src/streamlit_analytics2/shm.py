@@ -0,0 +1,393 @@
+"""
+Shared-memory counters for several Streamlit server processes on one host.
+
+All worker processes attach to the same `multiprocessing.shared_memory`
+segment. It holds a fixed-layout table for the totals and an open-addressing
+hash region for per-day and widget counters, whose keys are stored once in a
+string heap. Each process buffers its increments and adds them to the segment
+under a file lock once per rerun. The process that holds the leader lock,
+the creator of the segment unless it exited, materializes the segment into
+`data` and does the persistence.
+
+Requires `fcntl`, so this backend is only available on POSIX systems. The
+module itself imports everywhere, `attach` raises without it.
+"""
+
+import bisect
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, Optional, Tuple
+
+from .state import observers
+
+MAGIC = b"SA2M"
+VERSION = 1
+
+# magic, version, seeded, number of slots, heap size, heap used, used slots,
+# increments lost because the segment was full.
+_HEADER = struct.Struct("<4sHHIQQQQ")
+# total_pageviews, total_script_runs, total_time (microseconds)
+_TOTALS = struct.Struct("<qqq")
+# key hash, count, key offset in heap, key length
+_SLOT = struct.Struct("<QqII")
+_INDEX = struct.Struct("<I")
+
+_SEP = "\x1f"
+_TOTAL_KEYS = ["pageviews", "script_runs", "session_time_seconds"]
+_TOTAL_FIELDS = {
+    "pageviews": "total_pageviews",
+    "script_runs": "total_script_runs",
+    "session_time_seconds": "total_time_seconds",
+}
+# Fractional metrics are stored as integer microseconds.
+_METRIC_SCALE = {"session_time_seconds": 1_000_000}
+
+
+def _fcntl():
+    # Imported here, so that the package still imports where it is missing.
+    import fcntl
+
+    return fcntl
+
+
+def _tracked_name(segment: shared_memory.SharedMemory) -> str:
+    """Name the resource tracker knows `segment` by, with the POSIX leading slash."""
+    return "/" + segment.name.lstrip("/")
+
+
+def _hash(key: bytes) -> int:
+    # 0 marks an empty slot.
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") or 1
+
+
+class SharedCounters:
+    """
+    A counter table in a named shared memory segment.
+
+    Parameters
+    ----------
+    name : str
+        Name of the segment. All processes that use the same name share
+        their counts.
+    slots : int
+        Capacity of the hash region, i.e. the number of distinct per-day and
+        widget counters. Only used by the process that creates the segment.
+    heap_size : int
+        Bytes reserved for the counter keys.
+    """
+
+    def __init__(self, name: str, slots: int = 1 << 16, heap_size: int = 1 << 22):
+        self.name = name
+        lock_dir = tempfile.gettempdir()
+        self._lock_file = open(os.path.join(lock_dir, f"{name}.lock"), "a+b")
+        self._leader_file = open(os.path.join(lock_dir, f"{name}.leader"), "a+b")
+        self._leader = False
+        self._buffer: Dict[Tuple[str, ...], float] = {}
+        self._buffer_lock = threading.Lock()
+        self._shared = False
+        self._share_lock = threading.Lock()
+
+        self._slots_offset = _HEADER.size + _TOTALS.size
+        with self._locked():
+            try:
+                self._shm = shared_memory.SharedMemory(name=name)
+                self.created = False
+            except FileNotFoundError:
+                size = (
+                    self._slots_offset + slots * (_SLOT.size + _INDEX.size) + heap_size
+                )
+                self._shm = shared_memory.SharedMemory(
+                    name=name, create=True, size=size
+                )
+                self.created = True
+            buf = self._shm.buf
+            if buf is None:
+                raise ValueError(f"Shared memory segment {name} is closed")
+            self._buf = buf
+            if self.created:
+                _HEADER.pack_into(
+                    self._buf, 0, MAGIC, VERSION, 0, slots, heap_size, 0, 0, 0
+                )
+                # The creator loads the stored data, so it persists as well.
+                self.is_leader()
+            # The segment must outlive the process that created it.
+            resource_tracker.unregister(_tracked_name(self._shm), "shared_memory")
+
+        magic, version, _, slots, heap_size, _, _, _ = _HEADER.unpack_from(self._buf, 0)
+        self._slots: int = slots
+        self._heap_size: int = heap_size
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Shared memory segment {name} has an unknown layout")
+        self._index_offset = self._slots_offset + self._slots * _SLOT.size
+        self._heap_offset = self._index_offset + self._slots * _INDEX.size
+        # Slot lookups of keys this process has seen, they never move.
+        self._slot_cache: Dict[bytes, int] = {}
+
+    @contextmanager
+    def _locked(self):
+        fcntl = _fcntl()
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _header(self) -> Tuple[Any, ...]:
+        return _HEADER.unpack_from(self._buf, 0)
+
+    def _set_header(self, **fields):
+        names = ["magic", "version", "seeded", "slots", "heap_size", "heap_used"]
+        names += ["used", "lost"]
+        values = dict(zip(names, self._header()))
+        values.update(fields)
+        _HEADER.pack_into(self._buf, 0, *(values[n] for n in names))
+
+    def is_leader(self) -> bool:
+        """
+        Whether this process persists the counts.
+
+        The creator of the segment leads. Another process only takes over once
+        the creator is gone.
+        """
+        if not self._leader:
+            fcntl = _fcntl()
+            try:
+                fcntl.flock(self._leader_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._leader = True
+            except BlockingIOError:
+                pass
+        return self._leader
+
+    def share(self, d: Dict[str, Any]):
+        """
+        Start mirroring the increments of `d` into the segment.
+
+        The process that created the segment seeds it from `d`, which should
+        hold the loaded counts by now. Safe to call on every rerun.
+        """
+        with self._share_lock:
+            if self._shared:
+                return
+            if self.created:
+                self.seed(d)
+            else:
+                self.wait_until_seeded()
+            observers.append(self.observe)
+            self._shared = True
+
+    # Buffering, called from the wrappers on every increment.
+
+    def observe(self, day: str, key: Tuple[Any, ...], amount: float = 1):
+        """`state.record` observer that buffers an increment of `data`."""
+        if key[0] == "widgets":
+            keys = [("w",) + key[1:], ("dw", day) + key[1:]]
+        else:
+            keys = [("t", key[0]), ("d", day, key[0])]
+        with self._buffer_lock:
+            for k in keys:
+                self._buffer[k] = self._buffer.get(k, 0) + amount
+
+    def flush(self):
+        """Add the buffered increments to the shared segment."""
+        with self._buffer_lock:
+            buffer, self._buffer = self._buffer, {}
+        if not buffer:
+            return
+        with self._locked():
+            for key, amount in buffer.items():
+                self._add(key, amount)
+
+    # Segment access, the caller holds the lock.
+
+    def _add(self, key: Tuple[Any, ...], amount: float, absolute: bool = False):
+        if key[0] == "t":
+            offset = _HEADER.size + 8 * _TOTAL_KEYS.index(key[1])
+        else:
+            slot = self._slot(_SEP.join(str(k) for k in key).encode())
+            if slot is None:
+                self._set_header(lost=self._header()[7] + 1)
+                return
+            offset = self._slots_offset + slot * _SLOT.size + 8
+        scale = _METRIC_SCALE.get(key[-1], 1) if key[0] in ("t", "d") else 1
+        amount = int(round(amount * scale))
+        (count,) = struct.unpack_from("<q", self._buf, offset)
+        struct.pack_into(
+            "<q", self._buf, offset, amount if absolute else count + amount
+        )
+
+    def _slot(self, key: bytes) -> Optional[int]:
+        """Find or claim the slot for `key`, None if the segment is full."""
+        if key in self._slot_cache:
+            return self._slot_cache[key]
+        h = _hash(key)
+        for probe in range(self._slots):
+            slot = (h + probe) % self._slots
+            offset = self._slots_offset + slot * _SLOT.size
+            slot_hash, _, key_offset, key_len = _SLOT.unpack_from(self._buf, offset)
+            if slot_hash == 0:
+                _, _, _, _, _, heap_used, used, _ = self._header()
+                if heap_used + len(key) > self._heap_size:
+                    return None
+                start = self._heap_offset + heap_used
+                end = start + len(key)
+                self._buf[start:end] = key
+                _SLOT.pack_into(self._buf, offset, h, 0, heap_used, len(key))
+                _INDEX.pack_into(
+                    self._buf, self._index_offset + used * _INDEX.size, slot
+                )
+                self._set_header(heap_used=heap_used + len(key), used=used + 1)
+                self._slot_cache[key] = slot
+                return slot
+            if slot_hash == h and self._key(key_offset, key_len) == key:
+                self._slot_cache[key] = slot
+                return slot
+        return None
+
+    def _key(self, key_offset: int, key_len: int) -> bytes:
+        start = self._heap_offset + key_offset
+        end = start + key_len
+        return bytes(self._buf[start:end])
+
+    def _items(self):
+        """Yield `(key, count)` for all counters in the hash region."""
+        used = self._header()[6]
+        for i in range(used):
+            (slot,) = _INDEX.unpack_from(
+                self._buf, self._index_offset + i * _INDEX.size
+            )
+            _, count, key_offset, key_len = _SLOT.unpack_from(
+                self._buf, self._slots_offset + slot * _SLOT.size
+            )
+            key = self._key(key_offset, key_len).decode()
+            yield tuple(key.split(_SEP)), count
+
+    # Conversion from and to the `data` dict.
+
+    def seed(self, d: Dict[str, Any]):
+        """Initialize the segment from a loaded `data` dict, once."""
+        with self._locked():
+            if self._header()[2]:
+                return
+            for metric in _TOTAL_KEYS:
+                self._add(("t", metric), d[_TOTAL_FIELDS[metric]], absolute=True)
+            history = d["per_day"]
+            for i, day in enumerate(history["days"]):
+                for metric in _TOTAL_KEYS:
+                    self._add(("d", day, metric), history[metric][i], absolute=True)
+                for key, count in _flatten(history["widgets"][i]):
+                    self._add(("dw", day) + key, count, absolute=True)
+            for key, count in _flatten(d["widgets"]):
+                self._add(("w",) + key, count, absolute=True)
+            self._set_header(seeded=1)
+
+    def wait_until_seeded(self, timeout: float = 30):
+        """Block until the creating process has seeded the segment."""
+        deadline = time.monotonic() + timeout
+        while not self._header()[2]:
+            if time.monotonic() > deadline:
+                logging.warning(f"SA2: Shared memory {self.name} was never seeded")
+                return
+            time.sleep(0.05)
+
+    def apply(self, d: Dict[str, Any]):
+        """Overwrite the counters in `data` with the shared counts."""
+        with self._locked():
+            totals = _TOTALS.unpack_from(self._buf, _HEADER.size)
+            items = list(self._items())
+        for metric, total in zip(_TOTAL_KEYS, totals):
+            d[_TOTAL_FIELDS[metric]] = _unscale(metric, total)
+
+        history = d["per_day"]
+        rows = {day: i for i, day in enumerate(history["days"])}
+        aliases: Dict[int, Dict[str, Any]] = {}
+        for key, count in items:
+            if key[0] == "w":
+                _set(d["widgets"], key[1:], count, aliases)
+                continue
+            day = key[1]
+            if day not in rows:
+                if day < history["days"][0]:
+                    # Already rolled up by the retention policy.
+                    continue
+                history.insert_day(bisect.bisect_left(history["days"], day), day)
+                rows = {day: i for i, day in enumerate(history["days"])}
+            if key[0] == "d":
+                history[key[2]][rows[day]] = _unscale(key[2], count)
+            else:
+                _set(history["widgets"][rows[day]], key[2:], count, aliases)
+
+    def lost(self) -> int:
+        """Number of increments dropped because the segment was full."""
+        return int(self._header()[7])
+
+    def close(self):
+        self._shm.close()
+
+    def unlink(self):
+        """Remove the segment, e.g. once all worker processes are stopped."""
+        resource_tracker.register(_tracked_name(self._shm), "shared_memory")
+        self._shm.unlink()
+
+
+def _flatten(widgets: Dict[Any, Any]):
+    for label, counts in widgets.items():
+        if isinstance(counts, dict):
+            for value, count in counts.items():
+                yield (str(label), str(value)), count
+        else:
+            yield (str(label),), counts
+
+
+def _unscale(metric: str, count: int):
+    if metric in _METRIC_SCALE:
+        return count / _METRIC_SCALE[metric]
+    return count
+
+
+def _set(
+    widgets: Dict[Any, Any],
+    key: Tuple[str, ...],
+    count: int,
+    aliases: Dict[int, Dict[str, Any]],
+):
+    """
+    Set a widget counter from the segment, where all keys are strings.
+
+    Values that are not strings locally (e.g. int options of a radio) are
+    found through `aliases`, which caches `str(value) -> value` per dict.
+    """
+    if len(key) == 1:
+        widgets[key[0]] = count
+        return
+    label, value = key
+    counts = widgets.get(label)
+    if not isinstance(counts, dict):
+        counts = widgets[label] = {}
+    if value not in counts:
+        if id(counts) not in aliases:
+            aliases[id(counts)] = {str(v): v for v in counts if type(v) is not str}
+        value = aliases[id(counts)].get(value, value)
+    counts[value] = count
+
+
+_counters: Dict[str, SharedCounters] = {}
+_counters_lock = threading.Lock()
+
+
+def attach(name: str, **kwargs) -> SharedCounters:
+    """Return this process's handle on the segment `name`, creating it once."""
+    try:
+        _fcntl()
+    except ImportError:
+        raise ValueError("shared_memory needs fcntl, which is only available on POSIX")
+    with _counters_lock:
+        if name not in _counters:
+            _counters[name] = SharedCounters(name, **kwargs)
+        return _counters[name]
@@ -0,0 +1,129 @@
+"""
+Mergeable quantile sketches for numeric widget values.
+
+A sketch is a plain dict, so it is stored and serialized like the rest of the
+data. As in DDSketch, a value `x > 0` is counted in bucket
+`ceil(log_gamma(x))` with `gamma = (1 + alpha) / (1 - alpha)`, which bounds
+the relative error of every quantile by `alpha`. Negative values use mirrored
+buckets and values close to zero a counter of their own. Once more than
+`max_buckets` buckets are in use, those of the smallest magnitudes are
+collapsed, so the state stays bounded however many distinct values are seen.
+"""
+
+import math
+from typing import Any, Dict, List, Optional
+
+ALPHA = 0.01
+MAX_BUCKETS = 2048
+# Values with a smaller magnitude are counted as zero.
+MIN_VALUE = 1e-9
+
+
+def new(alpha: float = ALPHA, max_buckets: int = MAX_BUCKETS) -> Dict[str, Any]:
+    """Return an empty sketch."""
+    return {
+        "alpha": alpha,
+        "max_buckets": max_buckets,
+        "count": 0,
+        "sum": 0.0,
+        "min": None,
+        "max": None,
+        "zero": 0,
+        # Bucket index (as str, to be a valid JSON/Firestore key) -> count.
+        "positive": {},
+        "negative": {},
+    }
+
+
+def _gamma(sketch: Dict[str, Any]) -> float:
+    alpha: float = sketch["alpha"]
+    return (1 + alpha) / (1 - alpha)
+
+
+def _bucket_value(sketch: Dict[str, Any], index: int) -> float:
+    """The value a bucket stands for, within `alpha` of all values in it."""
+    gamma = _gamma(sketch)
+    return 2 * gamma**index / (gamma + 1)
+
+
+def _collapse(sketch: Dict[str, Any]):
+    for side in ["negative", "positive"]:
+        buckets = sketch[side]
+        limit = sketch["max_buckets"] // 2
+        if len(buckets) <= limit:
+            continue
+        # Fold the buckets of the smallest magnitudes into one.
+        indices = sorted(buckets, key=int)
+        cut = len(indices) - limit
+        for index in indices[:cut]:
+            buckets[indices[cut]] += buckets.pop(index)
+
+
+def add(sketch: Dict[str, Any], value: float, count: int = 1):
+    """Count `value` `count` times."""
+    value = float(value)
+    if not math.isfinite(value):
+        return
+    sketch["count"] += count
+    sketch["sum"] += value * count
+    if sketch["min"] is None or value < sketch["min"]:
+        sketch["min"] = value
+    if sketch["max"] is None or value > sketch["max"]:
+        sketch["max"] = value
+    if abs(value) < MIN_VALUE:
+        sketch["zero"] += count
+        return
+    buckets = sketch["positive"] if value > 0 else sketch["negative"]
+    index = str(math.ceil(math.log(abs(value), _gamma(sketch))))
+    buckets[index] = buckets.get(index, 0) + count
+    _collapse(sketch)
+
+
+def merge(sketch: Dict[str, Any], other: Dict[str, Any]):
+    """Add the counts of `other`, which must use the same `alpha`, to `sketch`."""
+    if other["alpha"] != sketch["alpha"]:
+        raise ValueError("Sketches with a different alpha cannot be merged")
+    if not other["count"]:
+        return
+    sketch["count"] += other["count"]
+    sketch["sum"] += other["sum"]
+    for key, pick in [("min", min), ("max", max)]:
+        values = [v for v in [sketch[key], other[key]] if v is not None]
+        sketch[key] = pick(values)
+    sketch["zero"] += other["zero"]
+    for side in ["negative", "positive"]:
+        for index, n in other[side].items():
+            sketch[side][index] = sketch[side].get(index, 0) + n
+    _collapse(sketch)
+
+
+def buckets(sketch: Dict[str, Any]) -> List[Dict[str, float]]:
+    """Return `value` and `count` of every bucket in ascending value order."""
+    result = [
+        {"value": -_bucket_value(sketch, int(index)), "count": n}
+        for index, n in sorted(
+            sketch["negative"].items(), key=lambda item: -int(item[0])
+        )
+    ]
+    if sketch["zero"]:
+        result.append({"value": 0.0, "count": sketch["zero"]})
+    result += [
+        {"value": _bucket_value(sketch, int(index)), "count": n}
+        for index, n in sorted(
+            sketch["positive"].items(), key=lambda item: int(item[0])
+        )
+    ]
+    return result
+
+
+def quantile(sketch: Dict[str, Any], q: float) -> Optional[float]:
+    """Return the `q` quantile, None for an empty sketch."""
+    if not sketch["count"]:
+        return None
+    rank = q * (sketch["count"] - 1)
+    seen = 0.0
+    for bucket in buckets(sketch):
+        seen += bucket["count"]
+        if seen > rank:
+            return float(min(max(bucket["value"], sketch["min"]), sketch["max"]))
+    return float(sketch["max"])
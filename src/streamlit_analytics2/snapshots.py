@@ -0,0 +1,168 @@
+"""
+Read-only snapshots of the analytics data for the dashboard.
+
+The dashboard renders from a copy of `data` instead of the live dict, which
+the wrappers of other sessions keep changing. `current` publishes a new
+snapshot when the data changed and the last one is older than `max_age`;
+readers in between share the published one without locking.
+
+Every copy is made with `dict.copy`, `list(...)` or `array(...)`, which do
+not run Python code and can therefore not see a dict change size. Retention
+restructures the histories, so snapshots are taken under `history_lock`.
+Past rows of the per-day widget counts no longer change, so a snapshot
+reuses their copies from the previous one (structural sharing) and only
+copies today's. Code that changes past rows in place calls `invalidate`.
+
+The published snapshot also holds the dashboard aggregates under
+`aggregates`, taken together with the copy, see `aggregates.current`.
+
+Snapshots must not be changed, they may share parts with later snapshots.
+"""
+
+import threading
+import time
+from array import array
+from typing import Any, Dict, Optional, Tuple
+
+from . import aggregates, columnar
+from .state import data, history_lock
+
+# Day -> (live row, copy of it), see `build`.
+Rows = Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]]
+
+_lock = threading.Lock()
+_published: Dict[str, Any] = {
+    "snapshot": None,
+    "key": None,
+    "time": float("-inf"),
+    "rows": {},
+    "generation": 0,
+}
+
+
+def invalidate():
+    """Copy every row again next time, e.g. after past days changed in place."""
+    _published["generation"] += 1
+
+
+def _copy_widgets(widgets: Dict[Any, Any]) -> Dict[Any, Any]:
+    copied = widgets.copy()
+    for label, counts in copied.items():
+        if isinstance(counts, dict):
+            copied[label] = counts.copy()
+    return copied
+
+
+def _copy_sketch(sketch: Dict[str, Any]) -> Dict[str, Any]:
+    copied = sketch.copy()
+    copied["positive"] = sketch["positive"].copy()
+    copied["negative"] = sketch["negative"].copy()
+    return copied
+
+
+def _copy_sketches(sketches: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: _copy_sketch(sketch) for key, sketch in sketches.copy().items()}
+
+
+def _copy_history(
+    history: columnar.PerDay, rows: Optional[Rows], shared: Rows
+) -> columnar.PerDay:
+    columns = {
+        name: array(column.typecode, column)
+        for name, column in history.columns().items()
+    }
+    days = [columnar._from_epoch(day) for day in columns["days"]]
+    live_rows = list(history["widgets"])
+    widgets = []
+    for i, (day, row) in enumerate(zip(days, live_rows)):
+        previous = rows.get(day) if rows is not None else None
+        if previous is not None and previous[0] is row:
+            copied = previous[1]
+        else:
+            copied = _copy_widgets(row)
+        # Today's row still changes, only copies of past rows are shared.
+        if i < len(days) - 1:
+            shared[day] = (row, copied)
+        widgets.append(copied)
+    return columnar.PerDay.from_columns(columns, widgets, history.extra())
+
+
+def build(
+    d: Dict[str, Any], rows: Optional[Rows] = None
+) -> Tuple[Dict[str, Any], Rows]:
+    """
+    Return a snapshot of `d`.
+
+    `rows` are the per-day rows of the previous snapshot to share, as
+    returned with it. Without them, everything is copied.
+    """
+    with history_lock:
+        return _build(d, rows)
+
+
+def _build(d: Dict[str, Any], rows: Optional[Rows]) -> Tuple[Dict[str, Any], Rows]:
+    snapshot = d.copy()
+    shared: Rows = {}
+    columnar.adopt(snapshot)
+    snapshot["per_day"] = _copy_history(snapshot["per_day"], rows, shared)
+    for key in ["per_week", "per_month"]:
+        # Retention adds to these rows in place, they are always copied.
+        snapshot[key] = _copy_history(snapshot[key], None, {})
+    snapshot["widgets"] = _copy_widgets(snapshot["widgets"])
+    if "sketches" in snapshot:
+        snapshot["sketches"] = _copy_sketches(snapshot["sketches"])
+    if "latency" in snapshot:
+        latency = snapshot["latency"].copy()
+        latency["pages"] = _copy_sketches(latency["pages"])
+        latency["days"] = {
+            day: _copy_sketches(pages) for day, pages in latency["days"].copy().items()
+        }
+        snapshot["latency"] = latency
+    if "uploads" in snapshot:
+        snapshot["uploads"] = {
+            label: {**stats, "sizes": _copy_sketch(stats["sizes"])}
+            for label, stats in snapshot["uploads"].copy().items()
+        }
+    return snapshot, shared
+
+
+def current(max_age: float = 1.0) -> Dict[str, Any]:
+    """
+    Return the published snapshot of `data`, publishing a new one first if
+    the data changed and the last one is older than `max_age` seconds.
+    """
+    key = (
+        data["total_script_runs"],
+        data["total_pageviews"],
+        id(data["widgets"]),
+        id(data["per_day"]),
+        _published["generation"],
+    )
+    snapshot: Optional[Dict[str, Any]] = _published["snapshot"]
+    last = _published["key"]
+    # A reset or invalidation is shown right away, new counts after max_age.
+    fresh = (
+        last is not None
+        and key[2:] == last[2:]
+        and time.monotonic() - _published["time"] < max_age
+    )
+    if snapshot is not None and (key == last or fresh):
+        return snapshot
+    if snapshot is None:
+        _lock.acquire()
+    elif not _lock.acquire(blocking=False):
+        # Someone else is publishing, the last snapshot will do meanwhile.
+        return snapshot
+    try:
+        last = _published["key"]
+        rows = _published["rows"] if last is not None and last[-1] == key[-1] else None
+        with history_lock:
+            snapshot, shared = build(data, rows)
+            # Taken with the copy, so both hold the same increments.
+            snapshot["aggregates"] = aggregates.current()
+        _published.update(
+            snapshot=snapshot, key=key, time=time.monotonic(), rows=shared
+        )
+        return snapshot
+    finally:
+        _lock.release()
@@ -1,25 +1,183 @@
+import contextvars
 import datetime
+import threading
+import uuid
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .columnar import PerDay
+from .interning import StringTable, counted_strings
+from .schema import VERSION as SCHEMA_VERSION
+from .sessions import SessionStore
 
 # Dict that holds all analytics results. Note that this is persistent across
 # users, as modules are only imported once by a streamlit app.
-data = {"loaded_from_firestore": False}
-session_data = {"loaded_from_firestore": False}
+data: Dict[str, Any] = {"loaded_from_firestore": False}
+
+# Session counters of scripts that run without a `session_id`.
+_shared_session: Dict[str, Any] = {"loaded_from_firestore": False}
+_current_session = contextvars.ContextVar("sa2_session", default=_shared_session)
+
+
+def current_session():
+    """Return the counters dict of the session the running script belongs to."""
+    return _current_session.get()
+
+
+def activate_session(counters=None):
+    """Make `counters` (shared ones if None) the running script's `session_data`."""
+    _current_session.set(_shared_session if counters is None else counters)
+
+
+# Whether the running script's session is tracked. Streamlit is patched for the
+# whole process, so scripts of untracked sessions, e.g. ones left out by
+# `sampling`, must call the original widgets, see `wrappers.method`.
+_tracked = contextvars.ContextVar("sa2_tracked", default=False)
+
+
+def is_tracked() -> bool:
+    return _tracked.get()
+
+
+def set_tracked(tracked: bool):
+    _tracked.set(tracked)
+
+
+# `st.session_state.state_dict` of the run, so the wrappers do not look it up
+# through session_state on every call. Set by `start_tracking`.
+_state_dict: contextvars.ContextVar[Optional[Dict[Any, Any]]] = contextvars.ContextVar(
+    "sa2_state_dict", default=None
+)
+
+
+def current_state_dict() -> Optional[Dict[Any, Any]]:
+    return _state_dict.get()
+
+
+def use_state_dict(state_dict: Optional[Dict[Any, Any]]):
+    _state_dict.set(state_dict)
+
+
+class _SessionData(MutableMapping):
+    """Forwards to `current_session()`, so each script sees its own counters."""
+
+    def __getitem__(self, key):
+        return current_session()[key]
+
+    def __setitem__(self, key, value):
+        current_session()[key] = value
+
+    def __delitem__(self, key):
+        del current_session()[key]
+
+    def __iter__(self):
+        return iter(current_session())
+
+    def __len__(self):
+        return len(current_session())
+
+    def __repr__(self):
+        return repr(current_session())
+
+
+session_data = _SessionData()
+
+# Held while a history is rolled up (see `retention.py`) and while data is
+# copied or encoded to be saved, so that no save sees it half-compacted.
+# Counters are incremented and `record`ed under it, so a save holds the
+# increments up to the journal mark it copies, see `journal.py`.
+history_lock = threading.RLock()
+
+# Widget labels and values, shared by all dicts that count them.
+strings = StringTable()
+
+# Callables notified about every increment of the aggregate `data`, see
+# `record`.
+observers: List[Callable[[str, Tuple[Any, ...], float], None]] = []
+
+
+def record(key, amount=1):
+    """
+    Notify the observers that a counter of `data` was incremented.
+
+    `key` is `("pageviews",)`, `("script_runs",)`, `("session_time_seconds",)`,
+    `("widgets", label)` or `("widgets", label, value)`. It stands for both the
+    total and today's per-day counter.
+    """
+    if observers:
+        day = str(datetime.date.today())
+        for observer in observers:
+            observer(day, key, amount)
+
+
+def _new_session():
+    counters = {"loaded_from_firestore": False}
+    _reset(counters)
+    return counters
+
+
+# Counters of the sessions that pass a `session_id`, see `sessions.py`.
+sessions = SessionStore(_new_session)
+
+
+# Size of `strings` after the last `compact_strings`.
+_strings_kept = {"size": 0}
+
+
+def compact_strings(force=False):
+    """
+    Drop the strings from `strings` that no dict in memory counts anymore.
+
+    Unless `force` is set, this only runs once the table doubled since the
+    last time, so the scan of all counters is amortized over the new strings.
+    """
+    if not force and len(strings) < 2 * _strings_kept["size"]:
+        return
+    keep = set()
+    for d in [data, _shared_session] + sessions.counters():
+        keep |= counted_strings(d)
+    strings.retain(keep)
+    _strings_kept["size"] = len(strings)
 
 
 def reset_data():
+    for d in [data, session_data]:
+        _reset(d)
+    # Identifies this data among merged replicas, see `replicas.py`. Kept
+    # across resets, and replaced by the stored id when data is loaded.
+    data["replica_id"] = data.get("replica_id") or uuid.uuid4().hex
+
+
+def _reset(d):
     # Use yesterday as first entry to make chart look better.
     yesterday = str(datetime.date.today() - datetime.timedelta(days=1))
 
-    for d in [data, session_data]:
-        d["total_pageviews"] = 0
-        d["total_script_runs"] = 0
-        d["total_time_seconds"] = 0
-        d["per_day"] = {
+    d["total_pageviews"] = 0
+    d["total_script_runs"] = 0
+    d["total_time_seconds"] = 0
+    d["per_day"] = PerDay(
+        {
             "days": [str(yesterday)],
             "pageviews": [0],
             "script_runs": [0],
             "session_time_seconds": [0],
             "widgets": [{}],
         }
-        d["widgets"] = {}
-        d["start_time"] = datetime.datetime.now().strftime("%d %b %Y, %H:%M:%S")
+    )
+    # Rolled-up history, see `retention.py`.
+    d["per_week"] = PerDay()
+    d["per_month"] = PerDay()
+    d["widgets"] = {}
+    # Quantile sketches of numeric widgets, see `sketches.py`.
+    d["sketches"] = {}
+    # Script run latency per page, see `latency.py`.
+    d["latency"] = {"pages": {}, "days": {}}
+    # Upload statistics of file widgets, see `uploads.py`.
+    d["uploads"] = {}
+    # Days the sample rate changed on -> new rate, see `sampling.py`.
+    d["sample_rates"] = {}
+    # Number of saves to the durable backends, kept across resets so a
+    # checkpoint of older data is never restored, see `checkpoint.py`.
+    d["save_seq"] = d.get("save_seq", 0)
+    d["start_time"] = datetime.datetime.now().strftime("%d %b %Y, %H:%M:%S")
+    d["schema_version"] = SCHEMA_VERSION
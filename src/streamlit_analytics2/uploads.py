@@ -0,0 +1,139 @@
+"""
+Upload statistics of the file widgets.
+
+`wrappers.file_uploader` identifies an uploaded file by Streamlit's `file_id`
+and its size, so every new upload counts as an interaction without reading
+the file. Per widget, `d["uploads"]` holds the number of uploaded files,
+their total bytes, the number of duplicates and a quantile sketch of the
+file sizes (see `sketches.py`).
+
+With `hash_uploads`, the contents are hashed in a thread pool instead of on
+the script thread, chunk by chunk over a memoryview of the upload buffer, so
+no copy is made. A file whose digest the session has seen before counts as a
+duplicate.
+"""
+
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import streamlit as st
+
+from . import sketches
+from .state import current_session, data
+
+# Bytes hashed per update.
+CHUNK_SIZE = 1 << 20
+HASH_WORKERS = 2
+
+_pool: Dict[str, Optional[ThreadPoolExecutor]] = {"executor": None}
+_lock = threading.Lock()
+
+
+def files(uploaded: Any) -> List[Any]:
+    """The files a file widget returned, which may be None, one or a list."""
+    if uploaded is None:
+        return []
+    if isinstance(uploaded, (list, tuple)):
+        return list(uploaded)
+    return [uploaded]
+
+
+def identity(file: Any) -> Tuple[str, int]:
+    """Identify `file` by Streamlit's `file_id` (name on older versions) and size."""
+    return getattr(file, "file_id", None) or file.name, file.size
+
+
+def new() -> Dict[str, Any]:
+    """Return empty statistics of a widget."""
+    return {"files": 0, "bytes": 0, "duplicates": 0, "sizes": sketches.new()}
+
+
+def digest(buffer: Any, chunk_size: int = CHUNK_SIZE) -> str:
+    """BLAKE2b digest of `buffer`, hashed in chunks of a memoryview."""
+    h = hashlib.blake2b(digest_size=16)
+    with memoryview(buffer) as view:
+        for start in range(0, len(view), chunk_size):
+            end = start + chunk_size
+            h.update(view[start:end])
+    return h.hexdigest()
+
+
+def session_digests() -> Set[str]:
+    """Digests of the files uploaded in this session."""
+    if "upload_digests" not in st.session_state:
+        st.session_state.upload_digests = set()
+    digests: Set[str] = st.session_state.upload_digests
+    return digests
+
+
+def _executor() -> ThreadPoolExecutor:
+    with _lock:
+        executor = _pool["executor"]
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                HASH_WORKERS, thread_name_prefix="sa2-upload-hash"
+            )
+            _pool["executor"] = executor
+        return executor
+
+
+def _count_duplicate(
+    file: Any, label: str, seen: Set[str], dicts: List[Dict[str, Any]]
+):
+    with file.getbuffer() as buffer:
+        file_digest = digest(buffer)
+    with _lock:
+        duplicate = file_digest in seen
+        seen.add(file_digest)
+        if duplicate:
+            for d in dicts:
+                stats = d.setdefault("uploads", {}).setdefault(label, new())
+                stats["duplicates"] += 1
+
+
+def observe(label: str, file: Any, seen: Optional[Set[str]] = None):
+    """
+    Count the upload of `file` to widget `label` in `data` and the session's
+    counters. With `seen`, the session's digests, its contents are hashed in
+    the background to count duplicates.
+    """
+    dicts = [data, current_session()]
+    size = file.size
+    with _lock:
+        for d in dicts:
+            stats = d.setdefault("uploads", {}).setdefault(label, new())
+            stats["files"] += 1
+            stats["bytes"] += size
+            sketches.add(stats["sizes"], size)
+    if seen is not None:
+        _executor().submit(_count_duplicate, file, label, seen, dicts)
+
+
+def summary(d: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Files, bytes, duplicates and median/p95 size per file widget."""
+    rows = []
+    for label, stats in d.get("uploads", {}).items():
+        row: Dict[str, Any] = {
+            "widget": label,
+            "files": stats["files"],
+            "bytes": stats["bytes"],
+            "duplicates": stats["duplicates"],
+        }
+        for p in [50, 95]:
+            row[f"p{p}_bytes"] = sketches.quantile(stats["sizes"], p / 100)
+        rows.append(row)
+    return rows
+
+
+def merge(uploads: Dict[str, Any], other: Dict[str, Any]):
+    """Add the statistics of `other` to `uploads`, both `d["uploads"]`."""
+    for label, stats in other.items():
+        if label not in uploads:
+            uploads[label] = stats
+            continue
+        target = uploads[label]
+        for key in ["files", "bytes", "duplicates"]:
+            target[key] += stats[key]
+        sketches.merge(target["sizes"], stats["sizes"])
@@ -1,3 +1,6 @@
+from typing import Any, Mapping
+
+
 def format_seconds(s: int) -> str:
     """Formats seconds to 00:00:00 format."""
     # days, remainder = divmod(s, 86400)
@@ -26,3 +29,21 @@ def replace_empty(s):
         return " "
     else:
         return s
+
+
+def page_name() -> str:
+    """Name of the page the running script renders, "main" if there is none."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return "main"
+    try:
+        manager = ctx.pages_manager
+        page: Mapping[str, Any] = manager.get_pages().get(
+            manager.current_page_script_hash, {}
+        )
+        return page.get("page_name") or "main"
+    except AttributeError:
+        # Streamlit versions without a pages manager.
+        return "main"
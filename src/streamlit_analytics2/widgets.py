@@ -1,166 +1,178 @@
-# import streamlit as st
-
-
-# def copy_original():
-#     # Store original streamlit functions. They will be monkey-patched with
-#       some wrappers in `start_tracking` (see wrapper functions below).
-#     _orig_button = st.button
-#     _orig_checkbox = st.checkbox
-#     _orig_radio = st.radio
-#     _orig_selectbox = st.selectbox
-#     _orig_multiselect = st.multiselect
-#     _orig_slider = st.slider
-#     _orig_select_slider = st.select_slider
-#     _orig_text_input = st.text_input
-#     _orig_number_input = st.number_input
-#     _orig_text_area = st.text_area
-#     _orig_date_input = st.date_input
-#     _orig_time_input = st.time_input
-#     _orig_file_uploader = st.file_uploader
-#     _orig_color_picker = st.color_picker
-#     # new elements, testing
-#     # _orig_download_button = st.download_button
-#     # _orig_link_button = st.link_button
-#     # _orig_page_link = st.page_link
-#     # _orig_toggle = st.toggle
-#     # _orig_camera_input = st.camera_input
-#     _orig_chat_input = st.chat_input
-#     # _orig_searchbox = st_searchbox
-
-#     _orig_sidebar_button = st.sidebar.button
-#     _orig_sidebar_checkbox = st.sidebar.checkbox
-#     _orig_sidebar_radio = st.sidebar.radio
-#     _orig_sidebar_selectbox = st.sidebar.selectbox
-#     _orig_sidebar_multiselect = st.sidebar.multiselect
-#     _orig_sidebar_slider = st.sidebar.slider
-#     _orig_sidebar_select_slider = st.sidebar.select_slider
-#     _orig_sidebar_text_input = st.sidebar.text_input
-#     _orig_sidebar_number_input = st.sidebar.number_input
-#     _orig_sidebar_text_area = st.sidebar.text_area
-#     _orig_sidebar_date_input = st.sidebar.date_input
-#     _orig_sidebar_time_input = st.sidebar.time_input
-#     _orig_sidebar_file_uploader = st.sidebar.file_uploader
-#     _orig_sidebar_color_picker = st.sidebar.color_picker
-#     # _orig_sidebar_searchbox = st.sidebar.st_searchbox
-#     # new elements, testing
-#     # _orig_sidebar_download_button = st.sidebar.download_button
-#     # _orig_sidebar_link_button = st.sidebar.link_button
-#     # _orig_sidebar_page_link = st.sidebar.page_link
-#     # _orig_sidebar_toggle = st.sidebar.toggle
-#     # _orig_sidebar_camera_input = st.sidebar.camera_input
-
-
-# def monkey_patch():
-#     # Monkey-patch streamlit to call the wrappers above.
-#     st.button = _wrap.button(_orig_button)
-#     st.checkbox = _wrap.checkbox(_orig_checkbox)
-#     st.radio = _wrap.select(_orig_radio)
-#     st.selectbox = _wrap.select(_orig_selectbox)
-#     st.multiselect = _wrap.multiselect(_orig_multiselect)
-#     st.slider = _wrap.value(_orig_slider)
-#     st.select_slider = _wrap.select(_orig_select_slider)
-#     st.text_input = _wrap.value(_orig_text_input)
-#     st.number_input = _wrap.value(_orig_number_input)
-#     st.text_area = _wrap.value(_orig_text_area)
-#     st.date_input = _wrap.value(_orig_date_input)
-#     st.time_input = _wrap.value(_orig_time_input)
-#     st.file_uploader = _wrap.file_uploader(_orig_file_uploader)
-#     st.color_picker = _wrap.value(_orig_color_picker)
-#     # new elements, testing
-#     # st.download_button = _wrap.value(_orig_download_button)
-#     # st.link_button = _wrap.value(_orig_link_button)
-#     # st.page_link = _wrap.value(_orig_page_link)
-#     # st.toggle = _wrap.value(_orig_toggle)
-#     # st.camera_input = _wrap.value(_orig_camera_input)
-#     st.chat_input = _wrap.chat_input(_orig_chat_input)
-#     # st_searchbox = _wrap.searchbox(_orig_searchbox)
-
-#     st.sidebar.button = _wrap.button(_orig_sidebar_button)
-#     st.sidebar.checkbox = _wrap.checkbox(_orig_sidebar_checkbox)
-#     st.sidebar.radio = _wrap.select(_orig_sidebar_radio)
-#     st.sidebar.selectbox = _wrap.select(_orig_sidebar_selectbox)
-#     st.sidebar.multiselect = _wrap.multiselect(_orig_sidebar_multiselect)
-#     st.sidebar.slider = _wrap.value(_orig_sidebar_slider)
-#     st.sidebar.select_slider = _wrap.select(_orig_sidebar_select_slider)
-#     st.sidebar.text_input = _wrap.value(_orig_sidebar_text_input)
-#     st.sidebar.number_input = _wrap.value(_orig_sidebar_number_input)
-#     st.sidebar.text_area = _wrap.value(_orig_sidebar_text_area)
-#     st.sidebar.date_input = _wrap.value(_orig_sidebar_date_input)
-#     st.sidebar.time_input = _wrap.value(_orig_sidebar_time_input)
-#     st.sidebar.file_uploader= _wrap.file_uploader(_orig_sidebar_file_uploader)
-#     st.sidebar.color_picker = _wrap.value(_orig_sidebar_color_picker)
-#     # st.sidebar.st_searchbox = _wrap.searchbox(_orig_sidebar_searchbox)
-
-#     # new elements, testing
-#     # st.sidebar.download_button = _wrap.value(_orig_sidebar_download_button)
-#     # st.sidebar.link_button = _wrap.value(_orig_sidebar_link_button)
-#     # st.sidebar.page_link = _wrap.value(_orig_sidebar_page_link)
-#     # st.sidebar.toggle = _wrap.value(_orig_sidebar_toggle)
-#     # st.sidebar.camera_input = _wrap.value(_orig_sidebar_camera_input)
-
-#     # replacements = {
-#     #     "button": _wrap.bool,
-#     #     "checkbox": _wrap.bool,
-#     #     "radio": _wrap.select,
-#     #     "selectbox": _wrap.select,
-#     #     "multiselect": _wrap.multiselect,
-#     #     "slider": _wrap.value,
-#     #     "select_slider": _wrap.select,
-#     #     "text_input": _wrap.value,
-#     #     "number_input": _wrap.value,
-#     #     "text_area": _wrap.value,
-#     #     "date_input": _wrap.value,
-#     #     "time_input": _wrap.value,
-#     #     "file_uploader": _wrap.file_uploader,
-#     #     "color_picker": _wrap.value,
-#     # }
-
-
-# def reset_widgets():
-#     # Reset streamlit functions.
-#     st.button = _orig_button
-#     st.checkbox = _orig_checkbox
-#     st.radio = _orig_radio
-#     st.selectbox = _orig_selectbox
-#     st.multiselect = _orig_multiselect
-#     st.slider = _orig_slider
-#     st.select_slider = _orig_select_slider
-#     st.text_input = _orig_text_input
-#     st.number_input = _orig_number_input
-#     st.text_area = _orig_text_area
-#     st.date_input = _orig_date_input
-#     st.time_input = _orig_time_input
-#     st.file_uploader = _orig_file_uploader
-#     st.color_picker = _orig_color_picker
-#     # new elements, testing
-#     # st.download_button = _orig_download_button
-#     # st.link_button = _orig_link_button
-#     # st.page_link = _orig_page_link
-#     # st.toggle = _orig_toggle
-#     # st.camera_input = _orig_camera_input
-#     st.chat_input = _orig_chat_input
-#     # st.searchbox = _orig_searchbox
-#     st.sidebar.button = _orig_sidebar_button  # type: ignore
-#     st.sidebar.checkbox = _orig_sidebar_checkbox  # type: ignore
-#     st.sidebar.radio = _orig_sidebar_radio  # type: ignore
-#     st.sidebar.selectbox = _orig_sidebar_selectbox  # type: ignore
-#     st.sidebar.multiselect = _orig_sidebar_multiselect  # type: ignore
-#     st.sidebar.slider = _orig_sidebar_slider  # type: ignore
-#     st.sidebar.select_slider = _orig_sidebar_select_slider  # type: ignore
-#     st.sidebar.text_input = _orig_sidebar_text_input  # type: ignore
-#     st.sidebar.number_input = _orig_sidebar_number_input  # type: ignore
-#     st.sidebar.text_area = _orig_sidebar_text_area  # type: ignore
-#     st.sidebar.date_input = _orig_sidebar_date_input  # type: ignore
-#     st.sidebar.time_input = _orig_sidebar_time_input  # type: ignore
-#     st.sidebar.file_uploader = _orig_sidebar_file_uploader  # type: ignore
-#     st.sidebar.color_picker = _orig_sidebar_color_picker  # type: ignore
-#     # new elements, testing
-#     # st.sidebar.download_button = _orig_sidebar_download_button
-#     # st.sidebar.link_button = _orig_sidebar_link_button
-#     # st.sidebar.page_link = _orig_sidebar_page_link
-#     # st.sidebar.toggle = _orig_sidebar_toggle
-#     # st.sidebar.camera_input = _orig_sidebar_camera_input
-#     # st.sidebar.searchbox = _orig_sidebar_searchbox
-#     # Save data to firestore.
-#     # TODO: Maybe don't save on every iteration but on regular intervals in a
-#     # background thread.
+"""
+Registry of the tracked streamlit widgets.
+
+Every `Widget` names a streamlit widget and the semantics of its return
+value, its kind, which picks the wrapper in `wrappers.py`:
+
+    bool    checked or not, e.g. st.checkbox
+    event   counts truthy returns, e.g. st.button
+    submit  st.form_submit_button, see `forms.py`
+    select  one of the options, e.g. st.radio
+    multi   several of the options, e.g. st.multiselect
+    value   a single value, e.g. st.slider
+    file    uploaded file(s), e.g. st.file_uploader
+    edit    edited data, e.g. st.data_editor
+    chat    st.chat_input
+
+`monkey_patch` sets the wrappers as methods of `DeltaGenerator`, which covers
+`st.sidebar`, columns, forms and every other container alike, and as the
+`st.*` functions, bound to the main container. The wrappers are built once
+per configuration and reused by later runs.
+
+st.link_button and st.page_link are not registered: they navigate in the
+browser and return nothing a wrapper could count.
+"""
+
+import threading
+import types
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+import streamlit as st
+from streamlit.delta_generator import DeltaGenerator
+
+from . import wrappers as _wrap
+
+
+class Widget(NamedTuple):
+    name: str
+    kind: str
+    # Numeric values go into a sketch with `numeric_sketches`.
+    numeric: bool = False
+
+
+KINDS: Dict[str, Callable[..., Any]] = {
+    "bool": _wrap.checkbox,
+    "event": _wrap.button,
+    "submit": _wrap.form_submit_button,
+    "select": _wrap.select,
+    "multi": _wrap.multiselect,
+    "value": _wrap.value,
+    "file": _wrap.file_uploader,
+    "edit": _wrap.data_editor,
+    "chat": _wrap.chat_input,
+}
+
+REGISTRY: Dict[str, Widget] = {}
+
+
+def register(name: str, kind: str, numeric: bool = False):
+    """Track widget `name` with the wrapper for `kind`, see the module docstring."""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown widget kind {kind!r}, expected one of {list(KINDS)}")
+    REGISTRY[name] = Widget(name, kind, numeric)
+    _built["key"] = None
+
+
+for _widget in [
+    Widget("button", "event"),
+    Widget("download_button", "event"),
+    Widget("checkbox", "bool"),
+    Widget("toggle", "bool"),
+    Widget("radio", "select"),
+    Widget("selectbox", "select"),
+    Widget("select_slider", "select"),
+    Widget("multiselect", "multi"),
+    Widget("slider", "value", numeric=True),
+    Widget("number_input", "value", numeric=True),
+    Widget("text_input", "value"),
+    Widget("text_area", "value"),
+    Widget("date_input", "value"),
+    Widget("time_input", "value"),
+    Widget("color_picker", "value"),
+    Widget("file_uploader", "file"),
+    Widget("camera_input", "file"),
+    Widget("data_editor", "edit"),
+    Widget("chat_input", "chat"),
+    Widget("form_submit_button", "submit"),
+]:
+    REGISTRY[_widget.name] = _widget
+
+# Name -> (own DeltaGenerator attribute or None, method, st function).
+_originals: Dict[str, Tuple[Any, Any, Any]] = {}
+# Name -> (method, st function) of the current configuration.
+_built: Dict[str, Any] = {"key": None, "patches": {}}
+_lock = threading.Lock()
+
+
+def copy_original():
+    """Store the original streamlit functions, before anything is patched."""
+    for name in REGISTRY:
+        if name not in _originals and hasattr(DeltaGenerator, name):
+            _originals[name] = (
+                DeltaGenerator.__dict__.get(name),
+                getattr(DeltaGenerator, name),
+                getattr(st, name, None),
+            )
+
+
+def dispatcher(func: Callable[..., Any], wrapper: Callable[..., Any], **kwargs):
+    """
+    Return a DeltaGenerator method that calls `wrapper(func, **kwargs)` on
+    the container it is called on, `func` being the original method.
+    """
+    return _wrap.method(wrapper(_wrap.bound(func), **kwargs), func)
+
+
+def _build(
+    widget: Widget, numeric_sketches: bool, policy: Dict[str, Any], hash_uploads: bool
+):
+    kwargs: Dict[str, Any] = {}
+    if widget.kind == "file":
+        kwargs["hash_uploads"] = hash_uploads
+    elif widget.kind == "value":
+        kwargs["sketch_numbers"] = numeric_sketches and widget.numeric
+        kwargs["policy"] = policy.get(widget.name)
+    elif widget.kind == "chat":
+        kwargs["policy"] = policy.get(widget.name)
+    method = dispatcher(_originals[widget.name][1], KINDS[widget.kind], **kwargs)
+    return method, types.MethodType(method, st._main)
+
+
+def _patches(
+    numeric_sketches: bool, policy: Dict[str, Any], hash_uploads: bool
+) -> Dict[str, Tuple[Any, Any]]:
+    key = (numeric_sketches, repr(sorted(policy.items())), hash_uploads)
+    with _lock:
+        if _built["key"] != key:
+            copy_original()
+            patches = {
+                name: _build(widget, numeric_sketches, policy, hash_uploads)
+                for name, widget in REGISTRY.items()
+                if name in _originals
+            }
+            _built.update(key=key, patches=patches)
+        built: Dict[str, Tuple[Any, Any]] = _built["patches"]
+        return built
+
+
+def monkey_patch(
+    numeric_sketches: bool = False,
+    policy: Optional[Dict] = None,
+    hash_uploads: bool = False,
+):
+    """
+    Patch streamlit to call the wrappers of the registered widgets.
+
+    `numeric_sketches`, `policy` (widget name -> value policy) and
+    `hash_uploads` are passed on to the wrappers, see `wrappers.value` and
+    `wrappers.file_uploader`.
+    """
+    patches = _patches(numeric_sketches, policy or {}, hash_uploads)
+    for name, (method, function) in patches.items():
+        setattr(DeltaGenerator, name, method)
+        if _originals[name][2] is not None:
+            setattr(st, name, function)
+
+
+def reset_widgets():
+    """Restore the original streamlit functions."""
+    for name, (own, _, function) in _originals.items():
+        if own is not None:
+            setattr(DeltaGenerator, name, own)
+        elif name in DeltaGenerator.__dict__:
+            delattr(DeltaGenerator, name)
+        if function is not None:
+            setattr(st, name, function)
+
+
+copy_original()
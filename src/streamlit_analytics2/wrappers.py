@@ -1,13 +1,205 @@
 import datetime
+import functools
+import sys
+import threading
+import time
 
 import streamlit as st
 
-from . import utils
-from .state import data, session_data
+from . import forms, metrics, policies, sketches, uploads, utils
+from .state import (
+    current_state_dict,
+    data,
+    history_lock,
+    is_tracked,
+    record,
+    session_data,
+    strings,
+)
 
 dicts = [data, session_data]
 
+# Marks widgets that count interactions without distinguishing values.
+NO_VALUE = object()
 
+
+# Time spent in the wrapped streamlit function of the call on this thread.
+_widget_time = threading.local()
+
+
+class _Container(threading.local):
+    # Container (DeltaGenerator) whose widget method runs on this thread.
+    dg = None
+
+
+_container = _Container()
+
+
+def bound(func):
+    """
+    Call `func`, an unbound DeltaGenerator method, on the container `method`
+    was called on.
+    """
+
+    def call(*args, **kwargs):
+        return func(_container.dg, *args, **kwargs)
+
+    return call
+
+
+def method(new_func, func):
+    """
+    Turn `new_func`, a wrapper around a `bound` version of `func`, into a
+    method that can be set on DeltaGenerator. Scripts of sessions that are not
+    tracked call `func` directly.
+    """
+
+    def call(self, *args, **kwargs):
+        if not is_tracked():
+            return func(self, *args, **kwargs)
+        outer = _container.dg
+        _container.dg = self
+        try:
+            return new_func(*args, **kwargs)
+        finally:
+            _container.dg = outer
+
+    return call
+
+
+def _instrumented(wrapper):
+    """
+    Measure the tracking overhead of the functions `wrapper` returns.
+
+    The time spent in the streamlit function itself is subtracted, the rest is
+    added to the run's wrapper time in `metrics`.
+    """
+
+    @functools.wraps(wrapper)
+    def make(func, *args, **kwargs):
+        def timed_func(*func_args, **func_kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*func_args, **func_kwargs)
+            finally:
+                _widget_time.seconds += time.perf_counter() - start
+
+        new_func = wrapper(timed_func, *args, **kwargs)
+
+        @functools.wraps(new_func)
+        def measured(*func_args, **func_kwargs):
+            _widget_time.seconds = 0.0
+            start = time.perf_counter()
+            try:
+                return new_func(*func_args, **func_kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.add_wrapper_time(elapsed - _widget_time.seconds)
+
+        return measured
+
+    return make
+
+
+def _state_dict():
+    """`st.session_state.state_dict`, see `state.use_state_dict`."""
+    state_dict = current_state_dict()
+    if state_dict is None:
+        state_dict = st.session_state.state_dict
+    return state_dict
+
+
+def _init(label, values=NO_VALUE):
+    """
+    Make sure `label` has a counter in the aggregate and today's dicts.
+
+    Widgets that count values get a dict with a zero counter per value in
+    `values`, the others a single int counter.
+    """
+    for d in dicts:
+        today = d["per_day"]["widgets"][-1]
+        if values is NO_VALUE:
+            if label not in d["widgets"]:
+                d["widgets"][label] = 0
+            if label not in today:
+                today[label] = 0
+            continue
+        # e.g. an int counter of a label tracked with `numeric_sketches`
+        # before, whose count cannot be split into values.
+        if not isinstance(d["widgets"].get(label), dict):
+            d["widgets"][label] = {}
+        if not isinstance(today.get(label), dict):
+            today[label] = {}
+        for value in values:
+            if value not in d["widgets"][label]:
+                d["widgets"][label][value] = 0
+            if value not in today[label]:
+                today[label][value] = 0
+
+
+def _count(label, value=NO_VALUE):
+    """Count one interaction with `label` (and `value`) in all dicts."""
+    # Applied and recorded together, see `journal.Journal.observe`.
+    with history_lock:
+        for d in dicts:
+            today = d["per_day"]["widgets"][-1]
+            if value is NO_VALUE:
+                d["widgets"][label] += 1
+                today[label] += 1
+            else:
+                d["widgets"][label][value] = d["widgets"][label].get(value, 0) + 1
+                today[label][value] = today[label].get(value, 0) + 1
+        if value is NO_VALUE:
+            record(("widgets", label))
+        else:
+            record(("widgets", label, value))
+
+
+def _init_sketch(label):
+    """
+    Make sure `label` has a sketch and an interaction counter in all dicts.
+
+    Values that were counted exactly before are folded into the new sketch.
+    """
+    for d in dicts:
+        if label not in d.setdefault("sketches", {}):
+            sketch = sketches.new()
+            exact = d["widgets"].get(label)
+            if isinstance(exact, dict):
+                for value, n in exact.items():
+                    try:
+                        sketches.add(sketch, float(value), n)
+                    except ValueError:
+                        pass
+                d["widgets"][label] = sum(exact.values())
+            d["sketches"][label] = sketch
+        today = d["per_day"]["widgets"][-1]
+        if isinstance(today.get(label), dict):
+            today[label] = sum(today[label].values())
+    _init(label)
+
+
+def _has_sketch(label):
+    return any(label in d.get("sketches", {}) for d in dicts)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _track(label, track):
+    """
+    Run `track`, which tracks widget `label`, or queue it in the batch of the
+    form the widget is in, see `forms.py`.
+    """
+    form_id = forms.current(_container.dg)
+    if form_id:
+        forms.defer(form_id, label, track)
+    else:
+        track()
+
+
+@_instrumented
 def checkbox(func):
     """
     Wrap st.checkbox.
@@ -15,25 +207,24 @@ def checkbox(func):
 
     def new_func(label, *args, **kwargs):
         checked = func(label, *args, **kwargs)
-        label = utils.replace_empty(label)
 
-        for d in dicts:
+        def track():
+            key = strings.intern(utils.replace_empty(label))
+            _init(key)
+            changed = checked != _state_dict().get(key, None)
+            if changed:
+                _count(key)
 
-            # Update aggregate data
-            if label not in d["widgets"]:
-                d["widgets"][label] = 0
-            if label not in d["per_day"]["widgets"][-1]:
-                d["per_day"]["widgets"][-1][label] = 0
-            if checked != st.session_state.state_dict.get(label, None):
-                d["widgets"][label] += 1
-                d["per_day"]["widgets"][-1][label] += 1
+            _state_dict()[key] = checked
+            return changed
 
-        st.session_state.state_dict[label] = checked
+        _track(label, track)
         return checked
 
     return new_func
 
 
+@_instrumented
 def button(func):
     """
     Wrap st.button.
@@ -41,53 +232,124 @@ def button(func):
 
     def new_func(label, *args, **kwargs):
         clicked = func(label, *args, **kwargs)
-        label = utils.replace_empty(label)
+        label = strings.intern(utils.replace_empty(label))
 
-        for d in dicts:
-            # Update aggregate data
-            if label not in d["widgets"]:
-                d["widgets"][label] = 0
-            if label not in d["per_day"]["widgets"][-1]:
-                d["per_day"]["widgets"][-1][label] = 0
-            if clicked:
-                d["widgets"][label] += 1
-                d["per_day"]["widgets"][-1][label] += 1
+        _init(label)
+        if clicked:
+            _count(label)
 
-        st.session_state.state_dict[label] = clicked
+        _state_dict()[label] = clicked
         return clicked
 
     return new_func
 
 
-def file_uploader(func):
+@_instrumented
+def form_submit_button(func):
+    """
+    Wrap st.form_submit_button.
+
+    A submit counts as one interaction with the button and runs the batch of
+    the form's widgets, see `forms.py`.
+    """
+
+    def new_func(label="Submit", *args, **kwargs):
+        form_id = forms.current(_container.dg)
+        submitted = func(label, *args, **kwargs)
+        label = strings.intern(utils.replace_empty(label))
+
+        _init(label)
+        if submitted:
+            _count(label)
+
+        _state_dict()[label] = submitted
+        forms.submit(form_id, submitted)
+        return submitted
+
+    return new_func
+
+
+@_instrumented
+def file_uploader(func, hash_uploads=False):
     """
-    Wrap st.file_uploader.
+    Wrap st.file_uploader, also st.camera_input.
+
+    Every file with a new `file_id` counts as an interaction, see
+    `uploads.py`. With `hash_uploads`, duplicate contents are counted too.
     """
 
     def new_func(label, *args, **kwargs):
         uploaded_file = func(label, *args, **kwargs)
-        label = utils.replace_empty(label)
-
-        for d in dicts:
-            # Update aggregate data
-            if label not in d["widgets"]:
-                d["widgets"][label] = 0
-            if label not in d["per_day"]["widgets"][-1]:
-                d["per_day"]["widgets"][-1][label] = 0
-            # TODO: Right now this doesn't track when multiple files are uploaded
-            # one after another. Maybe compare files directly (but probably not
-            # very clever to store in session state) or hash them somehow and check
-            # if a different file was uploaded.
-            if uploaded_file and not st.session_state.state_dict.get(label, None):
-                d["widgets"][label] += 1
-                d["per_day"]["widgets"][-1][label] += 1
 
-        st.session_state.state_dict[label] = bool(uploaded_file)
+        def track():
+            key = strings.intern(utils.replace_empty(label))
+            _init(key)
+            previous = _state_dict().get(key, None)
+            if not isinstance(previous, tuple):
+                previous = ()
+            files = uploads.files(uploaded_file)
+            current = tuple(uploads.identity(file) for file in files)
+            seen = uploads.session_digests() if hash_uploads else None
+            changed = False
+            for file, identity in zip(files, current):
+                if identity not in previous:
+                    _count(key)
+                    uploads.observe(key, file, seen)
+                    changed = True
+
+            _state_dict()[key] = current
+            return changed
+
+        _track(label, track)
         return uploaded_file
 
     return new_func
 
 
+def _fingerprint(edited):
+    # Pandas results come from pandas input, so pandas is imported by then.
+    pd = sys.modules.get("pandas")
+    if pd is not None and isinstance(edited, (pd.DataFrame, pd.Series)):
+        try:
+            return int(pd.util.hash_pandas_object(edited).sum())
+        except TypeError:
+            # e.g. cells holding lists.
+            pass
+    return hash(repr(edited))
+
+
+@_instrumented
+def data_editor(func):
+    """
+    Wrap st.data_editor.
+
+    An edit counts as one interaction, without the edited values. The editor
+    has no label, its `key` (default "data_editor") is used instead.
+    """
+
+    def new_func(data, *args, **kwargs):
+        edited = func(data, *args, **kwargs)
+        label = kwargs.get("key") or "data_editor"
+
+        def track():
+            key = strings.intern(str(label))
+            _init(key)
+            token = _fingerprint(edited)
+            previous = _state_dict().get(key, None)
+            changed = previous is not None and token != previous
+            if changed:
+                _count(key)
+
+            _state_dict()[key] = token
+            return changed
+
+        _track(label, track)
+        return edited
+
+    return new_func
+
+
+@_instrumented
 def select(func):
     """
     Wrap a streamlit function that returns one selected element out of multiple
@@ -97,35 +359,26 @@ def select(func):
 
     def new_func(label, options, *args, **kwargs):
         orig_selected = func(label, options, *args, **kwargs)
-        label = utils.replace_empty(label)
-        selected = utils.replace_empty(orig_selected)
 
-        for d in dicts:
-            # Update aggregate data
-            if label not in d["widgets"]:
-                d["widgets"][label] = {}
-            if label not in d["per_day"]["widgets"][-1]:
-                d["per_day"]["widgets"][-1][label] = {}
-
-            for option in options:
-                option = utils.replace_empty(option)
-                if option not in d["widgets"][label]:
-                    d["widgets"][label][option] = 0
-                if option not in d["per_day"]["widgets"][-1].get(label, {}):
-                    d["per_day"]["widgets"][-1][label][option] = 0
-
-            if selected != st.session_state.state_dict.get(label, None):
-                d["widgets"][label][selected] += 1
-                d["per_day"]["widgets"][-1][label][selected] = (
-                    d["per_day"]["widgets"][-1][label].get(selected, 0) + 1
-                )
-
-        st.session_state.state_dict[label] = selected
+        def track():
+            key = strings.intern(utils.replace_empty(label))
+            selected = strings.intern(utils.replace_empty(orig_selected))
+
+            _init(key, [strings.intern(utils.replace_empty(o)) for o in options])
+            changed = selected != _state_dict().get(key, None)
+            if changed:
+                _count(key, selected)
+
+            _state_dict()[key] = selected
+            return changed
+
+        _track(label, track)
         return orig_selected
 
     return new_func
 
 
+@_instrumented
 def multiselect(func):
     """
     Wrap a streamlit function that returns multiple selected elements out of
@@ -134,79 +387,90 @@ def multiselect(func):
 
     def new_func(label, options, *args, **kwargs):
         selected = func(label, options, *args, **kwargs)
-        label = utils.replace_empty(label)
-
-        for d in dicts:
-            if label not in d["widgets"]:
-                d["widgets"][label] = {}
-            if label not in d["per_day"]["widgets"][-1]:
-                d["per_day"]["widgets"][-1][label] = {}
-
-            for option in options:
-                option = utils.replace_empty(option)
-                if option not in d["widgets"][label]:
-                    d["widgets"][label][option] = 0
-                if option not in d["per_day"]["widgets"][-1].get(label, {}):
-                    d["per_day"]["widgets"][-1][label][option] = 0
 
+        def track():
+            key = strings.intern(utils.replace_empty(label))
+            _init(key, [strings.intern(utils.replace_empty(o)) for o in options])
+            changed = False
             for sel in selected:
-                sel = utils.replace_empty(sel)
-                if sel not in st.session_state.state_dict.get(label, []):
-                    d["widgets"][label][sel] += 1
-                    d["per_day"]["widgets"][-1][label][sel] += 1
+                sel = strings.intern(utils.replace_empty(sel))
+                if sel not in _state_dict().get(key, []):
+                    _count(key, sel)
+                    changed = True
+
+            _state_dict()[key] = selected
+            return changed
 
-        st.session_state.state_dict[label] = selected
+        _track(label, track)
         return selected
 
     return new_func
 
 
-def value(func):
+@_instrumented
+def value(func, sketch_numbers=False, policy=None):
     """
     Wrap a streamlit function that returns a single value,
     e.g. st.slider, st.text_input, st.number_input, st.text_area, st.date_input,
     st.time_input, st.color_picker.
+
+    With `sketch_numbers`, numeric values go into a quantile sketch (see
+    `sketches.py`) instead of one counter per distinct value. `policy` bounds
+    the size of recorded text values, see `policies.py`.
     """
 
     def new_func(label, *args, **kwargs):
         value = func(label, *args, **kwargs)
-        label = utils.replace_empty(label)
-
-        formatted_value = utils.replace_empty(value)
-        if type(value) is tuple and len(value) == 2:
-            # Double-ended slider or date input with start/end, convert to str.
-            formatted_value = f"{value[0]} - {value[1]}"
-
-        # st.date_input and st.time return datetime object, convert to str
-        if (
-            isinstance(value, datetime.datetime)
-            or isinstance(value, datetime.date)
-            or isinstance(value, datetime.time)
-        ):
-            formatted_value = str(value)
-
-        for d in dicts:
-            if label not in d["widgets"]:
-                d["widgets"][label] = {}
-            if label not in d["per_day"]["widgets"][-1]:
-                d["per_day"]["widgets"][-1][label] = {}
-
-            if formatted_value not in d["widgets"][label]:
-                d["widgets"][label][formatted_value] = 0
-            if formatted_value not in d["per_day"]["widgets"][-1].get(label, {}):
-                d["per_day"]["widgets"][-1][label][formatted_value] = 0
-
-            if formatted_value != st.session_state.state_dict.get(label, None):
-                d["widgets"][label][formatted_value] += 1
-                d["per_day"]["widgets"][-1][label][formatted_value] += 1
-
-        st.session_state.state_dict[label] = formatted_value
+        _track(
+            label, functools.partial(_track_value, label, value, sketch_numbers, policy)
+        )
         return value
 
     return new_func
 
 
-def chat_input(func):
+def _track_value(label, value, sketch_numbers, policy):
+    label = strings.intern(utils.replace_empty(label))
+
+    # Once a label has a sketch, its counter is an int, also for e.g. None.
+    if sketch_numbers and (_is_number(value) or _has_sketch(label)):
+        _init_sketch(label)
+        changed = value != _state_dict().get(label, None)
+        if changed:
+            _count(label)
+            if _is_number(value):
+                for d in dicts:
+                    sketches.add(d["sketches"][label], value)
+
+        _state_dict()[label] = value
+        return changed
+
+    formatted_value = utils.replace_empty(value)
+    if type(value) is tuple and len(value) == 2:
+        # Double-ended slider or date input with start/end, convert to str.
+        formatted_value = f"{value[0]} - {value[1]}"
+
+    # st.date_input and st.time return datetime object, convert to str
+    if (
+        isinstance(value, datetime.datetime)
+        or isinstance(value, datetime.date)
+        or isinstance(value, datetime.time)
+    ):
+        formatted_value = str(value)
+    formatted_value, token = policies.apply(formatted_value, policy)
+    formatted_value = strings.intern(formatted_value)
+
+    _init(label, [formatted_value])
+    changed = token != _state_dict().get(label, None)
+    if changed:
+        _count(label, formatted_value)
+
+    _state_dict()[label] = token
+    return changed
+
+
+@_instrumented
+def chat_input(func, policy=None):
     """
     Wrap a streamlit function that returns a single value,
     e.g. st.slider, st.text_input, st.number_input, st.text_area, st.date_input,
@@ -216,25 +480,19 @@ def chat_input(func):
     def new_func(placeholder, *args, **kwargs):
         input_received = func(placeholder, *args, **kwargs)
 
+        placeholder = strings.intern(placeholder)
         formatted_value = str(input_received)
+        if input_received is not None:
+            formatted_value, token = policies.apply(formatted_value, policy)
+        else:
+            token = formatted_value
+        formatted_value = strings.intern(formatted_value)
 
-        for d in dicts:
-            # Update aggregate data
-            if placeholder not in d["widgets"]:
-                d["widgets"][placeholder] = {}
-            if placeholder not in d["per_day"]["widgets"][-1]:
-                d["per_day"]["widgets"][-1][placeholder] = {}
-
-            if formatted_value not in d["widgets"][placeholder]:
-                d["widgets"][placeholder][formatted_value] = 0
-            if formatted_value not in d["per_day"]["widgets"][-1].get(placeholder, {}):
-                d["per_day"]["widgets"][-1][placeholder][formatted_value] = 0
-
-            if formatted_value != st.session_state.state_dict.get(placeholder):
-                d["widgets"][placeholder][formatted_value] += 1
-                d["per_day"]["widgets"][-1][placeholder][formatted_value] += 1
-
-        st.session_state.state_dict[placeholder] = formatted_value
+        _init(placeholder, [formatted_value])
+        if token != _state_dict().get(placeholder):
+            _count(placeholder, formatted_value)
+
+        _state_dict()[placeholder] = token
         return input_received
 
     return new_func
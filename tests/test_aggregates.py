@@ -0,0 +1,87 @@
+# tests/test_aggregates.py
+import random
+
+import pytest
+
+from streamlit_analytics2 import aggregates
+
+
+@pytest.fixture
+def widgets(monkeypatch):
+    d = {"widgets": {"Go": 3, "Color": {"red": 2, "blue": 5, "green": 0}}}
+    monkeypatch.setattr(aggregates, "data", d)
+    monkeypatch.setattr(aggregates, "observers", [])
+    aggregates.invalidate()
+    yield d
+    aggregates.invalidate()
+
+
+def _increment(d, label, value=None):
+    if value is None:
+        d["widgets"][label] += 1
+        aggregates._observe("2026-10-19", ("widgets", label))
+    else:
+        d["widgets"][label][value] += 1
+        aggregates._observe("2026-10-19", ("widgets", label, value))
+
+
+def test_top_n_stays_exact_as_counts_grow():
+    random.seed(0)
+    top = aggregates.TopN(5)
+    counts = {key: 0 for key in range(30)}
+    for key in counts:
+        top.update(key, 0)
+    for _ in range(2000):
+        key = random.choice(list(counts))
+        counts[key] += 1
+        top.update(key, counts[key])
+        expected = sorted(counts.values(), reverse=True)[:5]
+        assert [count for _, count in top.top()] == expected
+    assert all(counts[key] == count for key, count in top.top())
+    assert all(top.items[i][1] == key for key, i in top.index.items())
+
+
+def test_current_ranks_widgets_and_values(widgets):
+    aggregated = aggregates.current()
+
+    assert aggregated["totals"] == {"Go": 3, "Color": 7}
+    assert aggregated["ranking"] == [("Color", 7), ("Go", 3)]
+    assert aggregated["values"]["Color"] == [("blue", 5), ("red", 2), ("green", 0)]
+    assert aggregates._observe in aggregates.observers
+
+
+def test_observer_updates_the_aggregates(widgets):
+    aggregates.current()
+    for _ in range(4):
+        _increment(widgets, "Go")
+    for _ in range(4):
+        _increment(widgets, "Color", "red")
+
+    aggregated = aggregates.current()
+    assert aggregated["ranking"] == [("Color", 11), ("Go", 7)]
+    assert aggregated["values"]["Color"][0] == ("red", 6)
+
+
+def test_rebuilds_after_invalidate_or_new_data(widgets):
+    aggregates.current()
+
+    widgets["widgets"]["Go"] = 10
+    assert aggregates.current()["totals"]["Go"] == 3
+    aggregates.invalidate()
+    assert aggregates.current()["totals"]["Go"] == 10
+
+    widgets["widgets"] = {"Other": 1}
+    assert aggregates.current()["ranking"] == [("Other", 1)]
+
+
+def test_top_values_fills_up_with_unselected_values(widgets):
+    aggregated = aggregates.current()
+    counts = widgets["widgets"]["Color"]
+    counts["yellow"] = 0
+
+    rows = aggregates.top_values(aggregated, "Color", counts)
+    assert rows == [("blue", 5), ("red", 2), ("green", 0), ("yellow", 0)]
+    assert aggregates.top_values(aggregated, "Color", counts, n=2) == [
+        ("blue", 5),
+        ("red", 2),
+    ]
@@ -0,0 +1,118 @@
+# tests/test_bulk_delete.py
+import datetime
+import threading
+
+import pytest
+
+from streamlit_analytics2.firestore import bulk_delete, inactive_for
+
+
+class FakeQuery:
+    def __init__(self, client, name, limit=None, after=None):
+        self.client = client
+        self.name = name
+        self._limit = limit
+        self._after = after
+
+    def select(self, fields):
+        self.client.selected.append(fields)
+        return self
+
+    def order_by(self, field):
+        assert field == "__name__"
+        return self
+
+    def limit(self, n):
+        return FakeQuery(self.client, self.name, n, self._after)
+
+    def start_after(self, snapshot):
+        return FakeQuery(self.client, self.name, self._limit, snapshot.id)
+
+    def stream(self):
+        ids = sorted(i for c, i in self.client.docs if c == self.name)
+        ids = [i for i in ids if self._after is None or i > self._after]
+        for i in ids[: self._limit]:
+            yield FakeSnapshot(i, self.client.docs[(self.name, i)])
+
+
+class FakeSnapshot:
+    def __init__(self, id, doc):
+        self.id = id
+        self._doc = doc
+
+    def to_dict(self):
+        return dict(self._doc)
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self.client = client
+        self.paths = []
+
+    def delete(self, path):
+        self.paths.append(path)
+
+    def commit(self):
+        with self.client.lock:
+            self.client.commits.append(len(self.paths))
+            for path in self.paths:
+                self.client.docs.pop(path, None)
+
+
+class FakeClient:
+    """In-process stand-in for google.cloud.firestore.Client."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.commits = []
+        self.selected = []
+        self.lock = threading.Lock()
+
+    def collection(self, name):
+        query = FakeQuery(self, name)
+        query.document = lambda i: (name, i)
+        return query
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def _session(day):
+    return {"per_day": {"days": [str(day)]}}
+
+
+def test_delete_ids_in_batches():
+    docs = {("col", f"s{i}"): _session("2026-10-19") for i in range(25)}
+    docs[("col", "counts")] = {}
+    client = FakeClient(docs)
+    reports = []
+    ids = [f"s{i}" for i in range(20)] + ["counts"]
+
+    report = bulk_delete(
+        client, "col", ids, batch_size=8, max_workers=2, progress=reports.append
+    )
+    assert report["deleted"] == 20
+    assert sorted(client.commits) == [4, 8, 8]
+    assert [r["deleted"] for r in reports][-1] == 20
+    assert set(i for _, i in client.docs) == {"counts"} | {
+        f"s{i}" for i in range(20, 25)
+    }
+
+
+def test_delete_inactive_sessions_by_paging():
+    today = datetime.date.today()
+    old = today - datetime.timedelta(days=100)
+    docs = {("col", f"s{i:02}"): _session(old if i % 3 else today) for i in range(30)}
+    docs[("col", "counts")] = {}
+    client = FakeClient(docs)
+
+    report = bulk_delete(client, "col", predicate=inactive_for(90), batch_size=4)
+    assert report["deleted"] == 20
+    assert len(client.docs) == 11
+    # Only the days are fetched, not the whole session documents.
+    assert client.selected == [["per_day.days"]]
+
+
+def test_ids_or_predicate_required():
+    with pytest.raises(ValueError):
+        bulk_delete(FakeClient({}), "col")
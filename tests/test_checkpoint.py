@@ -0,0 +1,88 @@
+# tests/test_checkpoint.py
+import pytest
+
+from streamlit_analytics2 import checkpoint, codec, jsonfile, main
+from streamlit_analytics2.state import _reset
+
+
+def _data():
+    d = {"loaded_from_firestore": False}
+    _reset(d)
+    d["total_pageviews"] = 7
+    d["widgets"] = {"Go": 3, "Color": {"red": 2, "blue": 1}}
+    d["per_day"].append_day("2026-10-19")
+    d["per_day"]["pageviews"][-1] = 7
+    d["per_day"]["session_time_seconds"][-1] = 1.25
+    d["per_day"]["widgets"][-1] = {"Go": 3}
+    return d
+
+
+def test_checkpoint_round_trip(tmp_path):
+    d = _data()
+    path = tmp_path / "counts.ckpt"
+    checkpoint.save(path, d)
+    saved_at, restored = checkpoint.load(path)
+
+    assert saved_at == checkpoint.saved_at(path)
+    assert restored["per_day"]["pageviews"].typecode == "q"
+    assert codec.loads(codec.dumps(restored)) == codec.loads(codec.dumps(d))
+    assert checkpoint.saved_at(tmp_path / "missing.ckpt") is None
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "counts.json"
+    path.write_bytes(codec.dumps(_data()))
+    with pytest.raises(ValueError):
+        checkpoint.load(path)
+
+
+def test_periodic_defers_checkpoints_within_the_interval(tmp_path):
+    path = tmp_path / "counts.ckpt"
+    d = _data()
+    checkpoint.periodic(path, d, interval=0.2)
+    first = checkpoint.saved_at(path)
+    d["total_pageviews"] = 8
+    checkpoint.periodic(path, d, interval=0.2)
+    assert checkpoint.saved_at(path) == first
+
+    checkpoint._timers[str(path)].join()
+    assert checkpoint.load(path)[1]["total_pageviews"] == 8
+
+
+@pytest.fixture
+def live_data():
+    saved = dict(main.data)
+    yield main.data
+    main.data.clear()
+    main.data.update(saved)
+
+
+def test_checkpoint_is_restored_unless_the_json_was_saved_since(tmp_path, live_data):
+    path = tmp_path / "counts.ckpt"
+    json_path = tmp_path / "counts.json"
+    d = _data()
+    d["save_seq"] = 2
+    jsonfile.save(json_path, d)
+    assert jsonfile.save_seq(json_path) == 2
+    # Counted since the last save, the json file is older.
+    d["total_pageviews"] = 9
+    checkpoint.save(path, d)
+    assert checkpoint.save_seq(path) == 2
+
+    firestore = {"service_account_json": None, "streamlit_secrets_firestore_key": None}
+    assert main._restore_checkpoint(path, json_path, False, **firestore)
+    assert live_data["total_pageviews"] == 9
+
+    d["save_seq"] = 3
+    jsonfile.save(json_path, d)
+    assert not main._restore_checkpoint(path, json_path, False, **firestore)
+
+
+def test_save_seq_of_json_files_without_it_up_front(tmp_path):
+    path = tmp_path / "counts.json"
+    d = _data()
+    path.write_bytes(codec.dumps(d))
+    assert jsonfile.save_seq(path) == 0
+    d = {**d, "save_seq": 4}
+    path.write_bytes(codec.dumps(d))
+    assert jsonfile.save_seq(path) == 4
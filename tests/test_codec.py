@@ -0,0 +1,62 @@
+# tests/test_codec.py
+import json
+
+import pytest
+
+from streamlit_analytics2 import codec
+from streamlit_analytics2.columnar import PerDay
+
+DATA = {
+    "total_pageviews": 2,
+    "total_time_seconds": 1.5,
+    "per_day": PerDay(
+        {
+            "days": ["2026-10-19"],
+            "pageviews": [2],
+            "script_runs": [4],
+            "session_time_seconds": [1.5],
+            "widgets": [{"button": 1, "radio": {1: 1, "b": 0}}],
+        }
+    ),
+    "widgets": {"button": 1, "radio": {1: 1, "b": 0}},
+}
+
+
+@pytest.fixture(params=list(codec.BACKENDS))
+def backend(request):
+    try:
+        codec.use(request.param)
+    except ImportError:
+        pytest.skip(f"{request.param} is not installed")
+    yield request.param
+    codec.use()
+
+
+def test_backends_match_stdlib(backend):
+    raw = codec.dumps(DATA)
+    expected = json.loads(json.dumps(DATA["per_day"].to_dict()))
+    assert codec.load_data(raw)["per_day"] == expected
+    assert codec.loads(raw) == json.loads(raw)
+
+
+def test_unusual_keys_fall_back_to_stdlib(backend):
+    assert json.loads(codec.dumps({"radio": {None: 1, True: 2}})) == {
+        "radio": {"null": 1, "true": 2}
+    }
+
+
+def test_msgspec_validates_schema():
+    pytest.importorskip("msgspec")
+    codec.use("msgspec")
+    try:
+        with pytest.raises(ValueError):
+            codec.load_data(b'{"per_day": {"pageviews": ["1"]}}')
+    finally:
+        codec.use()
+
+
+def test_float_counts_are_loaded(backend):
+    raw = b'{"total_pageviews": 2.0, "widgets": {"a": 1.0, "b": {"x": 0.5}}}'
+    d = codec.load_data(raw)
+    assert d["total_pageviews"] == 2
+    assert d["widgets"] == {"a": 1, "b": {"x": 0.5}}
@@ -0,0 +1,72 @@
+# tests/test_columnar.py
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from streamlit_analytics2.columnar import PerDay, add_history, to_jsonable
+
+HISTORY = {
+    "days": ["2025-02-19", "2025-02-20"],
+    "pageviews": [0, 2],
+    "script_runs": [0, 4],
+    "session_time_seconds": [0.0, 8.4],
+    "widgets": [{}, {"button": 1}],
+}
+
+
+def test_roundtrip_to_existing_json_shape():
+    history = PerDay(HISTORY)
+    assert history.to_dict() == HISTORY
+    assert json.loads(json.dumps({"per_day": history}, default=to_jsonable)) == {
+        "per_day": HISTORY
+    }
+
+
+def test_fills_missing_columns_of_old_data():
+    history = PerDay({"days": ["2025-02-19"], "pageviews": [1], "script_runs": [2]})
+    assert list(history["session_time_seconds"]) == [0.0]
+    assert history["widgets"] == [{}]
+
+
+def test_misaligned_columns_are_not_replaced():
+    with pytest.raises(ValueError):
+        PerDay({"days": ["2025-02-19", "2025-02-20"], "pageviews": [5]})
+    with pytest.raises(ValueError):
+        PerDay({"days": ["2025-02-19"], "widgets": [{}, {"button": 1}]})
+
+
+def test_tracker_updates_and_zero_copy_frame():
+    history = PerDay(HISTORY)
+    history["pageviews"][-1] += 1
+    assert history["days"][-1] == "2025-02-20"
+
+    df = pd.DataFrame(history.to_numpy(), copy=False)
+    assert np.shares_memory(df["pageviews"].to_numpy(), history["pageviews"])
+    assert df["pageviews"].tolist() == [0, 3]
+
+    # Growing the history while pandas still holds the view must not fail.
+    history.append_day("2025-02-21")
+    history["script_runs"][-1] += 1
+    assert history.to_dict()["script_runs"] == [0, 4, 1]
+    assert df["script_runs"].tolist() == [0, 4]
+
+    history.delete_front(1)
+    assert list(history["days"]) == ["2025-02-20", "2025-02-21"]
+    assert len(history["widgets"]) == 2
+
+
+def test_add_history_matches_rows_by_day():
+    loaded = PerDay(HISTORY)
+    tracked = {
+        "days": ["2025-02-20", "2025-02-22"],
+        "pageviews": [1, 1],
+        "script_runs": [1, 2],
+        "session_time_seconds": [0.5, 1.0],
+        "widgets": [{"button": 1}, {"radio": {"a": 1}}],
+    }
+    add_history(loaded, tracked)
+    assert list(loaded["days"]) == ["2025-02-19", "2025-02-20", "2025-02-22"]
+    assert list(loaded["pageviews"]) == [0, 3, 1]
+    assert loaded["widgets"][2] == {"radio": {"a": 1}}
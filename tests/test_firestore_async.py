@@ -0,0 +1,148 @@
+# tests/test_firestore_async.py
+import asyncio
+import threading
+
+import pytest
+
+from streamlit_analytics2 import firestore_async, schema
+from streamlit_analytics2.firestore import TRACKING_FIELDS
+from streamlit_analytics2.firestore_async import AsyncFirestore
+
+
+class FakeSnapshot:
+    def __init__(self, doc):
+        self._doc = doc
+
+    def to_dict(self):
+        return None if self._doc is None else dict(self._doc)
+
+
+class FakeDocument:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    async def get(self, field_paths=None):
+        await self.client.enter()
+        try:
+            doc = self.client.docs.get(self.path)
+            if doc is not None and field_paths is not None:
+                doc = {k: v for k, v in doc.items() if k in field_paths}
+            return FakeSnapshot(doc)
+        finally:
+            self.client.exit()
+
+    async def set(self, payload, merge=False):
+        await self.client.enter()
+        try:
+            self.client.writes += 1
+            self.client.docs.setdefault(self.path, {}).update(payload)
+        finally:
+            self.client.exit()
+
+    async def delete(self):
+        self.client.docs.pop(self.path, None)
+
+
+class FakeCollection:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def document(self, name):
+        return FakeDocument(self.client, (self.name, name))
+
+
+class FakeAsyncClient:
+    """In-process stand-in for google.cloud.firestore.AsyncClient."""
+
+    def __init__(self, gate=None):
+        self.docs = {}
+        self.writes = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.gate = gate
+
+    async def enter(self):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if self.gate is not None:
+            while not self.gate.is_set():
+                await asyncio.sleep(0.001)
+
+    def exit(self):
+        self.in_flight -= 1
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+
+def test_save_load_delete_roundtrip():
+    client = FakeAsyncClient()
+    backend = AsyncFirestore(lambda: client)
+    try:
+        backend.set("col", "counts", {"total_pageviews": 3}).result(timeout=5)
+        assert backend.get("col", "counts").result(timeout=5) == {"total_pageviews": 3}
+        backend.delete("col", "counts").result(timeout=5)
+        assert backend.get("col", "counts").result(timeout=5) is None
+    finally:
+        backend.close()
+
+
+def test_bounded_concurrency_and_coalescing():
+    gate = threading.Event()
+    client = FakeAsyncClient(gate)
+    backend = AsyncFirestore(lambda: client, max_concurrency=2)
+    try:
+        futures = [backend.set("col", f"session{i}", {"n": i}) for i in range(6)]
+        # Saves of a document that has not started yet collapse into one.
+        futures += [backend.set("col", "session5", {"n": 50}) for _ in range(3)]
+        gate.set()
+        for future in futures:
+            future.result(timeout=5)
+        assert client.max_in_flight <= 2
+        assert client.writes == 6
+        assert client.docs[("col", "session5")] == {"n": 50}
+    finally:
+        backend.close()
+
+
+def test_tracking_load_leaves_history_for_later():
+    client = FakeAsyncClient()
+    client.docs[("col", "counts")] = {
+        "total_pageviews": 3,
+        "per_day": {"days": ["2026-10-19"], "pageviews": [3]},
+    }
+    backend = AsyncFirestore(lambda: client)
+    try:
+        data = {"total_pageviews": 0, "per_day": None}
+        firestore_async.load(
+            data, collection_name="col", field_paths=TRACKING_FIELDS, backend=backend
+        ).result(timeout=5)
+        assert data == {"total_pageviews": 3, "per_day": None}
+
+        history = firestore_async.load_history(
+            collection_name="col", backend=backend
+        ).result(timeout=5)
+        assert history["per_day"]["days"] == ["2026-10-19"]
+        assert list(history["per_day"]["pageviews"]) == [3]
+        # Upgraded from the old shape as it is loaded.
+        assert history["per_day"]["widgets"] == [{}]
+        assert history["schema_version"] == schema.VERSION
+    finally:
+        backend.close()
+
+
+def test_failed_load_fails_the_returned_future():
+    client = FakeAsyncClient()
+    # Malformed: a schema version that cannot be compared.
+    client.docs[("col", "counts")] = {"schema_version": "x"}
+    backend = AsyncFirestore(lambda: client)
+    try:
+        future = firestore_async.load(
+            {"total_pageviews": 0}, collection_name="col", backend=backend
+        )
+        with pytest.raises(TypeError):
+            future.result(timeout=5)
+    finally:
+        backend.close()
@@ -0,0 +1,54 @@
+# tests/test_forms.py
+import pytest
+import streamlit as st
+
+from streamlit_analytics2 import forms
+
+
+@pytest.fixture(autouse=True)
+def run():
+    st.session_state.pop("forms_seen", None)
+    forms.start()
+    yield
+    forms.end()
+
+
+def _tracker(calls, label, changed=True):
+    def track():
+        calls.append(label)
+        return changed
+
+    return track
+
+
+def test_first_render_records_the_initial_values():
+    calls = []
+    forms.defer("f", "name", _tracker(calls, "name"))
+    assert calls == []
+    forms.end()
+    assert calls == ["name"]
+
+
+def test_unsubmitted_reruns_skip_the_form_widgets():
+    st.session_state.forms_seen = {"f"}
+    calls = []
+    forms.defer("f", "name", _tracker(calls, "name"))
+    forms.submit("f", False)
+    forms.end()
+    assert calls == []
+
+
+def test_submit_runs_the_batch_once():
+    st.session_state.forms_seen = {"f", "g"}
+    calls = []
+    forms.defer("f", "name", _tracker(calls, "name"))
+    forms.defer("f", "color", _tracker(calls, "color", changed=False))
+    forms.defer("g", "other", _tracker(calls, "other"))
+    forms.submit("f", True)
+    assert calls == ["name", "color"]
+
+    # Widgets after the submit button are tracked right away.
+    forms.defer("f", "late", _tracker(calls, "late"))
+    assert calls[-1] == "late"
+    forms.end()
+    assert "other" not in calls
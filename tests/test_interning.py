@@ -0,0 +1,70 @@
+# tests/test_interning.py
+import json
+
+from streamlit_analytics2.columnar import PerDay, to_jsonable
+from streamlit_analytics2.interning import (
+    StringTable,
+    counted_strings,
+    decode,
+    encode,
+    intern_data,
+)
+
+
+def _data():
+    widgets = {"Select your favorite": {"cat": 2, "dog": 0}, "Click me": 3}
+    return {
+        "total_pageviews": 2,
+        "widgets": widgets,
+        "per_day": {
+            "days": ["2025-02-19", "2025-02-20"],
+            "pageviews": [0, 2],
+            "script_runs": [0, 4],
+            "session_time_seconds": [0.0, 1.5],
+            "widgets": [dict(widgets), dict(widgets)],
+        },
+    }
+
+
+def test_encode_decode_roundtrip():
+    d = _data()
+    encoded = encode(d)
+    assert encoded["strings"] == ["Select your favorite", "cat", "dog", "Click me"]
+    assert encoded["widgets"] == {"0": {"1": 2, "2": 0}, "3": 3}
+    assert decode(json.loads(json.dumps(encoded))) == d
+
+
+def test_encode_accepts_columnar_history_and_shrinks():
+    d = _data()
+    d["per_day"]["widgets"] = [d["widgets"]] * 2
+    d["per_day"] = PerDay(d["per_day"])
+    plain = json.dumps(d, default=to_jsonable)
+    encoded = json.dumps(encode(d))
+    assert len(encoded) < len(plain)
+    assert decode(json.loads(encoded))["per_day"] == d["per_day"].to_dict()
+
+
+def test_intern_data_shares_strings():
+    table = StringTable()
+    a, b = _data(), json.loads(json.dumps(_data()))
+    intern_data(a, table)
+    intern_data(b, table)
+    key_a = next(iter(a["widgets"]))
+    key_b = next(iter(b["per_day"]["widgets"][1]))
+    assert key_a is key_b
+    assert table.intern("Select your favorite") is key_a
+
+
+def test_retain_drops_strings_no_longer_counted():
+    table = StringTable()
+    d = _data()
+    intern_data(d, table)
+    table.intern("typed once")
+    kept = table.intern("cat")
+
+    table.retain(counted_strings(d))
+    assert "typed once" not in table.strings()
+    assert len(table) == 4
+    # Strings that are still counted keep their instance.
+    assert table.intern("cat") is kept
+    assert decode(encode(d)) == d
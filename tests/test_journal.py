@@ -0,0 +1,96 @@
+# tests/test_journal.py
+from streamlit_analytics2 import journal, main
+from streamlit_analytics2.state import _reset, observers, record
+
+
+def _data():
+    d = {"loaded_from_firestore": False}
+    _reset(d)
+    return d
+
+
+def _record_some(wal):
+    observers.append(wal.observe)
+    try:
+        record(("pageviews",))
+        record(("script_runs",))
+        record(("widgets", "Go"))
+        record(("widgets", "Color", "red"))
+        record(("widgets", "Color", "red"))
+    finally:
+        observers.remove(wal.observe)
+    assert wal.commit(timeout=5)
+
+
+def test_recover_replays_records_after_the_saved_sequence(tmp_path):
+    path = tmp_path / "sa2.journal"
+    wal = journal.Journal(path, commit_interval=0)
+    _record_some(wal)
+    wal.close()
+
+    # As if the process crashed before anything was saved.
+    d = _data()
+    assert journal.Journal(path).recover(d) == 5
+    assert d["total_pageviews"] == 1
+    assert d["widgets"] == {"Go": 1, "Color": {"red": 2}}
+    assert d["per_day"]["widgets"][-1] == {"Go": 1, "Color": {"red": 2}}
+
+    # Only records after the saved sequence number are replayed.
+    d = _data()
+    d["journal"] = {path.name: 3}
+    assert journal.Journal(path).recover(d) == 2
+    assert d["widgets"] == {"Color": {"red": 2}}
+
+
+def test_compact_and_torn_records(tmp_path):
+    path = tmp_path / "sa2.journal"
+    wal = journal.Journal(path, commit_interval=0)
+    _record_some(wal)
+    wal._compact(wal.seq)
+    assert path.read_bytes() == b""
+    wal.close()
+
+    # A new process continues after the saved sequence number.
+    d = _data()
+    d["journal"] = {path.name: 5}
+    wal = journal.Journal(path, commit_interval=0)
+    assert wal.recover(d) == 0
+    _record_some(wal)
+    wal.close()
+    with open(path, "ab") as f:
+        f.write(b'[11, "2026-10')
+    d = _data()
+    d["journal"] = {path.name: 5}
+    assert journal.Journal(path).recover(d) == 5
+
+
+def test_flush_compacts_up_to_the_marked_record(tmp_path, monkeypatch):
+    path = tmp_path / "sa2.journal"
+    wal = journal.Journal(path, commit_interval=0)
+    monkeypatch.setattr(main.journal, "attach", lambda *args: wal)
+    d = _data()
+    assert wal.recover(d) == 0
+    _record_some(wal)
+    assert d["journal"] == {path.name: 5}
+    on_saved = main._flush_due(path, flush_interval=0)
+    # Recorded after the save was taken, marked with their increments.
+    _record_some(wal)
+    assert d["journal"] == {path.name: 10}
+    assert on_saved.args == (5,)
+    wal.close()
+
+
+def test_flush_only_waits_for_the_writer_when_synced(tmp_path, monkeypatch):
+    path = tmp_path / "sa2.journal"
+    wal = journal.Journal(path, commit_interval=0.5)
+    monkeypatch.setattr(main.journal, "attach", lambda *args: wal)
+    monkeypatch.setitem(main._flushed, "time", float("inf"))
+    observers.append(wal.observe)
+    try:
+        record(("pageviews",))
+    finally:
+        observers.remove(wal.observe)
+    # Not written yet, but the run goes on without a save.
+    assert main._flush_due(path, flush_interval=10) is None
+    assert wal.commit(timeout=0) is False
+    wal.close()
@@ -0,0 +1,96 @@
+# tests/test_jsonfile.py
+import json
+import os
+
+import pytest
+
+import streamlit_analytics2.jsonfile as jsonfile
+from streamlit_analytics2.columnar import PerDay
+
+
+def _data(pageviews):
+    return {
+        "total_pageviews": pageviews,
+        "total_script_runs": 0,
+        "total_time_seconds": 0,
+        "per_day": PerDay(
+            {
+                "days": ["2026-10-19"],
+                "pageviews": [pageviews],
+                "script_runs": [0],
+                "session_time_seconds": [0.0],
+                "widgets": [{"button": pageviews}],
+            }
+        ),
+        "widgets": {"button": pageviews},
+    }
+
+
+def _touch(path, contents):
+    path.write_text(json.dumps(contents))
+    stat = path.stat()
+    # Make sure the change is visible even on coarse mtime filesystems.
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_file_is_only_read_when_it_changed(tmp_path):
+    path = tmp_path / "analytics.json"
+    jsonfile.save(path, _data(3))
+
+    d = _data(0)
+    # Our own save is not read back.
+    assert not jsonfile.load(path, d)
+    assert d["total_pageviews"] == 0
+
+    _touch(path, {"total_pageviews": 7})
+    assert jsonfile.load(path, d)
+    assert d["total_pageviews"] == 7
+    assert not jsonfile.load(path, d)
+
+
+def test_merge_adds_external_changes(tmp_path, monkeypatch):
+    path = tmp_path / "analytics.json"
+    with monkeypatch.context() as m:
+        # What was written is kept, not parsed back.
+        m.setattr(jsonfile, "_parse", None)
+        jsonfile.save(path, _data(3), merge=True)
+
+    # Another process added 2 pageviews to the file in the meantime.
+    external = jsonfile.columnar.to_jsonable(_data(5)["per_day"])
+    _touch(
+        path,
+        dict(
+            jsonfile.interning.decode(json.loads(path.read_text())),
+            total_pageviews=5,
+            widgets={"button": 5},
+            per_day=external,
+        ),
+    )
+
+    live = _data(4)
+    assert jsonfile.load(path, live, merge=True)
+    assert live["total_pageviews"] == 6
+    assert live["widgets"] == {"button": 6}
+    assert list(live["per_day"]["pageviews"]) == [6]
+
+
+def test_saved_file_is_dictionary_encoded(tmp_path):
+    path = tmp_path / "analytics.json"
+    jsonfile.save(path, _data(3))
+
+    saved = json.loads(path.read_text())
+    assert saved["strings"] == ["button"]
+    assert saved["widgets"] == {"0": 3}
+    assert jsonfile._parse(path.read_bytes())["widgets"] == {"button": 3}
+
+
+def test_unreadable_file_is_not_saved_over(tmp_path):
+    path = tmp_path / "analytics.json"
+    path.write_text('{"total_pageviews": ')
+    with pytest.raises(ValueError):
+        jsonfile.load(path, _data(0))
+    assert jsonfile.is_unreadable(path)
+
+    _touch(path, {"total_pageviews": 7})
+    assert jsonfile.load(path, _data(0))
+    assert not jsonfile.is_unreadable(path)
@@ -0,0 +1,35 @@
+# tests/test_latency.py
+import datetime
+
+from streamlit_analytics2 import latency
+
+
+def test_latency_per_page_and_day():
+    d = {}
+    for ms in range(1, 101):
+        latency.observe(d, "home", ms / 1000, day="2026-10-18")
+    latency.observe(d, "report", 2.0, day="2026-10-19")
+
+    overall = latency.summary(d)
+    assert [row["page"] for row in overall] == ["report", "home"]
+    home = overall[1]
+    assert home["runs"] == 100
+    assert abs(home["p50_ms"] - 50) <= 1
+    assert abs(home["p99_ms"] - 99) <= 2
+    assert [row["page"] for row in latency.summary(d, "2026-10-19")] == ["report"]
+
+
+def test_old_days_are_dropped_and_merge_adds_counts():
+    d = {}
+    latency.observe(d, "home", 0.1, day="2026-01-01")
+    last = datetime.date(2026, 10, 19)
+    for i in range(latency.LATENCY_DAYS, -1, -1):
+        latency.observe(d, "home", 0.1, day=str(last - datetime.timedelta(days=i)))
+    assert "2026-01-01" not in d["latency"]["days"]
+    assert len(d["latency"]["days"]) == latency.LATENCY_DAYS
+    assert d["latency"]["pages"]["home"]["count"] == latency.LATENCY_DAYS + 2
+
+    other = {}
+    latency.observe(other, "home", 0.2, day="2026-10-19")
+    latency.merge(d["latency"], other["latency"])
+    assert d["latency"]["days"]["2026-10-19"]["home"]["count"] == 2
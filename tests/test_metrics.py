@@ -0,0 +1,65 @@
+# tests/test_metrics.py
+import socket
+import urllib.request
+
+import pytest
+
+from streamlit_analytics2 import metrics
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_render_openmetrics():
+    metrics.inc("sa2_firestore_calls", op="save")
+    metrics.inc("sa2_firestore_calls", op="save")
+    metrics.set_gauge("sa2_sessions", 3)
+    metrics.start_run()
+    metrics.add_wrapper_time(0.25)
+    metrics.end_run()
+
+    text = metrics.render()
+    assert text.endswith("# EOF\n")
+    assert "# TYPE sa2_firestore_calls counter" in text
+    assert 'sa2_firestore_calls_total{op="save"} 2' in text
+    assert "sa2_sessions 3" in text
+    assert "sa2_wrapper_seconds_count 1" in text
+    assert "sa2_wrapper_seconds_sum 0.25" in text
+    assert metrics.snapshot()["sa2_runs_total"] == 1
+    with pytest.raises(KeyError):
+        metrics.inc("sa2_unknown")
+
+
+def test_write_and_serve(tmp_path):
+    metrics.inc("sa2_write_errors")
+    path = tmp_path / "metrics.prom"
+    metrics.write(path, min_interval=0)
+    assert "sa2_write_errors_total 1" in path.read_text()
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = metrics.serve(port)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as r:
+            assert r.headers["Content-Type"] == metrics.CONTENT_TYPE
+            assert "sa2_write_errors_total 1" in r.read().decode()
+    finally:
+        server.shutdown()
+        metrics._servers.pop(port)
+
+
+def test_sync_firestore_write_errors_are_counted(monkeypatch):
+    from streamlit_analytics2 import main
+
+    def fail(*args, **kwargs):
+        raise OSError("unavailable")
+
+    monkeypatch.setattr(main.firestore, "save", fail)
+    with pytest.raises(OSError):
+        main._firestore_save(False, None, collection_name="col")
+    assert 'sa2_write_errors_total{target="firestore"} 1' in metrics.render()
@@ -0,0 +1,37 @@
+# tests/test_policies.py
+import pytest
+
+from streamlit_analytics2 import policies
+
+TEXT = "lorem ipsum " * 10000
+
+
+def test_keep_is_the_default():
+    assert policies.apply(TEXT, None) == (TEXT, TEXT)
+    assert policies.apply(3, {"mode": "digest"}) == (3, 3)
+
+
+def test_truncate_and_ignore_are_bounded():
+    key, token = policies.apply(TEXT, {"mode": "truncate", "max_chars": 20})
+    assert key == TEXT[:20] + "…"
+    assert len(token) == 32
+    assert policies.apply("short", {"mode": "truncate"})[0] == "short"
+
+    key, other = policies.apply(TEXT + "!", {"mode": "ignore"})
+    assert key == policies.IGNORED
+    # Edits beyond the recorded part still count as a change.
+    assert other != token
+
+
+def test_digest_writes_full_text_once(tmp_path):
+    policy = {"mode": "digest", "side_store": tmp_path}
+    key, token = policies.apply(TEXT, policy)
+    assert key == f"#{token}"
+    assert (tmp_path / f"{token}.txt").read_text() == TEXT
+    assert policies.apply(TEXT, policy) == (key, token)
+
+
+def test_validate():
+    policies.validate({"mode": "truncate", "max_chars": 5})
+    with pytest.raises(ValueError):
+        policies.validate({"mode": "compress"})
@@ -0,0 +1,99 @@
+# tests/test_replicas.py
+import copy
+import datetime
+import json
+
+from streamlit_analytics2 import codec, replicas, retention
+
+
+def _replica(pageviews, clicks, days):
+    return {
+        "total_pageviews": pageviews,
+        "total_script_runs": pageviews * 2,
+        "total_time_seconds": 1.5,
+        "per_day": {
+            "days": days,
+            "pageviews": [pageviews] * len(days),
+            "script_runs": [1] * len(days),
+            "session_time_seconds": [0.5] * len(days),
+            "widgets": [{"Go": clicks}] * len(days),
+        },
+        "widgets": {"Go": clicks, "Color": {"red": clicks}},
+        "start_time": "05 Mar 2026, 10:00:00",
+    }
+
+
+def _write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(codec.dumps(data))
+    return path
+
+
+def test_replicas_are_added_and_versions_joined(tmp_path):
+    old = _write(tmp_path, "a-old.json", _replica(1, 2, ["2026-10-18"]))
+    a = _write(tmp_path, "a.json", _replica(3, 4, ["2026-10-18", "2026-10-19"]))
+    b = _write(tmp_path, "b.json", _replica(5, 1, ["2026-10-19"]))
+
+    states = replicas.join_states(
+        replicas.load_states(old, "a"), replicas.load_states(a, "a")
+    )
+    states = replicas.join_states(states, replicas.load_states(b, "b"))
+    merged = replicas.combine(states)
+    assert merged["total_pageviews"] == 8
+    assert merged["widgets"] == {"Go": 5, "Color": {"red": 5}}
+    assert list(merged["per_day"]["days"]) == ["2026-10-18", "2026-10-19"]
+    assert list(merged["per_day"]["pageviews"]) == [3, 8]
+
+
+def test_merging_is_idempotent(tmp_path):
+    a = _write(tmp_path, "a.json", _replica(3, 4, ["2026-10-19"]))
+    b = _write(tmp_path, "b.json", _replica(5, 1, ["2026-10-19"]))
+    once = replicas.merge_files([a, b], max_workers=2)
+    twice = replicas.merge_files([a, b, a, b], max_workers=2)
+    assert json.loads(codec.dumps(once)) == json.loads(codec.dumps(twice))
+
+    merged = tmp_path / "merged.json"
+    replicas.main([str(merged), str(a), str(b), "--workers", "1"])
+    again = replicas.merge_files([merged, a])
+    assert again["total_pageviews"] == once["total_pageviews"] == 8
+    assert sorted(again["replicas"]) == sorted([str(a.resolve()), str(b.resolve())])
+
+
+def test_spellings_of_a_path_are_one_replica(tmp_path, monkeypatch):
+    a = _write(tmp_path, "a.json", _replica(3, 4, ["2026-10-19"]))
+    monkeypatch.chdir(tmp_path)
+    merged = replicas.merge_files([a, "a.json", "./a.json"], max_workers=1)
+    assert merged["total_pageviews"] == 3
+    assert len(merged["replicas"]) == 1
+
+
+def test_copied_file_is_the_same_replica(tmp_path):
+    data = {**_replica(3, 4, ["2026-10-19"]), "replica_id": "r1"}
+    a = _write(tmp_path, "a.json", data)
+    moved = _write(tmp_path, "moved.json", data)
+    merged = replicas.merge_files([a, moved], max_workers=1)
+    assert merged["total_pageviews"] == 3
+    assert list(merged["replicas"]) == ["r1"]
+
+
+def test_versions_are_joined_at_the_same_granularity():
+    old = _replica(1, 2, ["2026-10-05", "2026-10-06", "2026-10-19"])
+    for key in ["per_week", "per_month"]:
+        old[key] = {"days": [], "widgets": [], "pageviews": []}
+        old[key].update(script_runs=[], session_time_seconds=[])
+    # The newer version rolled the first week up and counted one more view.
+    new = copy.deepcopy(old)
+    retention.compact(new, detail_days=7, today=datetime.date(2026, 10, 19))
+    new["per_day"]["pageviews"][-1] += 1
+    new["total_pageviews"] += 1
+    assert new["per_week"]["days"] == ["2026-10-05"]
+
+    for joined in [replicas.join(old, new), replicas.join(new, old)]:
+        assert joined["per_day"]["days"] == ["2026-10-19"]
+        assert joined["per_day"]["pageviews"] == [2]
+        assert joined["per_week"]["pageviews"] == [2]
+        assert joined["per_week"]["widgets"] == [{"Go": 4}]
+    # Value detail dropped in one version is joined as a total.
+    assert replicas._join_widgets({"Color": {"red": 2, "blue": 1}}, {"Color": 2}) == {
+        "Color": 3
+    }
@@ -0,0 +1,80 @@
+# tests/test_retention.py
+import datetime
+import time
+
+import streamlit_analytics2.retention as retention
+from streamlit_analytics2.state import history_lock
+
+
+def _history(days):
+    return {
+        "days": [str(day) for day in days],
+        "pageviews": [1 for _ in days],
+        "script_runs": [2 for _ in days],
+        "session_time_seconds": [3.0 for _ in days],
+        "widgets": [{"button": 1, "select": {"a": 1}} for _ in days],
+    }
+
+
+def _data(days):
+    return {
+        "per_day": _history(days),
+        "per_week": _history([]),
+        "per_month": _history([]),
+    }
+
+
+def test_compact_rolls_days_into_weeks_and_months():
+    today = datetime.date(2026, 10, 19)
+    days = [today - datetime.timedelta(days=i) for i in range(400, -1, -1)]
+    d = _data(days)
+    policy = {"detail_days": 30, "weekly_days": 180, "value_horizon_days": 365}
+
+    assert retention.is_due(d, today=today, **policy)
+    while retention.compact(d, today=today, **policy):
+        pass
+    assert not retention.is_due(d, today=today, **policy)
+
+    assert len(d["per_day"]["days"]) == 31
+    assert d["per_day"]["days"][-1] == str(today)
+    for history in [d["per_week"], d["per_month"]]:
+        assert history["days"] == sorted(history["days"])
+    assert datetime.date.fromisoformat(d["per_week"]["days"][0]).weekday() == 0
+    assert all(day.endswith("-01") for day in d["per_month"]["days"])
+
+    # Nothing is lost by rolling up.
+    total = sum(
+        sum(d[key]["pageviews"]) for key in ["per_day", "per_week", "per_month"]
+    )
+    assert total == len(days)
+
+    # Value detail is dropped past the horizon only.
+    assert d["per_month"]["widgets"][0]["select"] == d["per_month"]["pageviews"][0]
+    assert isinstance(d["per_week"]["widgets"][-1]["select"], dict)
+
+
+def test_compact_is_bounded_per_step():
+    today = datetime.date(2026, 10, 19)
+    days = [today - datetime.timedelta(days=i) for i in range(100, -1, -1)]
+    d = _data(days)
+
+    moved = retention.compact(d, detail_days=10, max_entries=5, today=today)
+    assert moved == 5
+    assert len(d["per_day"]["days"]) == len(days) - 5
+
+
+def test_background_compaction_waits_for_saves():
+    today = datetime.date.today()
+    days = [today - datetime.timedelta(days=i) for i in range(200, -1, -1)]
+    d = _data(days)
+
+    with history_lock:
+        retention.schedule(d, detail_days=30)
+        time.sleep(0.05)
+        # A save holding the lock sees the history as it was.
+        assert len(d["per_day"]["days"]) == 201
+    for _ in range(500):
+        if id(d) not in retention._running:
+            break
+        time.sleep(0.01)
+    assert len(d["per_day"]["days"]) == 31
@@ -0,0 +1,36 @@
+# tests/test_runlog.py
+import itertools
+import logging
+
+from streamlit_analytics2 import runlog
+from streamlit_analytics2.state import record
+
+
+def test_sampled_run_logs_its_increments(caplog, monkeypatch):
+    monkeypatch.setattr(runlog, "_runs", itertools.count())
+    caplog.set_level(logging.INFO, logger=runlog.logger.name)
+
+    runlog.start(verbose=True)
+    record(("script_runs",))
+    record(("widgets", "Go"))
+    record(("widgets", "Go"))
+    runlog.end(page="home")
+
+    [message] = [r for r in caplog.records if r.name == runlog.logger.name]
+    assert message.sa2["delta"] == {"script_runs": 1, "widgets/Go": 2}
+    assert message.sa2["page"] == "home"
+
+
+def test_one_in_n_runs_and_disabled_level(caplog, monkeypatch):
+    monkeypatch.setattr(runlog, "_runs", itertools.count())
+    caplog.set_level(logging.INFO, logger=runlog.logger.name)
+    logged = []
+    for _ in range(6):
+        runlog.start(verbose=3)
+        logged.append(runlog.sampled())
+        runlog.end()
+    assert logged == [True, False, False, True, False, False]
+
+    caplog.set_level(logging.WARNING, logger=runlog.logger.name)
+    runlog.start(verbose=True)
+    assert not runlog.sampled()
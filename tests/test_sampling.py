@@ -0,0 +1,73 @@
+# tests/test_sampling.py
+import pytest
+
+from streamlit_analytics2 import display, sampling
+from streamlit_analytics2.state import _reset
+
+
+def test_sessions_are_sampled_deterministically_at_the_rate():
+    keys = [f"session-{i}" for i in range(20000)]
+    sampled = [k for k in keys if sampling.is_sampled(k, 0.1)]
+    assert abs(len(sampled) / len(keys) - 0.1) < 0.01
+    assert sampled == [k for k in keys if sampling.is_sampled(k, 0.1)]
+    # Sessions sampled at a lower rate stay sampled at a higher one.
+    assert set(k for k in keys if sampling.is_sampled(k, 0.05)) <= set(sampled)
+    assert all(sampling.is_sampled(k, 1.0) for k in keys[:10])
+
+
+def test_estimate_and_validate():
+    assert sampling.estimate(40, 1.0) == (40, 40, 40)
+    total, low, high = sampling.estimate(100, 0.1)
+    assert total == pytest.approx(1000)
+    assert 100 <= low < total < high
+    assert high - total == pytest.approx(1.96 * (100 * 0.9) ** 0.5 / 0.1)
+    for rate in [0, -0.5, 1.5]:
+        with pytest.raises(ValueError):
+            sampling.validate(rate)
+
+
+def test_rates_are_kept_per_day():
+    rates = {}
+    sampling.record_rate(rates, "2024-01-01", 1.0)
+    assert rates == {}
+    sampling.record_rate(rates, "2024-01-05", 0.5)
+    sampling.record_rate(rates, "2024-01-06", 0.5)
+    sampling.record_rate(rates, "2024-02-01", 0.25)
+    assert rates == {"2024-01-05": 0.5, "2024-02-01": 0.25}
+    assert sampling.rate_on(rates, "2024-01-04") == 1.0
+    assert sampling.rate_on(rates, "2024-01-05") == 0.5
+    assert sampling.rate_on(rates, "2024-01-31") == 0.5
+    assert sampling.rate_on(rates, "2024-03-01") == 0.25
+
+
+def test_effective_rate_weights_counts_by_their_rate():
+    # 10 unsampled plus 10 at a half are an estimated 30.
+    rate = sampling.effective_rate([(10, 1.0), (10, 0.5)])
+    assert 20 / rate == pytest.approx(30)
+    assert sampling.effective_rate([], 0.5) == 0.5
+
+
+def test_dashboard_rates_skip_the_history_unless_sampled(monkeypatch):
+    d = {"loaded_from_firestore": False}
+    _reset(d)
+    d["per_day"]["pageviews"][-1] = 10
+    walked = []
+    weighted = display._weighted_rates
+    monkeypatch.setattr(
+        display,
+        "_weighted_rates",
+        lambda *args: walked.append(1) or weighted(*args),
+    )
+    assert display._sample_rates(d) == (1.0, dict.fromkeys(display._TRAFFIC, 1.0))
+    assert not walked
+
+    d["sample_rates"] = {d["per_day"]["days"][-1]: 0.5}
+    for _ in range(3):
+        rate, rates = display._sample_rates(d)
+    assert rate == 0.5
+    assert rates["pageviews"] == 0.5
+    # Only computed again after a save.
+    assert len(walked) == 1
+    d["save_seq"] = d.get("save_seq", 0) + 1
+    display._sample_rates(d)
+    assert len(walked) == 2
@@ -0,0 +1,54 @@
+# tests/test_schema.py
+from streamlit_analytics2 import jsonfile, schema
+from streamlit_analytics2.state import _reset
+
+
+def _old():
+    return {
+        "total_pageviews": 5,
+        "per_day": {
+            "days": ["2026-10-17", "2026-10-18", "2026-10-19"],
+            "pageviews": [1, 2, 2],
+            "script_runs": [1, 2, 2],
+            # Added in a later release, only the latest days have it.
+            "session_time_seconds": [4.0, 5.0],
+            "widgets": [{"Go": 1}],
+        },
+    }
+
+
+def test_upgrade_pads_columns_at_the_front():
+    d = schema.upgrade(_old())
+    history = d["per_day"]
+    assert list(history["session_time_seconds"]) == [0, 4.0, 5.0]
+    assert history["widgets"] == [{}, {}, {"Go": 1}]
+    assert list(history["pageviews"]) == [1, 2, 2]
+    assert d["schema_version"] == schema.VERSION
+
+
+def test_upgrade_runs_once():
+    d = schema.upgrade(_old())
+    d["per_day"]["widgets"] = [{"Go": 1}]
+    # Current data is not checked again.
+    assert schema.upgrade(d)["per_day"]["widgets"] == [{"Go": 1}]
+
+
+def test_newer_versions_are_left_alone():
+    d = {"schema_version": schema.VERSION + 1, "per_day": {"days": ["2026-10-19"]}}
+    assert schema.upgrade(d) == {
+        "schema_version": schema.VERSION + 1,
+        "per_day": {"days": ["2026-10-19"]},
+    }
+
+
+def test_json_files_are_upgraded_when_loaded(tmp_path):
+    path = tmp_path / "old.json"
+    path.write_text(
+        '{"per_day": {"days": ["2026-10-19"], "pageviews": [2], "script_runs": [2]}}'
+    )
+    d = {"loaded_from_firestore": False}
+    _reset(d)
+    jsonfile.load(path, d)
+    assert list(d["per_day"]["session_time_seconds"]) == [0]
+    assert d["per_day"]["widgets"] == [{}]
+    assert d["schema_version"] == schema.VERSION
@@ -0,0 +1,58 @@
+# tests/test_sessions.py
+import threading
+
+from streamlit_analytics2 import state
+from streamlit_analytics2.sessions import SessionStore
+
+
+def _store(**kwargs):
+    return SessionStore(lambda: {"total_pageviews": 0}, **kwargs)
+
+
+def test_least_recently_used_session_is_evicted():
+    store = _store(max_sessions=2)
+    a, created = store.get("a", now=0)
+    assert created
+    store.get("b", now=1)
+    assert store.get("a", now=2) == (a, False)
+    store.get("c", now=3)
+
+    assert store.ids() == ["a", "c"]
+    assert list(store.drain_evicted()) == ["b"]
+    assert store.drain_evicted() == {}
+
+
+def test_idle_sessions_expire_and_come_back_until_flushed():
+    store = _store(ttl_seconds=10)
+    a, _ = store.get("a", now=0)
+    a["total_pageviews"] = 3
+    store.get("b", now=5)
+    store.evict_idle(now=12)
+    assert store.ids() == ["b"]
+
+    # Not flushed yet, so its counts are not lost.
+    assert store.get("a", now=13) == (a, False)
+    store.evict_idle(now=30)
+    assert store.drain_evicted() == {"a": a, "b": {"total_pageviews": 0}}
+    assert store.get("a", now=31)[1]
+
+
+def test_session_data_is_per_script_thread():
+    first = {"total_pageviews": 0}
+    second = {"total_pageviews": 0}
+
+    def run(counters, n):
+        state.activate_session(counters)
+        for _ in range(n):
+            state.session_data["total_pageviews"] += 1
+
+    threads = [
+        threading.Thread(target=run, args=(first, 3)),
+        threading.Thread(target=run, args=(second, 5)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert first["total_pageviews"] == 3
+    assert second["total_pageviews"] == 5
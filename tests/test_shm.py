@@ -0,0 +1,76 @@
+# tests/test_shm.py
+import datetime
+import uuid
+
+import pytest
+
+from streamlit_analytics2.columnar import PerDay
+
+pytest.importorskip("fcntl")
+
+from streamlit_analytics2.shm import SharedCounters  # noqa: E402
+
+TODAY = str(datetime.date.today())
+
+
+def _data():
+    return {
+        "total_pageviews": 5,
+        "total_script_runs": 10,
+        "total_time_seconds": 1.5,
+        "per_day": PerDay(
+            {
+                "days": [TODAY],
+                "pageviews": [5],
+                "script_runs": [10],
+                "session_time_seconds": [1.5],
+                "widgets": [{"button": 2, "radio": {1: 1, 2: 0}}],
+            }
+        ),
+        "widgets": {"button": 2, "radio": {1: 1, 2: 0}},
+    }
+
+
+def test_workers_share_counts():
+    name = f"sa2-test-{uuid.uuid4().hex[:8]}"
+    first = SharedCounters(name, slots=64, heap_size=4096)
+    second = SharedCounters(name)
+    try:
+        assert first.created and not second.created
+        first.seed(_data())
+
+        for worker in [first, second]:
+            worker.observe(TODAY, ("pageviews",))
+            worker.observe(TODAY, ("session_time_seconds",), 0.25)
+            worker.observe(TODAY, ("widgets", "button"))
+            worker.observe(TODAY, ("widgets", "radio", 2))
+            worker.flush()
+
+        d = _data()
+        second.apply(d)
+        assert d["total_pageviews"] == 7
+        assert d["total_time_seconds"] == 2.0
+        assert d["widgets"] == {"button": 4, "radio": {1: 1, 2: 2}}
+        assert list(d["per_day"]["pageviews"]) == [7]
+        assert d["per_day"]["widgets"][-1]["radio"] == {1: 1, 2: 2}
+
+        # Only the creator, which loaded the stored data, persists.
+        assert first.is_leader()
+        assert not second.is_leader()
+    finally:
+        second.close()
+        first.unlink()
+        first.close()
+
+
+def test_full_segment_counts_lost_increments():
+    name = f"sa2-test-{uuid.uuid4().hex[:8]}"
+    counters = SharedCounters(name, slots=2, heap_size=4096)
+    try:
+        for i in range(3):
+            counters.observe(TODAY, ("widgets", f"button {i}"))
+        counters.flush()
+        assert counters.lost() > 0
+    finally:
+        counters.unlink()
+        counters.close()
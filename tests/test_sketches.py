@@ -0,0 +1,49 @@
+# tests/test_sketches.py
+import random
+
+import pytest
+
+from streamlit_analytics2 import sketches
+
+
+def _values(n, seed):
+    rng = random.Random(seed)
+    return [rng.lognormvariate(0, 2) * rng.choice([1, -1]) for _ in range(n)]
+
+
+def test_quantiles_within_relative_accuracy():
+    values = _values(20000, seed=1)
+    sketch = sketches.new()
+    for value in values:
+        sketches.add(sketch, value)
+
+    values.sort()
+    for q in [0.01, 0.25, 0.5, 0.9, 0.99]:
+        exact = values[int(q * (len(values) - 1))]
+        estimate = sketches.quantile(sketch, q)
+        assert abs(estimate - exact) <= 2 * sketches.ALPHA * abs(exact) + 1e-9
+    assert sketch["count"] == len(values)
+
+
+def test_merge_matches_single_sketch():
+    values = _values(5000, seed=2)
+    whole, first, second = sketches.new(), sketches.new(), sketches.new()
+    for i, value in enumerate(values):
+        sketches.add(whole, value)
+        sketches.add(first if i % 2 else second, value)
+
+    sketches.merge(first, second)
+    assert first["positive"] == whole["positive"]
+    assert first["negative"] == whole["negative"]
+    assert first["min"] == whole["min"] and first["max"] == whole["max"]
+    with pytest.raises(ValueError):
+        sketches.merge(first, sketches.new(alpha=0.05))
+
+
+def test_state_stays_bounded():
+    sketch = sketches.new(max_buckets=64)
+    for i in range(1, 100000, 7):
+        sketches.add(sketch, i * 1.001)
+    assert len(sketch["positive"]) <= 32
+    assert sketches.quantile(sketch, 1.0) == pytest.approx(sketch["max"], rel=0.02)
+    assert sketches.quantile(sketches.new(), 0.5) is None
@@ -0,0 +1,81 @@
+# tests/test_snapshots.py
+from streamlit_analytics2 import aggregates, snapshots
+from streamlit_analytics2.state import _reset
+
+
+def _data():
+    d = {"loaded_from_firestore": False}
+    _reset(d)
+    d["widgets"] = {"Go": 3, "Color": {"red": 2}}
+    d["per_day"].append_day("2026-10-19")
+    d["per_day"]["pageviews"][-1] = 4
+    d["per_day"]["widgets"][-1] = {"Go": 3}
+    return d
+
+
+def test_snapshot_does_not_follow_the_live_data():
+    d = _data()
+    snapshot, _ = snapshots.build(d)
+
+    d["total_pageviews"] += 1
+    d["widgets"]["Color"]["red"] += 1
+    d["per_day"]["pageviews"][-1] += 1
+    d["per_day"]["widgets"][-1]["Go"] += 1
+    d["per_day"].append_day("2026-10-20")
+
+    assert snapshot["total_pageviews"] == 0
+    assert snapshot["widgets"]["Color"] == {"red": 2}
+    assert list(snapshot["per_day"]["pageviews"]) == [0, 4]
+    assert snapshot["per_day"]["widgets"][-1] == {"Go": 3}
+    assert len(snapshot["per_day"]["days"]) == 2
+
+
+def test_past_rows_are_shared_and_today_is_copied():
+    d = _data()
+    first, rows = snapshots.build(d)
+    second, _ = snapshots.build(d, rows)
+
+    assert second["per_day"]["widgets"][0] is first["per_day"]["widgets"][0]
+    assert second["per_day"]["widgets"][-1] is not first["per_day"]["widgets"][-1]
+    assert second["per_day"]["widgets"][-1] == {"Go": 3}
+
+    # A new day makes yesterday a past row.
+    d["per_day"].append_day("2026-10-20")
+    third, _ = snapshots.build(d, rows)
+    assert third["per_day"]["widgets"][1] is not first["per_day"]["widgets"][1]
+
+
+def test_current_republishes_after_invalidate(monkeypatch):
+    d = _data()
+    monkeypatch.setattr(snapshots, "data", d)
+    monkeypatch.setattr(snapshots, "_published", dict(snapshots._published))
+
+    first = snapshots.current()
+    d["total_script_runs"] += 1
+    # Within max_age, new counts wait for the next snapshot.
+    assert snapshots.current(max_age=60) is first
+    assert snapshots.current(max_age=0)["total_script_runs"] == 1
+
+    d["per_day"]["widgets"][0]["Go"] = 1
+    snapshots.invalidate()
+    latest = snapshots.current(max_age=60)
+    assert latest["per_day"]["widgets"][0] == {"Go": 1}
+
+
+def test_published_aggregates_match_the_snapshot(monkeypatch):
+    d = _data()
+    monkeypatch.setattr(snapshots, "data", d)
+    monkeypatch.setattr(aggregates, "data", d)
+    monkeypatch.setattr(aggregates, "observers", [])
+    monkeypatch.setattr(snapshots, "_published", dict(snapshots._published))
+    aggregates.invalidate()
+
+    snapshot = snapshots.current()
+    d["widgets"]["Go"] += 1
+    aggregates._observe("2026-10-19", ("widgets", "Go"))
+
+    # The live aggregates moved on, the snapshot's did not.
+    assert aggregates.current()["totals"]["Go"] == 4
+    assert snapshot["aggregates"]["totals"] == {"Go": 3, "Color": 2}
+    assert snapshot["widgets"]["Go"] == 3
+    aggregates.invalidate()
@@ -0,0 +1,68 @@
+# tests/test_uploads.py
+import hashlib
+
+import pytest
+from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+
+from streamlit_analytics2 import uploads
+from streamlit_analytics2.state import activate_session
+
+
+def _file(file_id, contents):
+    return UploadedFile(UploadedFileRec(file_id, "a.csv", "text/csv", contents), None)
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    d, session = {}, {}
+    monkeypatch.setattr(uploads, "data", d)
+    activate_session(session)
+    yield d, session
+    activate_session()
+
+
+def test_identity_and_files():
+    first, second = _file("1", b"abc"), _file("2", b"abc")
+    assert uploads.identity(first) == ("1", 3)
+    assert uploads.identity(first) != uploads.identity(second)
+    assert uploads.files(None) == []
+    assert uploads.files(first) == [first]
+    assert uploads.files([first, second]) == [first, second]
+
+
+def test_digest_is_chunked_over_the_buffer():
+    contents = bytes(range(256)) * 100
+    expected = hashlib.blake2b(contents, digest_size=16).hexdigest()
+    assert uploads.digest(contents, chunk_size=1000) == expected
+
+
+def test_observe_counts_files_bytes_and_sizes(counters):
+    uploads.observe("Data", _file("1", b"x" * 100))
+    uploads.observe("Data", _file("2", b"x" * 300))
+    for d in counters:
+        stats = d["uploads"]["Data"]
+        assert (stats["files"], stats["bytes"]) == (2, 400)
+        assert stats["sizes"]["count"] == 2
+        assert stats["sizes"]["max"] == 300
+    row = uploads.summary(counters[0])[0]
+    assert (row["widget"], row["files"]) == ("Data", 2)
+    assert row["p50_bytes"] == pytest.approx(100, rel=0.02)
+
+
+def test_duplicate_contents_are_counted(counters):
+    seen = set()
+    dicts = list(counters)
+    uploads._count_duplicate(_file("1", b"same"), "Data", seen, dicts)
+    uploads._count_duplicate(_file("2", b"other"), "Data", seen, dicts)
+    uploads._count_duplicate(_file("3", b"same"), "Data", seen, dicts)
+    assert counters[0]["uploads"]["Data"]["duplicates"] == 1
+
+
+def test_merge_adds_up(counters):
+    uploads.observe("Data", _file("1", b"x" * 10))
+    other = {"Data": uploads.new(), "Other": uploads.new()}
+    other["Data"]["files"] = 2
+    merged = {"Data": dict(counters[0]["uploads"]["Data"])}
+    uploads.merge(merged, other)
+    assert merged["Data"]["files"] == 3
+    assert "Other" in merged
@@ -0,0 +1,62 @@
+# tests/test_widgets.py
+import pytest
+import streamlit as st
+from streamlit.delta_generator import DeltaGenerator
+
+from streamlit_analytics2 import state, widgets
+
+
+@pytest.fixture
+def patched():
+    widgets.monkey_patch()
+    yield
+    widgets.reset_widgets()
+
+
+def test_patches_st_sidebar_and_containers(patched):
+    method = DeltaGenerator.__dict__["checkbox"]
+    assert st.checkbox.__func__ is method
+    assert st.sidebar.checkbox.__func__ is method
+    assert st.container().toggle.__func__ is DeltaGenerator.__dict__["toggle"]
+
+
+def test_reset_restores_the_originals():
+    original = st.checkbox
+    widgets.monkey_patch()
+    widgets.reset_widgets()
+    assert st.checkbox == original
+    assert "checkbox" not in DeltaGenerator.__dict__
+
+
+def test_wrappers_are_built_once_per_configuration():
+    widgets.monkey_patch()
+    first = DeltaGenerator.__dict__["slider"]
+    widgets.monkey_patch()
+    assert DeltaGenerator.__dict__["slider"] is first
+    widgets.monkey_patch(numeric_sketches=True)
+    assert DeltaGenerator.__dict__["slider"] is not first
+    widgets.reset_widgets()
+
+
+def test_dispatcher_calls_the_original_on_its_container():
+    class Container:
+        def widget(self, label):
+            return self, label
+
+    def wrapper(func, suffix):
+        return lambda label: func(label + suffix)
+
+    Container.widget = widgets.dispatcher(Container.widget, wrapper, suffix="!")
+    container = Container()
+    state.set_tracked(True)
+    try:
+        assert container.widget("a") == (container, "a!")
+    finally:
+        state.set_tracked(False)
+    # Untracked sessions call the original directly.
+    assert container.widget("a") == (container, "a")
+
+
+def test_register_rejects_unknown_kinds():
+    with pytest.raises(ValueError):
+        widgets.register("pills", "colour")
@@ -0,0 +1,55 @@
+# tests/test_wrappers.py
+import pytest
+import streamlit as st
+
+from streamlit_analytics2 import state, wrappers
+from streamlit_analytics2.state import _reset
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    d, session = {}, {}
+    for counters in [d, session]:
+        _reset(counters)
+    monkeypatch.setattr(wrappers, "dicts", [d, session])
+    st.session_state.state_dict = {}
+    yield d, session
+    del st.session_state.state_dict
+
+
+def test_sketched_number_input_counts_none_on_its_counter(counters):
+    returned = iter([None, 5, None, 7])
+    number_input = wrappers.value(lambda label: next(returned), sketch_numbers=True)
+    for _ in range(4):
+        number_input("Amount")
+
+    for d in counters:
+        assert d["widgets"]["Amount"] == 4
+        assert d["per_day"]["widgets"][-1]["Amount"] == 4
+        # Only the numbers are in the sketch.
+        assert d["sketches"]["Amount"]["count"] == 2
+
+
+def test_exact_values_replace_a_sketched_counter(counters):
+    returned = iter([5, 7])
+    number_input = wrappers.value(lambda label: next(returned), sketch_numbers=True)
+    number_input("Amount")
+    # Tracked with exact values after `numeric_sketches` was turned off.
+    number_input = wrappers.value(lambda label: next(returned))
+    number_input("Amount")
+
+    for d in counters:
+        assert d["widgets"]["Amount"] == {7: 1}
+        assert d["per_day"]["widgets"][-1]["Amount"] == {7: 1}
+
+
+def test_state_dict_of_the_run_is_used(counters):
+    state_dict = {}
+    state.use_state_dict(state_dict)
+    try:
+        button = wrappers.button(lambda label: True)
+        button("Go")
+    finally:
+        state.use_state_dict(None)
+    assert state_dict == {"Go": True}
+    assert st.session_state.state_dict == {}